@@ -1,583 +1,827 @@
-# coding=utf-8
-# @Author    : ssss要加油哦
-import sys
-import os
-import cv2
-import re
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QPushButton, QLabel, QFileDialog, QGroupBox, QGridLayout,
-                             QMessageBox, QComboBox, QSpinBox, QProgressBar,
-                             QListWidget, QListWidgetItem)
-from PyQt5.QtGui import (QPixmap, QFont, QPainter, QPen, QColor,  QBrush)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
-
-
-class ImageProcessingThread(QThread):
-    progress_signal = pyqtSignal(int)
-    result_signal = pyqtSignal(list, list, list, list)
-
-    def __init__(self, screenshot_path, ref_dir, threshold):
-        super().__init__()
-        self.screenshot_path = screenshot_path
-        self.ref_dir = ref_dir
-        self.threshold = threshold
-
-    def run(self):
-        try:
-            screenshot_area = cv2.imread(self.screenshot_path)
-            if screenshot_area is None:
-                raise ValueError("无法加载截图图像")
-
-            ref_files = sorted([f for f in os.listdir(self.ref_dir) if f.endswith('.png')],
-                               key=self.natural_sort_key)
-            ref_pieces = []
-            ref_paths = []
-            for i, ref_file in enumerate(ref_files):
-                ref_path = os.path.join(self.ref_dir, ref_file)
-                ref_img = cv2.imread(ref_path)
-                if ref_img is None:
-                    raise ValueError(f"无法加载参考碎片: {ref_file}")
-                ref_pieces.append(ref_img)
-                ref_paths.append(ref_path)
-                self.progress_signal.emit(int((i + 1) / len(ref_files) * 30))
-
-            screenshot_gray = self.preprocess_image(screenshot_area)
-            matches = {}
-
-            for ref_idx, ref_piece in enumerate(ref_pieces):
-                ref_gray = self.preprocess_image(ref_piece)
-                h, w = screenshot_gray.shape[:2]
-                ref_resized = cv2.resize(ref_gray, (w // 4, h // 3))
-
-                result = cv2.matchTemplate(screenshot_gray, ref_resized, cv2.TM_CCOEFF_NORMED)
-                min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-
-                if max_val >= self.threshold:
-                    center_x = max_loc[0] + ref_resized.shape[1] // 2
-                    center_y = max_loc[1] + ref_resized.shape[0] // 2
-                    matches[(center_x, center_y)] = ref_idx + 1
-
-                self.progress_signal.emit(30 + int((ref_idx + 1) / len(ref_pieces) * 60))
-
-            piece_order = self.get_piece_order(screenshot_area, matches)
-            swaps, _ = self.min_swap_sort(piece_order)
-            piece_height, piece_width = ref_pieces[0].shape[:2]
-
-            self.result_signal.emit(piece_order, swaps, ref_paths, [piece_width, piece_height])
-
-        except Exception as e:
-            self.result_signal.emit([], [], [], str(e))
-
-    def natural_sort_key(self, s):
-        return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
-
-    def preprocess_image(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.equalizeHist(gray)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        return gray
-
-    def get_piece_order(self, screenshot_area, matches):
-        h, w = screenshot_area.shape[:2]
-        block_h = h // 3
-        block_w = w // 4
-        grid = [[0 for _ in range(4)] for _ in range(3)]
-        for (x, y), number in matches.items():
-            row = y // block_h
-            col = x // block_w
-            if 0 <= row < 3 and 0 <= col < 4:
-                grid[row][col] = number
-
-        piece_order = []
-        for row in grid:
-            for number in row:
-                piece_order.append(number)
-        return piece_order
-
-    def min_swap_sort(self, arr):
-        n = len(arr)
-        sorted_arr = sorted(arr)
-        pos_map = {}
-        for idx, val in enumerate(sorted_arr):
-            pos_map[val] = idx
-        target = [pos_map[x] for x in arr]
-
-        visited = [False] * n
-        cycles = []
-
-        for i in range(n):
-            if not visited[i]:
-                cycle = []
-                cur = i
-                while not visited[cur]:
-                    visited[cur] = True
-                    cycle.append(cur)
-                    cur = target[cur]
-                cycles.append(cycle)
-
-        swaps = []
-        result_arr = arr.copy()
-        for cycle in cycles:
-            if len(cycle) <= 1:
-                continue
-
-            for j in range(1, len(cycle)):
-                idx1, idx2 = cycle[0], cycle[j]
-                result_arr[idx1], result_arr[idx2] = result_arr[idx2], result_arr[idx1]
-                swaps.append((idx1, idx2))
-        return swaps, result_arr
-
-
-class PuzzleSorterApp(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("拼图碎片排序工具(By: ssss要加油哦)(B站闲话同名)")
-        self.setGeometry(100, 100, 1100, 750)
-        self.initUI()
-
-        self.screenshot_path = ""
-        self.ref_dir = ""
-        self.piece_order = []
-        self.swaps = []
-        self.current_step = 0
-        self.current_order = []
-        self.original_image = None
-        self.stitched_image = None
-        self.ref_pieces = []  # 存储所有碎片的QPixmap
-        self.piece_size = [0, 0]  # 碎片宽度和高度
-        self.drag_pos = None
-        self.highlighted_pieces = []  # 存储高亮碎片索引
-
-    def initUI(self):
-        main_widget = QWidget()
-        main_layout = QVBoxLayout()
-
-        title_label = QLabel("拼图碎片排序工具")
-        title_label.setFont(QFont("Arial", 18, QFont.Bold))
-        title_label.setAlignment(Qt.AlignCenter)
-        main_layout.addWidget(title_label)
-
-        input_group = QGroupBox("输入设置")
-        input_layout = QGridLayout()
-
-        self.screenshot_label = QLabel("未选择截图")
-        self.screenshot_label.setAcceptDrops(True)
-        self.screenshot_label.dragEnterEvent = self.dragEnterEvent
-        self.screenshot_label.dropEvent = self.dropEvent
-        screenshot_btn = QPushButton("选择截图")
-        screenshot_btn.clicked.connect(self.select_screenshot)
-
-        self.puzzle_number_label = QLabel("选择拼图:")
-        self.puzzle_number_combo = QComboBox()
-
-        puzzle_options = [
-            "第1幅图-樱花漫舞",
-            "第2幅图-雪后初晴",
-            "第3幅图-柿柿如意",
-            "第4幅图-稻谷飘香",
-            "第5幅图-春日琴韵",
-            "第6幅图-雨中嬉戏",
-            "第7幅图-暖室茶香"
-        ]
-        self.puzzle_number_combo.addItems(puzzle_options)
-        self.puzzle_number_combo.currentIndexChanged.connect(self.update_ref_dir)
-
-        self.threshold_label = QLabel("匹配阈值:")
-        self.threshold_spin = QSpinBox()
-        self.threshold_spin.setRange(40, 90)
-        self.threshold_spin.setValue(60)
-        self.threshold_spin.setSuffix("%")
-
-        input_layout.addWidget(QLabel("拼图截图:"), 0, 0)
-        input_layout.addWidget(self.screenshot_label, 0, 1)
-        input_layout.addWidget(screenshot_btn, 0, 2)
-
-        input_layout.addWidget(self.puzzle_number_label, 1, 0)
-        input_layout.addWidget(self.puzzle_number_combo, 1, 1)
-
-        input_layout.addWidget(self.threshold_label, 2, 0)
-        input_layout.addWidget(self.threshold_spin, 2, 1)
-
-        input_group.setLayout(input_layout)
-        main_layout.addWidget(input_group)
-
-        process_btn = QPushButton("处理图像")
-        process_btn.clicked.connect(self.process_image)
-        process_btn.setFont(QFont("Arial", 12))
-        main_layout.addWidget(process_btn)
-
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setRange(0, 100)
-        self.progress_bar.setVisible(False)
-        main_layout.addWidget(self.progress_bar)
-
-        result_group = QGroupBox("结果")
-        result_layout = QHBoxLayout()
-        result_layout.setStretch(0, 2)
-        result_layout.setStretch(1, 2)
-
-        image_group = QGroupBox("图像预览")
-        image_layout = QVBoxLayout()
-
-        self.original_image_label = QLabel()
-        self.original_image_label.setAlignment(Qt.AlignCenter)
-        self.original_image_label.setMinimumSize(380, 250)
-        self.original_image_label.setText("原始截图将显示在这里(可以直接把截图拖到这个地方)")
-        self.original_image_label.setAcceptDrops(True)
-        self.original_image_label.dragEnterEvent = self.dragEnterEvent
-        self.original_image_label.dropEvent = self.dropEvent
-
-        self.stitched_image_label = QLabel()
-        self.stitched_image_label.setAlignment(Qt.AlignCenter)
-        self.stitched_image_label.setMinimumSize(380, 250)
-        self.stitched_image_label.setText("拼接后的图像将显示在这里")
-        self.stitched_image_label.setMouseTracking(True)
-        self.stitched_image_label.mousePressEvent = self.mousePressEvent
-        self.stitched_image_label.mouseMoveEvent = self.mouseMoveEvent
-        self.stitched_image_label.mouseReleaseEvent = self.mouseReleaseEvent
-
-        image_layout.addWidget(QLabel("原始截像:"))
-        image_layout.addWidget(self.original_image_label)
-        image_layout.addWidget(QLabel("拼接图像:"))
-        image_layout.addWidget(self.stitched_image_label)
-        image_group.setLayout(image_layout)
-
-        text_group = QGroupBox("排序结果")
-        text_layout = QVBoxLayout()
-        text_group.setFixedWidth(400)
-
-        self.piece_order_label = QLabel("碎片顺序: ")
-        self.piece_order_label.setFont(QFont("Arial", 10))
-
-        self.steps_list = QListWidget()
-        self.steps_list.setFont(QFont("Arial", 10))
-        self.steps_list.setMinimumHeight(100)
-        self.steps_list.setMinimumWidth(380)
-
-        steps_label = QLabel("交换步骤:")
-        steps_label.setFont(QFont("Arial", 10))
-
-        self.swap_count_label = QLabel("总交换次数: 0")
-        self.swap_count_label.setFont(QFont("Arial", 10, QFont.Bold))
-
-        self.next_step_btn = QPushButton("下一步")
-        self.next_step_btn.clicked.connect(self.next_step)
-        self.next_step_btn.setEnabled(False)
-
-        text_layout.addWidget(self.piece_order_label)
-        text_layout.addWidget(steps_label)
-        text_layout.addWidget(self.steps_list)
-        text_layout.addWidget(self.swap_count_label)
-        text_layout.addWidget(self.next_step_btn)
-        text_group.setLayout(text_layout)
-
-        result_layout.addWidget(image_group)
-        result_layout.addWidget(text_group)
-        result_group.setLayout(result_layout)
-        main_layout.addWidget(result_group)
-
-        button_layout = QHBoxLayout()
-        save_result_btn = QPushButton("保存结果")
-        save_result_btn.clicked.connect(self.save_results)
-        save_image_btn = QPushButton("保存图片")
-        save_image_btn.clicked.connect(self.save_image)
-        reset_btn = QPushButton("重置")
-        reset_btn.clicked.connect(self.reset)
-        exit_btn = QPushButton("退出")
-        exit_btn.clicked.connect(self.close)
-
-        button_layout.addWidget(save_result_btn)
-        button_layout.addWidget(save_image_btn)
-        button_layout.addWidget(reset_btn)
-        button_layout.addWidget(exit_btn)
-        main_layout.addLayout(button_layout)
-
-        main_widget.setLayout(main_layout)
-        self.setCentralWidget(main_widget)
-
-    def dragEnterEvent(self, event):
-        if event.mimeData().hasUrls():
-            event.acceptProposedAction()
-
-    def dropEvent(self, event):
-        for url in event.mimeData().urls():
-            file_path = url.toLocalFile()
-            if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                self.screenshot_path = file_path
-                self.screenshot_label.setText(os.path.basename(file_path))
-                self.display_image(file_path, self.original_image_label)
-                break
-
-    def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton and hasattr(self, 'stitched_image') and self.stitched_image:
-            self.drag_pos = event.pos()
-            self.stitched_image_label.setCursor(Qt.ClosedHandCursor)
-
-    def mouseMoveEvent(self, event):
-        if event.buttons() & Qt.LeftButton and self.drag_pos:
-            pass
-
-    def mouseReleaseEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.drag_pos = None
-            self.stitched_image_label.setCursor(Qt.ArrowCursor)
-
-    def update_ref_dir(self):
-        puzzle_index = self.puzzle_number_combo.currentIndex() + 1
-        base_dir = os.getcwd()
-        self.ref_dir = os.path.join(base_dir, f"reference_patches/fig{str(puzzle_index).zfill(2)}")
-        if not os.path.exists(self.ref_dir):
-            os.makedirs(self.ref_dir, exist_ok=True)
-
-    def select_screenshot(self):
-        path, _ = QFileDialog.getOpenFileName(
-            self, "选择拼图截图", "", "图像文件 (*.png *.jpg *.jpeg *.bmp)"
-        )
-        if path:
-            self.screenshot_path = path
-            self.screenshot_label.setText(os.path.basename(path))
-            self.display_image(path, self.original_image_label)
-
-    def display_image(self, path, label):
-        pixmap = QPixmap(path)
-        if not pixmap.isNull():
-            self.original_image = pixmap.copy()
-            pixmap = pixmap.scaled(label.width(), label.height(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            label.setPixmap(pixmap)
-        else:
-            label.setText("无法加载图像")
-
-    def process_image(self):
-        if not self.screenshot_path:
-            QMessageBox.warning(self, "警告", "请先选择拼图截图")
-            return
-
-        self.update_ref_dir()
-        if not os.path.exists(self.ref_dir) or not os.listdir(self.ref_dir):
-            QMessageBox.warning(self, "警告", f"参考碎片目录不存在或为空: {self.ref_dir}")
-            return
-
-        self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
-
-        threshold = self.threshold_spin.value() / 100.0
-
-        self.worker = ImageProcessingThread(
-            self.screenshot_path,
-            self.ref_dir,
-            threshold
-        )
-        self.worker.progress_signal.connect(self.update_progress)
-        self.worker.result_signal.connect(self.handle_results)
-        self.worker.start()
-
-    def update_progress(self, value):
-        self.progress_bar.setValue(value)
-
-    def handle_results(self, piece_order, swaps, ref_paths, piece_size):
-        self.progress_bar.setVisible(False)
-
-        if not piece_order:
-            QMessageBox.critical(self, "错误", ref_paths)
-            return
-
-        self.piece_order = piece_order
-        self.swaps = swaps
-        self.current_order = piece_order.copy()
-        self.current_step = 0
-        self.piece_size = piece_size
-        self.highlighted_pieces = []
-
-        self.ref_pieces = []
-        for path in ref_paths:
-            pixmap = QPixmap(path)
-            if not pixmap.isNull():
-                pixmap = pixmap.scaled(piece_size[0], piece_size[1], Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.ref_pieces.append(pixmap)
-
-        self.create_stitched_image()
-        if self.stitched_image:
-            pixmap = self.stitched_image.scaled(
-                self.stitched_image_label.width(),
-                self.stitched_image_label.height(),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            self.stitched_image_label.setPixmap(pixmap)
-
-        self.piece_order_label.setText(f"碎片顺序: {piece_order}")
-
-        self.steps_list.clear()
-        for step, (idx1, idx2) in enumerate(swaps, 1):
-            item = QListWidgetItem(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}")
-            item.setData(Qt.UserRole, (idx1, idx2))
-            self.steps_list.addItem(item)
-
-        self.swap_count_label.setText(f"总交换次数: {len(swaps)}")
-        self.next_step_btn.setEnabled(len(swaps) > 0)
-
-    def create_stitched_image(self):
-        if not self.ref_pieces or len(self.ref_pieces) < 12:
-            return
-
-        width = self.piece_size[0] * 4
-        height = self.piece_size[1] * 3
-        stitched_image = QPixmap(width, height)
-        stitched_image.fill(Qt.transparent)
-
-        painter = QPainter(stitched_image)
-        painter.setRenderHint(QPainter.Antialiasing)
-
-        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-        for i, piece_idx in enumerate(self.current_order):
-            if piece_idx < 1 or piece_idx > len(self.ref_pieces):
-                continue
-
-            row = i // 4
-            col = i % 4
-            x = col * self.piece_size[0]
-            y = row * self.piece_size[1]
-
-            painter.drawPixmap(x, y, self.ref_pieces[piece_idx - 1])
-
-            if i in self.highlighted_pieces:
-                highlight_color = QColor(255, 0, 0, 180)
-                painter.setBrush(QBrush(highlight_color))
-                painter.drawRect(x, y, self.piece_size[0], self.piece_size[1])
-                pen = QPen(QColor(255, 0, 0))
-                pen.setWidth(3)
-                painter.setPen(pen)
-                painter.drawRect(x, y, self.piece_size[0], self.piece_size[1])
-
-        painter.end()
-        self.stitched_image = stitched_image
-
-    def next_step(self):
-        if self.current_step < len(self.swaps):
-            idx1, idx2 = self.swaps[self.current_step]
-            self.highlighted_pieces = [idx1, idx2]
-            self.current_order[idx1], self.current_order[idx2] = self.current_order[idx2], self.current_order[idx1]
-            self.create_stitched_image()
-            if self.stitched_image:
-                pixmap = self.stitched_image.scaled(
-                    self.stitched_image_label.width(),
-                    self.stitched_image_label.height(),
-                    Qt.KeepAspectRatio,
-                    Qt.SmoothTransformation
-                )
-                self.stitched_image_label.setPixmap(pixmap)
-
-            self.current_step += 1
-            self.piece_order_label.setText(f"当前碎片顺序: {self.current_order}")
-            self.swap_count_label.setText(f"已完成交换: {self.current_step}/{len(self.swaps)}")
-            self.highlight_current_step()
-
-            if self.current_step >= len(self.swaps):
-                self.next_step_btn.setEnabled(False)
-                QMessageBox.information(self, "完成", "所有交换步骤已完成！")
-            QTimer.singleShot(1000, self.clear_highlight)
-
-    def highlight_current_step(self):
-        for i in range(self.steps_list.count()):
-            item = self.steps_list.item(i)
-            item.setBackground(Qt.transparent)
-
-        if self.current_step > 0 and self.current_step - 1 < self.steps_list.count():
-            current_step_item = self.steps_list.item(self.current_step - 1)
-
-            highlight_color = QColor(255, 200, 200, 200)
-            current_step_item.setBackground(highlight_color)
-
-            self.steps_list.scrollToItem(current_step_item)
-
-    def clear_highlight(self):
-        self.highlighted_pieces = []
-        self.create_stitched_image()
-
-        if self.stitched_image:
-            pixmap = self.stitched_image.scaled(
-                self.stitched_image_label.width(),
-                self.stitched_image_label.height(),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            self.stitched_image_label.setPixmap(pixmap)
-
-        self.highlight_current_step()
-
-    def save_results(self):
-        if not hasattr(self, 'piece_order') or not self.piece_order:
-            QMessageBox.warning(self, "警告", "没有可保存的结果")
-            return
-
-        options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getSaveFileName(
-            self, "保存结果", "", "文本文件 (*.txt);;所有文件 (*)", options=options
-        )
-
-        if file_path:
-            try:
-                with open(file_path, 'w') as f:
-                    f.write("拼图碎片排序结果\n")
-                    f.write("=" * 30 + "\n\n")
-                    f.write(f"原始图像: {os.path.basename(self.screenshot_path)}\n")
-                    f.write(f"参考碎片目录: {os.path.basename(self.ref_dir)}\n")
-                    f.write(f"匹配阈值: {self.threshold_spin.value()}%\n\n")
-                    f.write(f"初始碎片顺序: {self.piece_order}\n")
-                    f.write(f"当前碎片顺序: {self.current_order}\n\n")
-                    f.write("交换步骤:\n")
-                    for step, (idx1, idx2) in enumerate(self.swaps, 1):
-                        f.write(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}\n")
-                    f.write(f"\n总交换次数: {len(self.swaps)}\n")
-                    f.write(f"已完成交换: {self.current_step}\n")
-
-                QMessageBox.information(self, "成功", "结果已保存")
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"保存失败: {str(e)}")
-
-    def save_image(self):
-        if not hasattr(self, 'stitched_image') or not self.stitched_image:
-            QMessageBox.warning(self, "警告", "没有可保存的图像")
-            return
-
-        options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getSaveFileName(
-            self, "保存图像", "", "PNG图像 (*.png);;JPEG图像 (*.jpg *.jpeg);;所有文件 (*)", options=options
-        )
-
-        if file_path:
-            try:
-                self.stitched_image.save(file_path)
-                QMessageBox.information(self, "成功", "图像已保存")
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"保存失败: {str(e)}")
-
-    def reset(self):
-        self.screenshot_path = ""
-        self.ref_dir = ""
-        self.screenshot_label.setText("未选择截图")
-        self.original_image_label.clear()
-        self.stitched_image_label.clear()
-        self.piece_order_label.setText("碎片顺序: ")
-
-        self.steps_list.clear()
-        self.swap_count_label.setText("总交换次数: 0")
-        self.threshold_spin.setValue(60)
-        self.progress_bar.setVisible(False)
-        self.current_step = 0
-        self.current_order = []
-        self.stitched_image = None
-        self.original_image = None
-        self.ref_pieces = []
-        self.piece_size = [0, 0]
-        self.next_step_btn.setEnabled(False)
-        self.puzzle_number_combo.setCurrentIndex(0)
-        self.highlighted_pieces = []
-
-
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = PuzzleSorterApp()
-    window.show()
-    sys.exit(app.exec_())
-
+# coding=utf-8
+# @Author    : ssss要加油哦
+import sys
+import os
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+                             QPushButton, QLabel, QFileDialog, QGroupBox, QGridLayout,
+                             QMessageBox, QComboBox, QSpinBox, QProgressBar, QCheckBox,
+                             QListWidget, QListWidgetItem)
+from PyQt5.QtGui import (QPixmap, QFont, QPainter, QPen, QColor,  QBrush, QImageReader, QImage)
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QRect
+
+import profiler
+from puzzle_core import (get_piece_order, min_swap_sort, discover_figures, figure_path, figure_name, is_figure_pack,
+                         reference_sources)
+
+# 原有碎片目录的拼图名称；图包自带名称，新增的图不需要改这里
+FIGURE_NAMES = {
+    '01': "樱花漫舞",
+    '02': "雪后初晴",
+    '03': "柿柿如意",
+    '04': "稻谷飘香",
+    '05': "春日琴韵",
+    '06': "雨中嬉戏",
+    '07': "暖室茶香",
+}
+
+
+def pack_piece_image(ref_dir, index):
+    # 图包中第 index 个碎片(BGR 数组)转换为 QImage
+    from figure_pack import get_figure_pack
+    piece = get_figure_pack(ref_dir).pieces[index]
+    h, w = piece.shape[:2]
+    return QImage(piece.tobytes(), w, h, 3 * w, QImage.Format_RGB888).rgbSwapped()
+
+
+class ImageProcessingThread(QThread):
+    progress_signal = pyqtSignal(int)
+    result_signal = pyqtSignal(list, list, list, list, list)
+    session_signal = pyqtSignal(object, list, bool)  # (连续截图会话, 重新识别的格子, 是否只识别了变化的格子)
+    margins_signal = pyqtSignal(list, list)  # (每个格子的置信度, 置信度偏低需要核对的位置)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, screenshot_path, ref_dir, threshold, pyramid_levels=0, workers=1, auto_crop=False,
+                 use_cache=True, swap_mode=('cycles', 'count'), continuous=False, session=None):
+        super().__init__()
+        # 连续截图：沿用上一张截图的会话，只重新识别有变化的格子；第一张截图时 session 为 None
+        # 每个线程在会话的副本上识别，界面只通过 session_signal 采用它，被取消的线程不会改动界面持有的会话
+        self.continuous = continuous
+        self.session = copy.copy(session)
+        self.swap_mode = swap_mode  # (交换规划方式, 交换代价)
+        self.use_cache = use_cache
+        self.auto_crop = auto_crop
+        self.screenshot_path = screenshot_path
+        self.ref_dir = ref_dir
+        self.threshold = threshold
+        self.pyramid_levels = pyramid_levels
+        self.workers = max(1, workers)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            # OpenCV 等图像处理相关的库在第一次处理截图时才在工作线程中导入，界面启动更快
+            from template_bank import get_template_bank, file_sha1
+            from result_cache import get_result_cache, make_key
+            from board_locator import crop_board
+            from memory_budget import load_screenshot
+
+            cache_key = None
+            if self.use_cache and not self.continuous and os.path.isfile(self.screenshot_path):
+                # 同一张截图重复处理(例如重置后再次处理)时直接使用缓存的结果；连续截图时要更新会话，不使用缓存
+                with profiler.span('cache_lookup') as span_args:
+                    cache_key = make_key(file_sha1(self.screenshot_path), self.ref_dir, pipeline='gui',
+                                         threshold=self.threshold, pyramid_levels=self.pyramid_levels,
+                                         auto_crop=self.auto_crop, swap_mode=list(self.swap_mode))
+                    cached = get_result_cache().get(cache_key)
+                    span_args['hit'] = cached is not None
+                if cached is not None:
+                    self.progress_signal.emit(100)
+                    self.emit_margins(cached.get('margins') or [])
+                    self.result_signal.emit(cached['piece_order'], cached['swaps'], cached['ref_paths'],
+                                            cached['piece_size'], cached['grid'])
+                    return
+
+            # 参考碎片从模板缓存加载，已预处理好的灰度模板无需重复解码
+            with profiler.span('load_templates', ref_dir=self.ref_dir):
+                bank = get_template_bank(self.ref_dir)
+            if not len(bank):
+                raise ValueError("参考碎片目录为空")
+
+            # 界面只需要碎片顺序，高分辨率截图直接缩小解码到不低于参考碎片的分辨率
+            # 未裁剪的截图中拼图区域只占一部分，留出一倍余量
+            board_w, board_h = bank.board_size
+            min_size = (board_w * 2, board_h * 2) if self.auto_crop else (board_w, board_h)
+            with profiler.span('load_image', path=self.screenshot_path) as span_args:
+                screenshot_area, span_args['scale'] = load_screenshot(self.screenshot_path, min_size, reduce=True)
+            if screenshot_area is None:
+                raise ValueError("无法加载截图图像")
+            # 图包只有一个文件，界面按碎片名计数，显示时从图包中取碎片
+            ref_paths = list(bank.pack.piece_names) if bank.pack is not None else list(bank.ref_paths)
+            if self.auto_crop:
+                # 未裁剪的整屏截图先定位拼图区域
+                with profiler.span('crop_board'):
+                    screenshot_area, _ = crop_board(screenshot_area, bank)
+            self.progress_signal.emit(30)
+
+            planner, cost = self.swap_mode
+            if self.continuous:
+                from solve_session import SolveSession
+                if self.session is None:
+                    self.session = SolveSession(bank, plan_options={'planner': planner, 'cost': cost})
+                result = self.session.solve(screenshot_area, lambda area: self.solve_board(area, bank))
+                if self.cancelled:
+                    return
+                piece_order, swaps, margins = result['order'], result['swaps'], result['margins']
+                self.session_signal.emit(self.session, result['changed'], result['incremental'])
+            else:
+                piece_order, margins = self.solve_board(screenshot_area, bank)
+                if self.cancelled:
+                    return
+                swaps, _ = min_swap_sort(piece_order, planner=planner, cols=bank.cols, cost=cost)
+            self.progress_signal.emit(90)
+            margins = list(margins or [])
+            self.emit_margins(margins)
+            piece_width, piece_height = bank.piece_sizes[0]
+
+            if cache_key is not None:
+                get_result_cache().put(cache_key, {
+                    'piece_order': piece_order,
+                    'swaps': [list(swap) for swap in swaps],
+                    'ref_paths': ref_paths,
+                    'piece_size': [piece_width, piece_height],
+                    'grid': [bank.rows, bank.cols],
+                    'margins': margins,
+                })
+            self.result_signal.emit(piece_order, swaps, ref_paths, [piece_width, piece_height], [bank.rows, bank.cols])
+
+        except Exception as e:
+            if not self.cancelled:
+                self.error_signal.emit(str(e))
+
+    def emit_margins(self, margins):
+        from cell_matcher import MIN_MARGIN
+        self.margins_signal.emit(margins, [i for i, margin in enumerate(margins) if margin < MIN_MARGIN])
+
+    def report_refine_progress(self, done, total):
+        # 不确定格子的窗口内匹配占 30~90 的进度
+        self.progress_signal.emit(30 + 60 * done // total)
+
+    def solve_board(self, screenshot_area, bank):
+        # 整幅匹配，返回 (碎片顺序, 每个格子的置信度)；取消时在不确定格子之间抛出 MatchCancelled
+        from image_core import preprocess_image
+        from cell_matcher import resolve_cells
+        with profiler.span('preprocess'):
+            screenshot_gray = preprocess_image(screenshot_area)
+            h, w = screenshot_gray.shape[:2]
+            ref_templates = bank.resized((w // bank.cols, h // bank.rows))
+
+        # 先用整格相关系数快速分配；最佳与次佳差距太小或匹配度低于阈值的格子，才在线程池中做窗口内模板匹配
+        # 低于阈值的碎片不再直接丢弃，每个格子都会分配到唯一的碎片
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            piece_scores, margins = resolve_cells(screenshot_gray, ref_templates, bank.rows, bank.cols, escalate=True,
+                                                  pyramid_levels=self.pyramid_levels, min_score=self.threshold,
+                                                  executor=pool, progress=self.report_refine_progress,
+                                                  cancelled=lambda: self.cancelled)
+        matches = {center: ref_idx + 1 for ref_idx, (_, center) in enumerate(piece_scores) if center is not None}
+        return get_piece_order(screenshot_gray, matches, bank.rows, bank.cols), margins
+
+
+# 拼接图像的显示控件：碎片画在显示尺寸的画布上，交换时只重画两个格子，高亮框在 paintEvent 中叠加绘制，不改动画布
+class StitchedImageView(QLabel):
+    def __init__(self):
+        super().__init__()
+        self.canvas = None
+        self.cell_size = (0, 0)
+        self.grid = (3, 4)
+        self.highlighted = []
+
+    def set_canvas(self, canvas, cell_size, grid):
+        self.canvas = canvas
+        self.cell_size = cell_size
+        self.grid = grid
+        self.highlighted = []
+        self.update()
+
+    def clear_canvas(self):
+        self.canvas = None
+        self.highlighted = []
+        self.clear()
+
+    def canvas_origin(self):
+        # 画布在控件中居中显示
+        return (self.width() - self.canvas.width()) // 2, (self.height() - self.canvas.height()) // 2
+
+    def cell_rect(self, index):
+        x0, y0 = self.canvas_origin()
+        cell_w, cell_h = self.cell_size
+        row, col = divmod(index, self.grid[1])
+        return QRect(x0 + col * cell_w, y0 + row * cell_h, cell_w, cell_h)
+
+    def update_cells(self, indices):
+        if self.canvas is None:
+            return
+        for index in indices:
+            self.update(self.cell_rect(index))
+
+    def set_highlight(self, indices):
+        old = self.highlighted
+        self.highlighted = list(indices)
+        if self.canvas is not None:
+            self.update_cells(set(old) | set(self.highlighted))
+
+    def paintEvent(self, event):
+        if self.canvas is None:
+            super().paintEvent(event)
+            return
+        painter = QPainter(self)
+        x0, y0 = self.canvas_origin()
+        painter.drawPixmap(x0, y0, self.canvas)
+        pen = QPen(QColor(255, 0, 0))
+        pen.setWidth(3)
+        painter.setPen(pen)
+        painter.setBrush(QBrush(QColor(255, 0, 0, 180)))
+        for index in self.highlighted:
+            painter.drawRect(self.cell_rect(index))
+        painter.end()
+
+
+class PuzzleSorterApp(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("拼图碎片排序工具(By: ssss要加油哦)(B站闲话同名)")
+        self.setGeometry(100, 100, 1100, 750)
+        self.initUI()
+
+        self.screenshot_path = ""
+        self.ref_dir = ""
+        self.piece_order = []
+        self.swaps = []
+        self.current_step = 0
+        self.current_order = []
+        self.original_image = None
+        self.stitched_image = None  # 显示尺寸的拼接画布
+        self.ref_paths = []
+        self.ref_pieces = []  # 存储所有碎片缩放到显示尺寸后的QPixmap
+        self.cell_size = (0, 0)  # 显示时每个格子的宽度和高度
+        self.piece_size = [0, 0]  # 碎片宽度和高度
+        self.grid = [3, 4]  # 拼图行数和列数
+        self.drag_pos = None
+        self.highlighted_pieces = []  # 存储高亮碎片索引
+        self.worker = None
+        self.cancelled_workers = []  # 已取消但还没结束的工作线程，结束前保留引用
+        self.margins = []  # 每个格子的置信度
+        self.low_margin_cells = []  # 置信度偏低、需要核对的位置
+        self.session = None  # 连续截图的会话，同一局拼图的截图之间保留上一次的棋盘
+        self.session_key = None  # 会话对应的 (参考碎片目录, 交换方式, 是否自动裁剪)，任何一个变了都重新开始
+        self.session_changes = None
+
+    def initUI(self):
+        main_widget = QWidget()
+        main_layout = QVBoxLayout()
+
+        title_label = QLabel("拼图碎片排序工具")
+        title_label.setFont(QFont("Arial", 18, QFont.Bold))
+        title_label.setAlignment(Qt.AlignCenter)
+        main_layout.addWidget(title_label)
+
+        input_group = QGroupBox("输入设置")
+        input_layout = QGridLayout()
+
+        self.screenshot_label = QLabel("未选择截图")
+        self.screenshot_label.setAcceptDrops(True)
+        self.screenshot_label.dragEnterEvent = self.dragEnterEvent
+        self.screenshot_label.dropEvent = self.dropEvent
+        screenshot_btn = QPushButton("选择截图")
+        screenshot_btn.clicked.connect(self.select_screenshot)
+
+        self.puzzle_number_label = QLabel("选择拼图:")
+        self.puzzle_number_combo = QComboBox()
+
+        # 拼图列表来自 reference_patches 下的碎片目录和图包
+        figures = discover_figures(os.path.join(os.getcwd(), "reference_patches"))
+        for figure_label, ref_dir in figures.items():
+            name = figure_name(ref_dir) or FIGURE_NAMES.get(figure_label)
+            text = f"第{int(figure_label)}幅图-{name}" if name else f"第{int(figure_label)}幅图"
+            self.puzzle_number_combo.addItem(text, ref_dir)
+        self.auto_figure_index = len(figures)
+        self.puzzle_number_combo.addItem("自动识别")
+        self.puzzle_number_combo.currentIndexChanged.connect(self.update_ref_dir)
+
+        self.threshold_label = QLabel("匹配阈值:")
+        self.threshold_spin = QSpinBox()
+        self.threshold_spin.setRange(40, 90)
+        self.threshold_spin.setValue(60)
+        self.threshold_spin.setSuffix("%")
+
+        # 金字塔层数：先在缩小的截图上定位，再在原图小窗口内精确匹配，-1 表示按截图大小自动选择
+        self.pyramid_label = QLabel("金字塔层数:")
+        self.pyramid_spin = QSpinBox()
+        self.pyramid_spin.setRange(-1, 4)
+        self.pyramid_spin.setValue(0)
+        self.pyramid_spin.setSpecialValueText("自动")
+
+        self.workers_label = QLabel("并行线程数:")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, os.cpu_count() or 1)
+        self.workers_spin.setValue(min(4, os.cpu_count() or 1))
+
+        # 交换方式：最少交换次数，或者按两个格子的距离计算代价、优先交换相邻的碎片
+        self.swap_mode_label = QLabel("交换方式:")
+        self.swap_mode_combo = QComboBox()
+        self.swap_mode_combo.addItem("最少交换次数", ('cycles', 'count'))
+        self.swap_mode_combo.addItem("最短移动距离", ('astar', 'distance'))
+
+        self.auto_crop_check = QCheckBox("自动裁剪拼图区域(截图未裁剪时勾选)")
+        # 边拼边截图时勾选：保留上一张截图的结果，只重新识别有变化的格子，交换步骤从剩下的继续
+        self.continuous_check = QCheckBox("连续截图(只重新识别有变化的格子)")
+        input_layout.addWidget(QLabel("拼图截图:"), 0, 0)
+        input_layout.addWidget(self.screenshot_label, 0, 1)
+        input_layout.addWidget(screenshot_btn, 0, 2)
+
+        input_layout.addWidget(self.puzzle_number_label, 1, 0)
+        input_layout.addWidget(self.puzzle_number_combo, 1, 1)
+
+        input_layout.addWidget(self.threshold_label, 2, 0)
+        input_layout.addWidget(self.threshold_spin, 2, 1)
+
+        input_layout.addWidget(self.pyramid_label, 3, 0)
+        input_layout.addWidget(self.pyramid_spin, 3, 1)
+
+        input_layout.addWidget(self.workers_label, 4, 0)
+        input_layout.addWidget(self.workers_spin, 4, 1)
+
+        input_layout.addWidget(self.swap_mode_label, 5, 0)
+        input_layout.addWidget(self.swap_mode_combo, 5, 1)
+
+        input_layout.addWidget(self.auto_crop_check, 6, 1)
+        input_layout.addWidget(self.continuous_check, 7, 1)
+
+        input_group.setLayout(input_layout)
+        main_layout.addWidget(input_group)
+
+        process_btn = QPushButton("处理图像")
+        process_btn.clicked.connect(self.process_image)
+        process_btn.setFont(QFont("Arial", 12))
+        main_layout.addWidget(process_btn)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setVisible(False)
+        main_layout.addWidget(self.progress_bar)
+
+        result_group = QGroupBox("结果")
+        result_layout = QHBoxLayout()
+        result_layout.setStretch(0, 2)
+        result_layout.setStretch(1, 2)
+
+        image_group = QGroupBox("图像预览")
+        image_layout = QVBoxLayout()
+
+        self.original_image_label = QLabel()
+        self.original_image_label.setAlignment(Qt.AlignCenter)
+        self.original_image_label.setMinimumSize(380, 250)
+        self.original_image_label.setText("原始截图将显示在这里(可以直接把截图拖到这个地方)")
+        self.original_image_label.setAcceptDrops(True)
+        self.original_image_label.dragEnterEvent = self.dragEnterEvent
+        self.original_image_label.dropEvent = self.dropEvent
+
+        self.stitched_image_label = StitchedImageView()
+        self.stitched_image_label.setAlignment(Qt.AlignCenter)
+        self.stitched_image_label.setMinimumSize(380, 250)
+        self.stitched_image_label.setText("拼接后的图像将显示在这里")
+        self.stitched_image_label.setMouseTracking(True)
+        self.stitched_image_label.mousePressEvent = self.mousePressEvent
+        self.stitched_image_label.mouseMoveEvent = self.mouseMoveEvent
+        self.stitched_image_label.mouseReleaseEvent = self.mouseReleaseEvent
+
+        image_layout.addWidget(QLabel("原始截像:"))
+        image_layout.addWidget(self.original_image_label)
+        image_layout.addWidget(QLabel("拼接图像:"))
+        image_layout.addWidget(self.stitched_image_label)
+        image_group.setLayout(image_layout)
+
+        text_group = QGroupBox("排序结果")
+        text_layout = QVBoxLayout()
+        text_group.setFixedWidth(400)
+
+        self.piece_order_label = QLabel("碎片顺序: ")
+        self.piece_order_label.setFont(QFont("Arial", 10))
+
+        self.steps_list = QListWidget()
+        self.steps_list.setFont(QFont("Arial", 10))
+        self.steps_list.setMinimumHeight(100)
+        self.steps_list.setMinimumWidth(380)
+
+        steps_label = QLabel("交换步骤:")
+        steps_label.setFont(QFont("Arial", 10))
+
+        self.swap_count_label = QLabel("总交换次数: 0")
+        self.swap_count_label.setFont(QFont("Arial", 10, QFont.Bold))
+
+        self.next_step_btn = QPushButton("下一步")
+        self.next_step_btn.clicked.connect(self.next_step)
+        self.next_step_btn.setEnabled(False)
+
+        text_layout.addWidget(self.piece_order_label)
+        text_layout.addWidget(steps_label)
+        text_layout.addWidget(self.steps_list)
+        text_layout.addWidget(self.swap_count_label)
+        text_layout.addWidget(self.next_step_btn)
+        text_group.setLayout(text_layout)
+
+        result_layout.addWidget(image_group)
+        result_layout.addWidget(text_group)
+        result_group.setLayout(result_layout)
+        main_layout.addWidget(result_group)
+
+        button_layout = QHBoxLayout()
+        save_result_btn = QPushButton("保存结果")
+        save_result_btn.clicked.connect(self.save_results)
+        save_image_btn = QPushButton("保存图片")
+        save_image_btn.clicked.connect(self.save_image)
+        reset_btn = QPushButton("重置")
+        reset_btn.clicked.connect(self.reset)
+        exit_btn = QPushButton("退出")
+        exit_btn.clicked.connect(self.close)
+
+        button_layout.addWidget(save_result_btn)
+        button_layout.addWidget(save_image_btn)
+        button_layout.addWidget(reset_btn)
+        button_layout.addWidget(exit_btn)
+        main_layout.addLayout(button_layout)
+
+        main_widget.setLayout(main_layout)
+        self.setCentralWidget(main_widget)
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+
+    def dropEvent(self, event):
+        for url in event.mimeData().urls():
+            file_path = url.toLocalFile()
+            if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+                self.screenshot_path = file_path
+                self.screenshot_label.setText(os.path.basename(file_path))
+                self.display_image(file_path, self.original_image_label)
+                break
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and hasattr(self, 'stitched_image') and self.stitched_image:
+            self.drag_pos = event.pos()
+            self.stitched_image_label.setCursor(Qt.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton and self.drag_pos:
+            pass
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_pos = None
+            self.stitched_image_label.setCursor(Qt.ArrowCursor)
+
+    def update_ref_dir(self):
+        self.puzzle_number_label.setText("选择拼图:")
+        if self.puzzle_number_combo.currentIndex() == self.auto_figure_index:
+            # 自动识别时在处理图像前根据截图决定参考碎片目录
+            self.ref_dir = ""
+            return
+        self.ref_dir = self.puzzle_number_combo.currentData() or ""
+
+    def select_screenshot(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, "选择拼图截图", "", "图像文件 (*.png *.jpg *.jpeg *.bmp)"
+        )
+        if path:
+            self.screenshot_path = path
+            self.screenshot_label.setText(os.path.basename(path))
+            self.display_image(path, self.original_image_label)
+
+    def display_image(self, path, label):
+        pixmap = QPixmap(path)
+        if not pixmap.isNull():
+            self.original_image = pixmap.copy()
+            pixmap = pixmap.scaled(label.width(), label.height(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            label.setPixmap(pixmap)
+        else:
+            label.setText("无法加载图像")
+
+    def process_image(self):
+        if not self.screenshot_path:
+            QMessageBox.warning(self, "警告", "请先选择拼图截图")
+            return
+
+        self.update_ref_dir()
+        if self.puzzle_number_combo.currentIndex() == self.auto_figure_index:
+            if not self.detect_ref_dir():
+                return
+        if not self.ref_dir or not reference_sources(self.ref_dir):
+            QMessageBox.warning(self, "警告", f"参考碎片目录不存在或为空: {self.ref_dir}")
+            return
+
+        # 上一次处理还没结束时先取消，避免两个任务同时运行
+        self.cancel_worker()
+
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+
+        threshold = self.threshold_spin.value() / 100.0
+        pyramid_levels = self.pyramid_spin.value()
+        if pyramid_levels < 0:
+            pyramid_levels = 'auto'
+
+        continuous = self.continuous_check.isChecked()
+        session_key = (self.ref_dir, self.swap_mode_combo.currentData(), self.auto_crop_check.isChecked())
+        if not continuous or session_key != self.session_key:
+            self.session = None
+        self.session_key = session_key
+        self.session_changes = None
+        self.margins = []
+        self.low_margin_cells = []
+
+        self.worker = ImageProcessingThread(
+            self.screenshot_path,
+            self.ref_dir,
+            threshold,
+            pyramid_levels,
+            self.workers_spin.value(),
+            self.auto_crop_check.isChecked(),
+            swap_mode=self.swap_mode_combo.currentData(),
+            continuous=continuous,
+            session=self.session
+        )
+        self.worker.progress_signal.connect(self.update_progress)
+        self.worker.session_signal.connect(self.update_session)
+        self.worker.margins_signal.connect(self.update_margins)
+        self.worker.result_signal.connect(self.handle_results)
+        self.worker.error_signal.connect(self.handle_error)
+        self.worker.start()
+
+    def detect_ref_dir(self):
+        import cv2
+        from figure_index import identify_figure
+        screenshot_area = cv2.imread(self.screenshot_path)
+        if screenshot_area is None:
+            QMessageBox.warning(self, "警告", "无法加载截图图像")
+            return False
+        ref_root = os.path.join(os.getcwd(), "reference_patches")
+        figure_label, _ = identify_figure(screenshot_area, ref_root, self.auto_crop_check.isChecked())
+        if figure_label is None:
+            QMessageBox.warning(self, "警告", f"参考碎片目录不存在或为空: {ref_root}")
+            return False
+        self.ref_dir = figure_path(ref_root, figure_label)
+        self.puzzle_number_label.setText(f"选择拼图(识别为第{int(figure_label)}幅):")
+        return True
+
+    def cancel_worker(self):
+        if self.worker is None:
+            return
+        self.worker.progress_signal.disconnect(self.update_progress)
+        self.worker.session_signal.disconnect(self.update_session)
+        self.worker.margins_signal.disconnect(self.update_margins)
+        self.worker.result_signal.disconnect(self.handle_results)
+        self.worker.error_signal.disconnect(self.handle_error)
+        if self.worker.isRunning():
+            # 不在界面线程中等待：工作线程在下一个不确定格子前停下，结束后再释放
+            worker = self.worker
+            worker.cancel()
+            self.cancelled_workers.append(worker)
+            worker.finished.connect(lambda: self.cancelled_workers.remove(worker))
+        self.worker = None
+
+    def update_progress(self, value):
+        self.progress_bar.setValue(value)
+
+    def update_margins(self, margins, low_margin_cells):
+        self.margins = margins
+        self.low_margin_cells = low_margin_cells
+
+    def update_session(self, session, changed, incremental):
+        self.session = session
+        self.session_changes = (changed, incremental)
+
+    def handle_error(self, message):
+        self.progress_bar.setVisible(False)
+        QMessageBox.critical(self, "错误", message)
+
+    def handle_results(self, piece_order, swaps, ref_paths, piece_size, grid):
+        self.progress_bar.setVisible(False)
+
+        self.piece_order = piece_order
+        self.swaps = swaps
+        self.current_order = piece_order.copy()
+        self.current_step = 0
+        self.piece_size = piece_size
+        self.grid = grid
+        self.highlighted_pieces = []
+
+        self.ref_paths = ref_paths
+        self.load_display_pieces()
+        self.create_stitched_image()
+
+        notes = []
+        if self.session_changes is not None and self.session_changes[1]:
+            changed = len(self.session_changes[0])
+            notes.append(f"只重新识别了 {changed} 个有变化的格子" if changed else "与上一张截图相同")
+        if self.low_margin_cells:
+            notes.append(f"位置 {', '.join(str(i + 1) for i in self.low_margin_cells)} 置信度偏低，请核对")
+        self.piece_order_label.setText(f"碎片顺序: {piece_order}" + (f"({'；'.join(notes)})" if notes else ""))
+        # 鼠标悬停时显示每个位置的置信度(最佳与次佳匹配度之差)
+        self.piece_order_label.setToolTip("\n".join(f"位置 {i + 1}: {margin:.3f}"
+                                                   for i, margin in enumerate(self.margins)))
+
+        self.steps_list.clear()
+        for step, (idx1, idx2) in enumerate(swaps, 1):
+            item = QListWidgetItem(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}")
+            item.setData(Qt.UserRole, (idx1, idx2))
+            self.steps_list.addItem(item)
+
+        self.swap_count_label.setText(f"总交换次数: {len(swaps)}")
+        self.next_step_btn.setEnabled(len(swaps) > 0)
+
+    def load_display_pieces(self):
+        # 碎片只在得到结果时按显示尺寸缩放一次，之后每一步直接绘制缓存的小图
+        rows, cols = self.grid
+        piece_w, piece_h = self.piece_size
+        label = self.stitched_image_label
+        scale = min(label.width() / (cols * piece_w), label.height() / (rows * piece_h))
+        self.cell_size = (max(1, int(piece_w * scale)), max(1, int(piece_h * scale)))
+        self.ref_pieces = []
+        if is_figure_pack(self.ref_dir):
+            for index in range(len(self.ref_paths)):
+                image = pack_piece_image(self.ref_dir, index)
+                self.ref_pieces.append(QPixmap.fromImage(
+                    image.scaled(self.cell_size[0], self.cell_size[1], Qt.KeepAspectRatio, Qt.SmoothTransformation)))
+            return
+        for path in self.ref_paths:
+            # 按显示尺寸解码，不在内存中保留原尺寸的碎片图
+            reader = QImageReader(path)
+            size = reader.size()
+            if size.isValid():
+                size.scale(self.cell_size[0], self.cell_size[1], Qt.KeepAspectRatio)
+                reader.setScaledSize(size)
+            image = reader.read()
+            if not image.isNull():
+                self.ref_pieces.append(QPixmap.fromImage(image))
+
+    def create_stitched_image(self):
+        rows, cols = self.grid
+        if not self.ref_pieces or len(self.ref_pieces) < rows * cols:
+            return
+
+        cell_w, cell_h = self.cell_size
+        stitched_image = QPixmap(cell_w * cols, cell_h * rows)
+        stitched_image.fill(Qt.transparent)
+        self.stitched_image = stitched_image
+        self.stitched_image_label.set_canvas(self.stitched_image, self.cell_size, (rows, cols))
+        self.redraw_cells(range(len(self.current_order)))
+
+    def redraw_cells(self, indices):
+        # 只重画给定位置的格子，耗时与拼图分辨率和碎片总数无关
+        if not self.stitched_image:
+            return
+        cols = self.grid[1]
+        cell_w, cell_h = self.cell_size
+        painter = QPainter(self.stitched_image)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for i in indices:
+            row, col = divmod(i, cols)
+            x = col * cell_w
+            y = row * cell_h
+            painter.fillRect(x, y, cell_w, cell_h, Qt.transparent)
+            piece_idx = self.current_order[i]
+            if 1 <= piece_idx <= len(self.ref_pieces):
+                painter.drawPixmap(x, y, self.ref_pieces[piece_idx - 1])
+        painter.end()
+        self.stitched_image_label.update_cells(indices)
+
+    def render_full_image(self):
+        # 保存图片时按碎片原始尺寸重新拼接
+        rows, cols = self.grid
+        piece_w, piece_h = self.piece_size
+        full_image = QPixmap(piece_w * cols, piece_h * rows)
+        full_image.fill(Qt.transparent)
+        painter = QPainter(full_image)
+        for i, piece_idx in enumerate(self.current_order):
+            if 1 <= piece_idx <= len(self.ref_paths):
+                if is_figure_pack(self.ref_dir):
+                    pixmap = QPixmap.fromImage(pack_piece_image(self.ref_dir, piece_idx - 1))
+                else:
+                    pixmap = QPixmap(self.ref_paths[piece_idx - 1])
+                row, col = divmod(i, cols)
+                painter.drawPixmap(col * piece_w, row * piece_h,
+                                   pixmap.scaled(piece_w, piece_h, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        painter.end()
+        return full_image
+
+    def next_step(self):
+        if self.current_step < len(self.swaps):
+            idx1, idx2 = self.swaps[self.current_step]
+            self.highlighted_pieces = [idx1, idx2]
+            self.current_order[idx1], self.current_order[idx2] = self.current_order[idx2], self.current_order[idx1]
+            self.redraw_cells([idx1, idx2])
+            self.stitched_image_label.set_highlight(self.highlighted_pieces)
+
+            self.current_step += 1
+            self.piece_order_label.setText(f"当前碎片顺序: {self.current_order}")
+            self.swap_count_label.setText(f"已完成交换: {self.current_step}/{len(self.swaps)}")
+            self.highlight_current_step()
+
+            if self.current_step >= len(self.swaps):
+                self.next_step_btn.setEnabled(False)
+                QMessageBox.information(self, "完成", "所有交换步骤已完成！")
+            QTimer.singleShot(1000, self.clear_highlight)
+
+    def highlight_current_step(self):
+        for i in range(self.steps_list.count()):
+            item = self.steps_list.item(i)
+            item.setBackground(Qt.transparent)
+
+        if self.current_step > 0 and self.current_step - 1 < self.steps_list.count():
+            current_step_item = self.steps_list.item(self.current_step - 1)
+
+            highlight_color = QColor(255, 200, 200, 200)
+            current_step_item.setBackground(highlight_color)
+
+            self.steps_list.scrollToItem(current_step_item)
+
+    def clear_highlight(self):
+        self.highlighted_pieces = []
+        self.stitched_image_label.set_highlight([])
+        self.highlight_current_step()
+
+    def save_results(self):
+        if not hasattr(self, 'piece_order') or not self.piece_order:
+            QMessageBox.warning(self, "警告", "没有可保存的结果")
+            return
+
+        options = QFileDialog.Options()
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "保存结果", "", "文本文件 (*.txt);;所有文件 (*)", options=options
+        )
+
+        if file_path:
+            try:
+                with open(file_path, 'w') as f:
+                    f.write("拼图碎片排序结果\n")
+                    f.write("=" * 30 + "\n\n")
+                    f.write(f"原始图像: {os.path.basename(self.screenshot_path)}\n")
+                    f.write(f"参考碎片目录: {os.path.basename(self.ref_dir)}\n")
+                    f.write(f"匹配阈值: {self.threshold_spin.value()}%\n\n")
+                    f.write(f"初始碎片顺序: {self.piece_order}\n")
+                    f.write(f"当前碎片顺序: {self.current_order}\n\n")
+                    f.write("交换步骤:\n")
+                    for step, (idx1, idx2) in enumerate(self.swaps, 1):
+                        f.write(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}\n")
+                    f.write(f"\n总交换次数: {len(self.swaps)}\n")
+                    f.write(f"已完成交换: {self.current_step}\n")
+
+                QMessageBox.information(self, "成功", "结果已保存")
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"保存失败: {str(e)}")
+
+    def save_image(self):
+        if not hasattr(self, 'stitched_image') or not self.stitched_image:
+            QMessageBox.warning(self, "警告", "没有可保存的图像")
+            return
+
+        options = QFileDialog.Options()
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "保存图像", "", "PNG图像 (*.png);;JPEG图像 (*.jpg *.jpeg);;所有文件 (*)", options=options
+        )
+
+        if file_path:
+            try:
+                self.render_full_image().save(file_path)
+                QMessageBox.information(self, "成功", "图像已保存")
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"保存失败: {str(e)}")
+
+    def reset(self):
+        self.screenshot_path = ""
+        self.ref_dir = ""
+        self.screenshot_label.setText("未选择截图")
+        self.original_image_label.clear()
+        self.stitched_image_label.clear_canvas()
+        self.piece_order_label.setText("碎片顺序: ")
+
+        self.steps_list.clear()
+        self.swap_count_label.setText("总交换次数: 0")
+        self.threshold_spin.setValue(60)
+        self.pyramid_spin.setValue(0)
+        self.workers_spin.setValue(min(4, os.cpu_count() or 1))
+        self.auto_crop_check.setChecked(False)
+        self.continuous_check.setChecked(False)
+        self.cancel_worker()
+        self.session = None
+        self.session_key = None
+        self.session_changes = None
+        self.margins = []
+        self.low_margin_cells = []
+        self.progress_bar.setVisible(False)
+        self.current_step = 0
+        self.current_order = []
+        self.stitched_image = None
+        self.original_image = None
+        self.ref_paths = []
+        self.ref_pieces = []
+        self.cell_size = (0, 0)
+        self.piece_size = [0, 0]
+        self.grid = [3, 4]
+        self.next_step_btn.setEnabled(False)
+        self.puzzle_number_combo.setCurrentIndex(0)
+        self.puzzle_number_label.setText("选择拼图:")
+        self.highlighted_pieces = []
+
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    window = PuzzleSorterApp()
+    window.show()
+    sys.exit(app.exec_())
+
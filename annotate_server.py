@@ -0,0 +1,252 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import sys
+import json
+import base64
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+
+import profiler
+from swap_sort import draw_annotations, order_confidence
+from image_core import match_screenshot, MATCHERS, DEFAULT_MATCHER
+from puzzle_core import get_piece_order, min_swap_sort, PLANNERS, SWAP_COSTS
+from template_bank import get_template_bank
+from figure_index import discover_figures, get_figure_index
+from board_locator import crop_board
+from result_cache import get_result_cache, make_key, encode_matches, decode_matches
+
+MAX_UPLOAD_SIZE = 32 * 1024 * 1024
+IMAGE_FORMATS = {'png': '.png', 'jpg': '.jpg', 'jpeg': '.jpg', 'webp': '.webp'}
+
+
+class AnnotateService:
+    def __init__(self, ref_root='reference_patches', jobs=None, use_cache=True):
+        self.ref_root = ref_root
+        self.cache = get_result_cache() if use_cache else None
+        self.figures = discover_figures(ref_root)
+        # 启动时预加载所有图的模板和拼图识别索引，之后每个请求都直接使用内存中的数据
+        for ref_dir in self.figures.values():
+            get_template_bank(ref_dir)
+        get_figure_index(ref_root)
+        # 匹配是 CPU 密集型任务，由固定大小的线程池执行，限制同时进行的匹配数
+        self.pool = ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+
+    def annotate(self, image_bytes, figure_label, matcher=DEFAULT_MATCHER, pyramid_levels=0, image_format=None,
+                 auto_crop=False, planner='cycles', swap_cost='count'):
+        response = self._annotate_cached(image_bytes, figure_label, matcher, pyramid_levels, image_format, auto_crop)
+        if (planner, swap_cost) != ('cycles', 'count'):
+            # 缓存中保存的是默认规划的交换步骤，其它规划方式按碎片顺序重新计算，不需要重新匹配
+            swaps, _ = min_swap_sort(response['order'], planner=planner, cols=response['grid'][1], cost=swap_cost)
+            response['swaps'] = [list(swap) for swap in swaps]
+        return response
+
+    def _annotate_cached(self, image_bytes, figure_label, matcher, pyramid_levels, image_format, auto_crop):
+        if figure_label != 'auto' and figure_label not in self.figures:
+            raise KeyError(f"未知的拼图编号: {figure_label}")
+        image_sha1 = hashlib.sha1(image_bytes).hexdigest()
+        if self.cache is not None and figure_label != 'auto' and not image_format:
+            # 指定了拼图且不需要标注图时，命中缓存就不用解码截图
+            cached = self.cache.get(self.cache_key(image_sha1, figure_label, matcher, pyramid_levels, auto_crop))
+            if cached is not None:
+                return self.build_response(figure_label, False, cached['piece_order'], cached['swaps'],
+                                           cached['scores'], cached['margins'], cached['board_box'],
+                                           cached['grid'], cached=True)
+        screenshot_area = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if screenshot_area is None:
+            raise ValueError("无法解码截图图像")
+        future = self.pool.submit(self._annotate, screenshot_area, image_sha1, figure_label, matcher, pyramid_levels,
+                                  image_format, auto_crop)
+        return future.result()
+
+    def cache_key(self, image_sha1, figure_label, matcher, pyramid_levels, auto_crop):
+        # 参数与命令行的结果缓存一致，命令行处理过的截图服务也可以直接使用
+        return make_key(image_sha1, self.figures[figure_label], matcher=matcher, pyramid_levels=pyramid_levels,
+                        auto_crop=auto_crop)
+
+    def build_response(self, figure_label, detected, piece_order, swaps, scores, margins, board_box, grid,
+                       cached=False):
+        return {
+            'figure': figure_label,
+            'order': piece_order,
+            'swaps': [list(swap) for swap in swaps],
+            'scores': scores,
+            'confidence': order_confidence(piece_order, scores),
+            'margins': margins,
+            'figure_detected': detected,
+            'board_box': [int(v) for v in board_box],
+            'grid': list(grid),
+            'cached': cached,
+        }
+
+    def _annotate(self, screenshot_area, image_sha1, figure_label, matcher, pyramid_levels, image_format, auto_crop):
+        with profiler.span('annotate', figure=figure_label, matcher=matcher) as span_args:
+            response = self._annotate_image(screenshot_area, image_sha1, figure_label, matcher, pyramid_levels,
+                                            image_format, auto_crop)
+            span_args['scores'] = response['scores']
+        return response
+
+    def _annotate_image(self, screenshot_area, image_sha1, figure_label, matcher, pyramid_levels, image_format,
+                        auto_crop):
+        detected = figure_label == 'auto'
+        if detected:
+            with profiler.span('identify_figure'):
+                figure_label, _ = get_figure_index(self.ref_root).identify(screenshot_area, auto_crop)
+        full_image = screenshot_area
+        cache_key = None
+        cached = None
+        if self.cache is not None:
+            cache_key = self.cache_key(image_sha1, figure_label, matcher, pyramid_levels, auto_crop)
+            cached = self.cache.get(cache_key)
+        if cached is not None:
+            best_matches = decode_matches(cached['matches'])
+            response = self.build_response(figure_label, detected, cached['piece_order'], cached['swaps'],
+                                           cached['scores'], cached['margins'], cached['board_box'],
+                                           cached['grid'], cached=True)
+        else:
+            bank = get_template_bank(self.figures[figure_label])
+            board_box = (0, 0, screenshot_area.shape[1], screenshot_area.shape[0])
+            if auto_crop:
+                with profiler.span('crop_board'):
+                    screenshot_area, board_box = crop_board(screenshot_area, bank)
+            best_matches, piece_scores, margins = match_screenshot(screenshot_area, bank=bank, matcher=matcher,
+                                                                   pyramid_levels=pyramid_levels, rows=bank.rows,
+                                                                   cols=bank.cols)
+            piece_order = get_piece_order(screenshot_area, best_matches, bank.rows, bank.cols)
+            swaps, _ = min_swap_sort(piece_order)
+            scores = [float(score) for score, _ in piece_scores]
+            response = self.build_response(figure_label, detected, piece_order, swaps, scores, margins, board_box,
+                                           [bank.rows, bank.cols])
+            if cache_key is not None:
+                self.cache.put(cache_key, {
+                    'piece_order': piece_order,
+                    'scores': scores,
+                    'margins': margins,
+                    'swaps': response['swaps'],
+                    'board_box': response['board_box'],
+                    'grid': response['grid'],
+                    'matches': encode_matches(best_matches),
+                    'output_path': None,
+                })
+        board_box = response['board_box']
+        if image_format:
+            annotated_img = draw_annotations(full_image, {(x + board_box[0], y + board_box[1]): number
+                                                          for (x, y), number in best_matches.items()})
+            ok, encoded = cv2.imencode(IMAGE_FORMATS[image_format], annotated_img)
+            if not ok:
+                raise ValueError(f"图像编码失败: {image_format}")
+            response['image_format'] = image_format
+            response['image'] = base64.b64encode(encoded.tobytes()).decode('ascii')
+        return response
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+class AnnotateRequestHandler(BaseHTTPRequestHandler):
+    # GET /health                      -> 服务状态与可用的拼图编号
+    # POST /annotate?figure=01         -> 请求体为截图文件的原始字节，返回碎片顺序和交换步骤，不给 figure 时自动识别
+    #   可选参数: matcher=auto|template|cells|orb, pyramid_levels=N|auto, image=png|jpg|webp(返回 base64 标注图),
+    #   crop=1(截图未裁剪时自动定位拼图区域), planner=cycles|astar, cost=count|distance(交换步骤的规划方式和代价)
+    service = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self.send_json(404, {'error': 'not found'})
+            return
+        self.send_json(200, {'status': 'ok', 'figures': list(self.service.figures)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/annotate':
+            self.send_json(404, {'error': 'not found'})
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            self.send_json(400, {'error': '请求体为空，请上传截图'})
+            return
+        if length > MAX_UPLOAD_SIZE:
+            self.send_json(413, {'error': '截图文件过大'})
+            return
+        image_bytes = self.rfile.read(length)
+
+        figure_label = params.get('figure', 'auto')
+        if figure_label.isdigit():
+            figure_label = figure_label.zfill(2)
+        matcher = params.get('matcher', DEFAULT_MATCHER)
+        image_format = params.get('image')
+        try:
+            pyramid_levels = params.get('pyramid_levels', '0')
+            pyramid_levels = pyramid_levels if pyramid_levels == 'auto' else int(pyramid_levels)
+            if matcher not in MATCHERS:
+                raise ValueError(f"未知的匹配方式: {matcher}")
+            if image_format is not None and image_format not in IMAGE_FORMATS:
+                raise ValueError(f"不支持的图像格式: {image_format}")
+            auto_crop = params.get('crop', '0') not in ('0', 'false', '')
+            planner = params.get('planner', 'cycles')
+            swap_cost = params.get('cost', 'count')
+            if planner not in PLANNERS:
+                raise ValueError(f"未知的交换规划方式: {planner}")
+            if swap_cost not in SWAP_COSTS:
+                raise ValueError(f"未知的交换代价: {swap_cost}")
+            response = self.service.annotate(image_bytes, figure_label, matcher, pyramid_levels, image_format,
+                                             auto_crop, planner, swap_cost)
+        except KeyError as e:
+            self.send_json(404, {'error': e.args[0]})
+            return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, response)
+
+
+def serve(host='127.0.0.1', port=8000, ref_root='reference_patches', jobs=None, use_cache=True):
+    service = AnnotateService(ref_root, jobs, use_cache)
+    handler = type('BoundAnnotateRequestHandler', (AnnotateRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"标注服务已启动: http://{host}:{server.server_port}，已加载拼图: {', '.join(service.figures)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='拼图截图标注 HTTP 服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--ref-root', default='reference_patches')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='同时进行匹配的线程数，默认为 CPU 核数')
+    parser.add_argument('--no-cache', action='store_true', help='不读写结果缓存，总是重新匹配')
+    parser.add_argument('--profile', default=None, help='记录各阶段耗时，服务退出时写入该文件(.json 或 .csv)')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiler.enable(args.profile)
+    return serve(args.host, args.port, args.ref_root, args.jobs, not args.no_cache)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import re
+import sys
+import json
+import glob
+import time
+import platform
+import argparse
+import subprocess
+
+import cv2
+import numpy as np
+
+from swap_sort import pyramid_levels_arg
+from image_core import preprocess_image, prepare_templates, score_templates, sweep_thresholds, MATCHERS
+from puzzle_core import natural_sort_key, get_piece_order, min_swap_sort, figure_path
+from template_bank import get_template_bank
+from memory_budget import load_screenshot, set_memory_budget, peak_rss_mb
+
+STAGES = ('load', 'preprocess', 'match', 'order', 'swap', 'total')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def discover_fixtures(screenshot_root):
+    # screenshot/figXX/*.png 以及 screenshot/figXX_*.png，返回 (图编号, 截图路径)
+    fixtures = []
+    paths = glob.glob(os.path.join(screenshot_root, '*')) + glob.glob(os.path.join(screenshot_root, 'fig*', '*'))
+    for path in sorted(paths, key=natural_sort_key):
+        if not os.path.isfile(path) or not path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+            continue
+        rel = os.path.relpath(path, screenshot_root).replace(os.sep, '/')
+        match = re.match(r'fig(\d+)', rel)
+        if match:
+            fixtures.append((match.group(1), path))
+    return fixtures
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def run_fixture(screenshot_path, bank, matcher, pyramid_levels):
+    timings = {}
+    start = time.perf_counter()
+    # 设置了内存预算时按参考碎片的分辨率缩小解码，与命令行一致
+    screenshot_area, _ = load_screenshot(screenshot_path, bank.board_size)
+    timings['load'] = time.perf_counter() - start
+    if screenshot_area is None:
+        raise ValueError(f"无法加载截图图像: {screenshot_path}")
+
+    t = time.perf_counter()
+    screenshot_gray = preprocess_image(screenshot_area)
+    ref_templates = prepare_templates(screenshot_gray, bank=bank, rows=bank.rows, cols=bank.cols)
+    timings['preprocess'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if matcher in ('cells', 'auto'):
+        from cell_matcher import resolve_cells
+        piece_scores, _ = resolve_cells(screenshot_gray, ref_templates, bank.rows, bank.cols, matcher == 'auto',
+                                        pyramid_levels)
+    elif matcher in ('orb', 'akaze'):
+        from feature_matcher import get_feature_bank, feature_vote_matrix, assign_votes
+        piece_scores = assign_votes(feature_vote_matrix(screenshot_gray, get_feature_bank(bank, matcher),
+                                                        bank.rows, bank.cols), screenshot_gray.shape, bank.cols)
+    else:
+        piece_scores = score_templates(screenshot_gray, ref_templates, pyramid_levels)
+    timings['match'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if matcher != 'template':
+        matches = {center: ref_idx + 1 for ref_idx, (_, center) in enumerate(piece_scores) if center is not None}
+    else:
+        matches = sweep_thresholds(piece_scores, verbose=False)
+    piece_order = get_piece_order(screenshot_area, matches, bank.rows, bank.cols)
+    timings['order'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    min_swap_sort(piece_order)
+    timings['swap'] = time.perf_counter() - t
+
+    timings['total'] = time.perf_counter() - start
+    return piece_order, timings
+
+
+def run_benchmark(screenshot_root='screenshot', ref_root='reference_patches', repeat=5, matcher='template',
+                  pyramid_levels=0, expected_path=None, budget_mb=None):
+    set_memory_budget(budget_mb)
+    expected_path = expected_path or os.path.join(screenshot_root, 'expected_orders.json')
+    expected = {}
+    if os.path.exists(expected_path):
+        with open(expected_path, encoding='utf-8') as f:
+            expected = json.load(f)
+
+    samples = {stage: [] for stage in STAGES}
+    fixtures = []
+    exact = 0
+    pieces_correct = 0
+    pieces_total = 0
+    for figure_label, path in discover_fixtures(screenshot_root):
+        bank = get_template_bank(figure_path(ref_root, figure_label))
+        fixture_samples = {stage: [] for stage in STAGES}
+        piece_order = None
+        for _ in range(repeat):
+            piece_order, timings = run_fixture(path, bank, matcher, pyramid_levels)
+            for stage, value in timings.items():
+                samples[stage].append(value)
+                fixture_samples[stage].append(value)
+
+        key = os.path.relpath(path, screenshot_root).replace(os.sep, '/')
+        record = {
+            'fixture': key,
+            'figure': figure_label,
+            'order': piece_order,
+            'median_ms': {stage: percentile_ms(values, 50) for stage, values in fixture_samples.items()},
+        }
+        if key in expected:
+            correct = sum(a == b for a, b in zip(piece_order, expected[key]))
+            record['correct'] = piece_order == expected[key]
+            exact += record['correct']
+            pieces_correct += correct
+            pieces_total += len(expected[key])
+        fixtures.append(record)
+        print(f"{key}: {record['median_ms']['total']:.1f} ms, "
+              f"{'正确' if record.get('correct') else ('错误' if 'correct' in record else '无标准答案')}")
+
+    checked = sum('correct' in record for record in fixtures)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'matcher': matcher,
+            'pyramid_levels': pyramid_levels,
+            'repeat': repeat,
+            'memory_budget_mb': budget_mb,
+        },
+        'stages': {stage: {'median_ms': percentile_ms(values, 50), 'p95_ms': percentile_ms(values, 95)}
+                   for stage, values in samples.items()},
+        'accuracy': {
+            'exact': exact,
+            'checked': checked,
+            'exact_ratio': exact / checked if checked else None,
+            'piece_ratio': pieces_correct / pieces_total if pieces_total else None,
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'fixtures': fixtures,
+    }
+
+
+def compare_reports(report, baseline, tolerance=0.25, min_delta_ms=1.0):
+    # 与基准结果比较，返回回退项列表；耗时变化小于 min_delta_ms 的视为噪声
+    regressions = []
+    for stage, stats in report['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if not old:
+            continue
+        new_ms, old_ms = stats['median_ms'], old['median_ms']
+        if new_ms > old_ms * (1 + tolerance) and new_ms - old_ms > min_delta_ms:
+            regressions.append(f"{stage}: {old_ms:.2f} ms -> {new_ms:.2f} ms")
+    old_ratio = baseline.get('accuracy', {}).get('exact_ratio')
+    new_ratio = report['accuracy']['exact_ratio']
+    if old_ratio is not None and new_ratio is not None and new_ratio < old_ratio:
+        regressions.append(f"accuracy: {old_ratio:.3f} -> {new_ratio:.3f}")
+    return regressions
+
+
+def print_report(report):
+    print(f"\n{'阶段':<12}{'中位数(ms)':>12}{'P95(ms)':>12}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:<12}{stats['median_ms']:>12.2f}{stats['p95_ms']:>12.2f}")
+    accuracy = report['accuracy']
+    if accuracy['checked']:
+        print(f"\n准确率: {accuracy['exact']}/{accuracy['checked']} 张完全正确，"
+              f"碎片正确率 {accuracy['piece_ratio']:.3f}")
+    if report['peak_rss_mb'] is not None:
+        print(f"峰值内存: {report['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='匹配与排序流程的性能和准确率基准测试')
+    parser.add_argument('--screenshot-root', default='screenshot')
+    parser.add_argument('--ref-root', default='reference_patches')
+    parser.add_argument('--repeat', type=int, default=5, help='每张截图重复运行的次数')
+    parser.add_argument('--matcher', choices=MATCHERS, default='template')
+    parser.add_argument('--pyramid-levels', type=pyramid_levels_arg, default=0)
+    parser.add_argument('--expected', default=None, help='标准答案 JSON，默认 screenshot/expected_orders.json')
+    parser.add_argument('--output', '-o', default=None, help='结果保存为 JSON，便于不同提交之间比较')
+    parser.add_argument('--baseline', default=None, help='基准结果 JSON，有回退时返回非零退出码')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的耗时增长比例')
+    parser.add_argument('--memory-budget-mb', type=float, default=None, help='在内存受限模式下测量')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.screenshot_root, args.ref_root, args.repeat, args.matcher, args.pyramid_levels,
+                           args.expected, args.memory_budget_mb)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print("\n性能或准确率回退:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n与基准相比没有回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import numpy as np
+
+from image_core import preprocess_image
+
+
+def score_board_scale(small_gray, templates, board_w, board_h, rows=3, cols=4):
+    # 在缩小的截图上按给定拼图区域大小匹配所有碎片，返回 (平均匹配度, 各碎片左上角坐标, 各碎片匹配度)
+    cell_w = int(round(board_w / cols))
+    cell_h = int(round(board_h / rows))
+    if cell_w < 8 or cell_h < 8 or cell_w > small_gray.shape[1] or cell_h > small_gray.shape[0]:
+        return -1.0, [], []
+    locs = []
+    vals = []
+    for template in templates:
+        resized = cv2.resize(template, (cell_w, cell_h), interpolation=cv2.INTER_AREA)
+        result = cv2.matchTemplate(small_gray, resized, cv2.TM_CCOEFF_NORMED)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        locs.append(subpixel_peak(result, max_loc))
+        vals.append(max_val)
+    return float(np.mean(vals)), locs, vals
+
+
+def subpixel_peak(result, loc):
+    # 用峰值两侧的匹配度拟合抛物线，把坐标精确到亚像素；缩略图上的一个像素对应原图好几个像素
+    x, y = loc
+
+    def offset(prev, peak, nxt):
+        denom = prev - 2 * peak + nxt
+        return float(np.clip(0.5 * (prev - nxt) / denom, -0.5, 0.5)) if denom < 0 else 0.0
+
+    dx = offset(result[y, x - 1], result[y, x], result[y, x + 1]) if 0 < x < result.shape[1] - 1 else 0.0
+    dy = offset(result[y - 1, x], result[y, x], result[y + 1, x]) if 0 < y < result.shape[0] - 1 else 0.0
+    return x + dx, y + dy
+
+
+def locate_board(screenshot_area, bank, work_size=360, min_scale=0.25, steps=16, coarse_pieces=6, refine=True,
+                 fine_pieces=24):
+    # 在未裁剪的整屏截图中定位拼图区域(行列数取自模板库)，返回原图上的 (x, y, 宽, 高)，找不到时返回 None
+    box = search_board(screenshot_area, bank, work_size, min_scale, steps, coarse_pieces, fine_pieces)
+    if box is None or not refine:
+        return box
+
+    # 第一遍在整屏缩略图上只能粗略定位，再在拼图区域附近(留出边距)重新搜索一次以提高精度
+    h, w = screenshot_area.shape[:2]
+    x, y, bw, bh = box
+    margin_x = int(bw * 0.1)
+    margin_y = int(bh * 0.1)
+    rx0, ry0 = max(0, x - margin_x), max(0, y - margin_y)
+    rx1, ry1 = min(w, x + bw + margin_x), min(h, y + bh + margin_y)
+    if (rx1 - rx0) * (ry1 - ry0) >= 0.9 * w * h:
+        return box
+    refined = search_board(screenshot_area[ry0:ry1, rx0:rx1], bank, work_size, 0.7, 7, coarse_pieces, fine_pieces)
+    if refined is None:
+        return box
+    return refined[0] + rx0, refined[1] + ry0, refined[2], refined[3]
+
+
+def search_board(screenshot_area, bank, work_size, min_scale, steps, coarse_pieces, fine_pieces=24):
+    h, w = screenshot_area.shape[:2]
+    factor = min(1.0, work_size / max(h, w))
+    small = cv2.resize(screenshot_area, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    small_gray = preprocess_image(small)
+    sh, sw = small_gray.shape[:2]
+
+    piece_w, piece_h = np.median(np.array(bank.piece_sizes, dtype=np.float64), axis=0)
+    board_aspect = (bank.cols * piece_w) / (bank.rows * piece_h)
+    max_board_w = min(sw, sh * board_aspect)
+    # 先只用几个碎片粗扫拼图区域的大小，再用全部碎片在最优值附近细扫
+    coarse_templates = bank.templates[::max(1, len(bank.templates) // coarse_pieces)]
+    best_scale = None
+    best_score = -1.0
+    scales = np.linspace(min_scale, 1.0, steps)
+    for scale in scales:
+        board_w = max_board_w * scale
+        score, _, _ = score_board_scale(small_gray, coarse_templates, board_w, board_w / board_aspect, bank.rows,
+                                        bank.cols)
+        if score > best_score:
+            best_score, best_scale = score, scale
+    if best_scale is None:
+        return None
+
+    step = scales[1] - scales[0] if steps > 1 else 0
+    # 碎片很多时细扫也只用一部分碎片，确定大小后再用全部碎片求各自的位置
+    fine_templates = bank.templates[::max(1, len(bank.templates) // fine_pieces)]
+    best = (-1.0, None, None, None)
+    for scale in np.clip(np.linspace(best_scale - step / 2, best_scale + step / 2, 5), min_scale, 1.0):
+        board_w = max_board_w * scale
+        score, locs, vals = score_board_scale(small_gray, fine_templates, board_w, board_w / board_aspect,
+                                              bank.rows, bank.cols)
+        if score > best[0]:
+            best = (score, scale, locs, vals)
+    score, scale, locs, vals = best
+    if scale is None:
+        # 所有尺度的匹配度都无效(例如纯色截图上得到 NaN)
+        return None
+    board_w = max_board_w * scale
+    board_h = board_w / board_aspect
+    if len(fine_templates) < len(bank.templates):
+        score, locs, vals = score_board_scale(small_gray, bank.templates, board_w, board_h, bank.rows, bank.cols)
+    # 只使用匹配度较高的碎片避免误匹配；这些碎片的坐标落在网格上，按所在的行列拟合出拼图区域的四条边
+    # 参考碎片的宽高比与截图中的格子不完全相同，按拟合出的格子大小重新匹配一次再拟合
+    # 原始宽(高)与其他碎片相差较多的参考碎片多切进了相邻的内容，缩放成统一大小后位置有偏差，只用来归格不用来拟合
+    regular = [(abs(pw - piece_w) <= 0.02 * piece_w, abs(ph - piece_h) <= 0.02 * piece_h)
+               for pw, ph in bank.piece_sizes]
+    for _ in range(2):
+        cutoff = max(0.3, float(np.median(vals)) - 0.15)
+        confident = [i for i, val in enumerate(vals) if val >= cutoff] or list(range(len(locs)))
+        x0, x1 = fit_grid_edges([locs[i][0] for i in confident], board_w / bank.cols, bank.cols,
+                                [regular[i][0] for i in confident])
+        y0, y1 = fit_grid_edges([locs[i][1] for i in confident], board_h / bank.rows, bank.rows,
+                                [regular[i][1] for i in confident])
+        if abs(x1 - x0 - board_w) < bank.cols and abs(y1 - y0 - board_h) < bank.rows:
+            break
+        _, new_locs, new_vals = score_board_scale(small_gray, bank.templates, x1 - x0, y1 - y0, bank.rows, bank.cols)
+        if not new_locs:
+            break
+        board_w, board_h, locs, vals = x1 - x0, y1 - y0, new_locs, new_vals
+
+    x = max(0, min(int(round(x0 / factor)), w - 1))
+    y = max(0, min(int(round(y0 / factor)), h - 1))
+    bw = int(round(x1 / factor)) - x
+    bh = int(round(y1 / factor)) - y
+    return x, y, min(bw, w - x), min(bh, h - y)
+
+
+def fit_grid_edges(coords, cell, count, reliable=None):
+    # coords 为各碎片左上角在一个方向上的坐标，cell 为按宽高比估计的格子边长，count 为该方向的格子数
+    # 最小的坐标是第一格，其余碎片按与它的距离归到各格，再用最小二乘拟合 坐标 = 起点 + 格号 * 格子边长
+    # reliable 标出可用于拟合的碎片(其余碎片只参与归格)；返回 (起点, 终点)，碎片都在同一格时沿用估计的格子边长
+    coords = np.asarray(coords, dtype=np.float64)
+    reliable = np.ones(len(coords), dtype=bool) if reliable is None else np.asarray(reliable, dtype=bool)
+    start = coords.min()
+    index = np.clip(np.round((coords - start) / cell), 0, count - 1)
+    for _ in range(2):
+        fit = reliable if len(np.unique(index[reliable])) >= 2 else np.ones(len(coords), dtype=bool)
+        if len(np.unique(index[fit])) < 2:
+            break
+        cell, start = np.polyfit(index[fit], coords[fit], 1)
+        # 按拟合结果重新归格，再去掉偏离网格超过四分之一格的误匹配
+        index = np.clip(np.round((coords - start) / cell), 0, count - 1)
+        keep = np.abs(coords - start - index * cell) <= cell / 4
+        if (keep & reliable).sum() >= 2 and not keep.all():
+            coords, index, reliable = coords[keep], index[keep], reliable[keep]
+    return start, start + count * cell
+
+
+def crop_board(screenshot_area, bank, min_fill=0.9, **kwargs):
+    # 返回 (裁剪后的图像, (x, y, 宽, 高))；截图本身已经基本只有拼图区域时不裁剪
+    h, w = screenshot_area.shape[:2]
+    box = locate_board(screenshot_area, bank, **kwargs)
+    if box is None:
+        return screenshot_area, (0, 0, w, h)
+    x, y, bw, bh = box
+    if bw * bh >= min_fill * w * h:
+        return screenshot_area, (0, 0, w, h)
+    return screenshot_area[y:y + bh, x:x + bw], box
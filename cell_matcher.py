@@ -0,0 +1,186 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import numpy as np
+
+import profiler
+from image_core import preprocess_image, prepare_templates, match_template
+
+MIN_MARGIN = 0.05  # 格子的最佳与次佳碎片匹配度之差低于该值时视为不确定
+MIN_SCORE = 0.5  # 格子与分配到的碎片的匹配度低于该值时也视为不确定
+SEARCH_PAD = 0.25  # 不确定的格子向四周扩大的比例(占格子边长)，在扩大的窗口内重新做模板匹配
+
+
+class MatchCancelled(Exception):
+    # 匹配途中 cancelled() 返回真时抛出，调用方(例如界面的工作线程)据此放弃这次匹配
+    pass
+
+
+def linear_assignment(cost):
+    # 匈牙利算法(最小化总代价)，返回 (行索引, 列索引)，用法与 scipy 的 linear_sum_assignment 相同
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)  # p[j]: 分配到第 j 列的行(从 1 开始，0 表示未分配)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            update = free & (cur < minv[1:])
+            minv[1:][update] = cur[update]
+            way[1:][update] = j0
+
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            used_cols = np.nonzero(used)[0]
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    if transposed:
+        rows, cols = cols, rows
+        order = np.argsort(rows)
+        rows, cols = rows[order], cols[order]
+    return rows, cols
+
+
+def cut_grid_cells(image, rows=3, cols=4):
+    h, w = image.shape[:2]
+    block_h = h // rows
+    block_w = w // cols
+    return [image[r * block_h:(r + 1) * block_h, c * block_w:(c + 1) * block_w]
+            for r in range(rows) for c in range(cols)]
+
+
+def normalize_rows(stack):
+    # 每行减均值、除以模长，之后行向量点积即为归一化相关系数(与 TM_CCOEFF_NORMED 在零偏移处一致)
+    stack = stack.reshape(len(stack), -1).astype(np.float32)
+    stack -= stack.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(stack, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    stack /= norms
+    return stack
+
+
+def cell_score_matrix(screenshot_gray, ref_templates, rows=3, cols=4):
+    # 返回 (格子数, 碎片数) 的相关系数矩阵，一次矩阵乘法算完所有格子与碎片的匹配度
+    cells = np.stack(cut_grid_cells(screenshot_gray, rows, cols))
+    templates = np.stack(ref_templates)
+    return normalize_rows(cells) @ normalize_rows(templates).T
+
+
+def cell_margins(scores, assigned):
+    # 每个格子分配到的碎片与该格子次佳碎片的匹配度之差，没有分配到碎片的格子为 0
+    margins = np.zeros(scores.shape[0])
+    for cell, ref in assigned.items():
+        others = np.delete(scores[cell], ref)
+        margins[cell] = scores[cell, ref] - others.max() if len(others) else scores[cell, ref]
+    return margins
+
+
+def refine_cells(screenshot_gray, ref_templates, cells, refs, rows=3, cols=4, pyramid_levels=0, pad=SEARCH_PAD,
+                 executor=None, progress=None, cancelled=None):
+    # 只对不确定的格子，在格子向四周扩大的窗口内做模板匹配，碎片与格子有少量错位时也能找到
+    # 给出线程池时各格子并行匹配(matchTemplate 执行时会释放 GIL)
+    # progress(已完成的格子数, 格子总数) 在每个格子匹配完后调用；每个格子开始匹配前检查 cancelled()，为真时抛出 MatchCancelled
+    h, w = screenshot_gray.shape[:2]
+    block_h = h // rows
+    block_w = w // cols
+    pad_h = int(block_h * pad)
+    pad_w = int(block_w * pad)
+
+    def refine_cell(cell):
+        if cancelled is not None and cancelled():
+            raise MatchCancelled()
+        y0 = (cell // cols) * block_h
+        x0 = (cell % cols) * block_w
+        window = screenshot_gray[max(y0 - pad_h, 0):min(y0 + block_h + pad_h, h),
+                                 max(x0 - pad_w, 0):min(x0 + block_w + pad_w, w)]
+        return [match_template(window, ref_templates[ref], cv2.TM_CCOEFF_NORMED, pyramid_levels)[0]
+                for ref in refs]
+
+    rows_out = []
+    for row in (executor.map(refine_cell, cells) if executor is not None else map(refine_cell, cells)):
+        rows_out.append(row)
+        if progress is not None:
+            progress(len(rows_out), len(cells))
+    return np.array(rows_out, dtype=np.float32).reshape(len(cells), len(refs))
+
+
+def match_cells(screenshot_area, ref_pieces=None, bank=None, rows=3, cols=4, escalate=False, pyramid_levels=0):
+    with profiler.span('preprocess'):
+        screenshot_gray = preprocess_image(screenshot_area)
+        ref_templates = prepare_templates(screenshot_gray, ref_pieces, bank, rows, cols)
+    return resolve_cells(screenshot_gray, ref_templates, rows, cols, escalate, pyramid_levels)
+
+
+def resolve_cells(screenshot_gray, ref_templates, rows=3, cols=4, escalate=False, pyramid_levels=0,
+                  min_margin=MIN_MARGIN, min_score=MIN_SCORE, executor=None, progress=None, cancelled=None):
+    # 返回 (每个碎片的 (匹配度, 中心坐标), 每个格子的置信度(最佳与次佳匹配度之差))
+    # escalate 时，快速的整格相关系数已经给出确定的完整排列就直接返回；
+    # 否则只对不确定的格子和它们的碎片重新做窗口内模板匹配，再在这一小块上重新分配
+    # progress / cancelled 传给 refine_cells，逐个不确定的格子汇报进度和检查是否取消
+    h, w = screenshot_gray.shape[:2]
+    block_h = h // rows
+    block_w = w // cols
+    with profiler.span('cell_scores', cells=rows * cols, pieces=len(ref_templates)):
+        scores = cell_score_matrix(screenshot_gray, ref_templates, rows, cols)
+    with profiler.span('assign_cells'):
+        cell_idx, ref_idx = linear_assignment(-scores)
+    assigned = dict(zip(cell_idx.tolist(), ref_idx.tolist()))
+    margins = cell_margins(scores, assigned)
+    cell_scores = {cell: float(scores[cell, ref]) for cell, ref in assigned.items()}
+
+    if escalate:
+        ambiguous = [cell for cell in range(rows * cols)
+                     if cell not in assigned or margins[cell] < min_margin or cell_scores[cell] < min_score]
+        if ambiguous:
+            # 候选碎片：分配给不确定格子的碎片，加上没有分配到任何格子的碎片
+            used = set(assigned.values())
+            candidates = [assigned[cell] for cell in ambiguous if cell in assigned]
+            candidates += [ref for ref in range(len(ref_templates)) if ref not in used]
+            with profiler.span('escalate', cells=len(ambiguous), pieces=len(candidates)):
+                refined = refine_cells(screenshot_gray, ref_templates, ambiguous, candidates, rows, cols,
+                                       pyramid_levels, executor=executor, progress=progress, cancelled=cancelled)
+                sub_cells, sub_refs = linear_assignment(-refined)
+            for cell in ambiguous:
+                assigned.pop(cell, None)
+                margins[cell] = 0.0
+            for i, j in zip(sub_cells, sub_refs):
+                cell = ambiguous[i]
+                assigned[cell] = candidates[j]
+                cell_scores[cell] = float(refined[i, j])
+                # 只剩一个候选碎片时没有次佳可比，以匹配度作为置信度
+                others = np.delete(refined[i], j)
+                margins[cell] = refined[i, j] - others.max() if len(others) else refined[i, j]
+
+    # 与 score_reference_pieces 的返回格式一致：每个碎片的 (匹配度, 中心坐标)
+    piece_scores = [(0, None)] * len(ref_templates)
+    for cell, ref in assigned.items():
+        center = ((cell % cols) * block_w + block_w // 2, (cell // cols) * block_h + block_h // 2)
+        piece_scores[ref] = (cell_scores[cell], center)
+    return piece_scores, [round(float(margin), 4) for margin in margins]
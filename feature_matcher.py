@@ -0,0 +1,193 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import profiler
+from image_core import preprocess_image
+from cell_matcher import linear_assignment
+
+FEATURE_VERSION = 2
+DETECTORS = ('orb', 'akaze')
+FEATURES_PER_PIECE = 250  # 每个碎片(截图中每个格子)最多提取的特征点数，越多越准但匹配越慢
+RATIO = 0.8  # Lowe 比值检验
+POSITION_TOLERANCE = 0.12  # 特征点在格子内的相对位置与在碎片内的相对位置之差(占格子边长的比例)
+_feature_banks = {}
+_feature_banks_lock = threading.Lock()
+
+
+def create_detector(kind, max_features=FEATURES_PER_PIECE):
+    if kind == 'orb':
+        return cv2.ORB_create(nfeatures=max_features)
+    if kind == 'akaze':
+        # 部分 OpenCV 版本(例如 5.x)没有编译 AKAZE
+        create = getattr(cv2, 'AKAZE_create', None)
+        if create is None:
+            raise ValueError("当前 OpenCV 不包含 AKAZE，请改用 orb")
+        return create()
+    raise ValueError(f"未知的特征类型: {kind}")
+
+
+def compute_features(templates, kind='orb'):
+    # 返回 (所有碎片的描述子, 每个描述子属于第几个碎片, 特征点在碎片内的相对位置)
+    detector = create_detector(kind)
+    descriptors = []
+    piece_ids = []
+    points = []
+    for ref_idx, template in enumerate(templates):
+        keypoints, desc = detector.detectAndCompute(template, None)
+        if desc is None:
+            continue
+        h, w = template.shape[:2]
+        descriptors.append(desc)
+        piece_ids.append(np.full(len(desc), ref_idx, dtype=np.int32))
+        points.append(np.array([(kp.pt[0] / w, kp.pt[1] / h) for kp in keypoints], dtype=np.float32))
+    if not descriptors:
+        return np.zeros((0, 32), dtype=np.uint8), np.zeros(0, dtype=np.int32), np.zeros((0, 2), dtype=np.float32)
+    return np.concatenate(descriptors), np.concatenate(piece_ids), np.concatenate(points)
+
+
+# 一幅图所有参考碎片的特征点描述子，只计算一次并缓存到 .npz，与模板库的 stats 一起校验
+class FeatureBank:
+    def __init__(self, bank, kind='orb', cache_path=None):
+        self.kind = kind
+        self.cache_path = cache_path or os.path.splitext(bank.cache_path)[0] + f'_{kind}.npz'
+        self.piece_sizes = bank.piece_sizes
+        self.stats = bank.stats
+        self.descriptors = None  # 所有碎片的描述子拼接在一起
+        self.piece_ids = None  # 每个描述子属于第几个碎片(从 0 开始)
+        self.points = None  # 特征点在碎片内的相对位置 (x / 宽, y / 高)
+        if not self._load_pack(bank) and not self._load_cache():
+            self._build(bank)
+        self.matcher = self._create_matcher()
+        self.lock = threading.Lock()  # 服务器多线程共用同一个索引
+
+    def _create_matcher(self):
+        # ORB/AKAZE 都是二进制描述子，用 LSH 索引代替暴力匹配，索引只在加载时建立一次
+        matcher = cv2.FlannBasedMatcher(dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1),
+                                        dict(checks=50))
+        if len(self.descriptors):
+            matcher.add([self.descriptors])
+            matcher.train()
+        return matcher
+
+    def _load_pack(self, bank):
+        # 图包中已经带有同一版本的描述子时直接使用，不再计算也不写缓存
+        features = bank.pack.features.get(self.kind) if bank.pack is not None else None
+        if features is None:
+            return False
+        self.descriptors, self.piece_ids, self.points = features
+        return True
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path) as data:
+                if int(data['version']) != FEATURE_VERSION or not np.array_equal(data['stats'], self.stats):
+                    return False
+                self.descriptors = data['descriptors']
+                self.piece_ids = data['piece_ids']
+                self.points = data['points']
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _build(self, bank):
+        self.descriptors, self.piece_ids, self.points = compute_features(bank.templates, self.kind)
+        self._save()
+
+    def _save(self):
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f,
+                         version=np.array(FEATURE_VERSION),
+                         stats=self.stats,
+                         descriptors=self.descriptors,
+                         piece_ids=self.piece_ids,
+                         points=self.points)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"特征缓存写入失败: {e}")
+
+
+def get_feature_bank(bank, kind='orb'):
+    # 模板库重新加载(参考碎片有变动)时，特征库也随之重新计算
+    key = (os.path.abspath(bank.ref_dir), kind)
+    with _feature_banks_lock:
+        feature_bank = _feature_banks.get(key)
+        if feature_bank is None or not np.array_equal(feature_bank.stats, bank.stats):
+            feature_bank = FeatureBank(bank, kind)
+            _feature_banks[key] = feature_bank
+    return feature_bank
+
+
+def feature_vote_matrix(screenshot_gray, feature_bank, rows=3, cols=4):
+    # 返回 (格子数, 碎片数) 的投票矩阵：截图特征点与某碎片的特征点匹配、且在格子内的相对位置一致时，给该格子投一票
+    n_pieces = len(feature_bank.piece_sizes)
+    votes = np.zeros((rows * cols, n_pieces), dtype=np.float32)
+    if not len(feature_bank.descriptors):
+        return votes
+
+    # 截图缩放到每个格子与参考碎片大小相同，特征点的尺度与参考碎片一致
+    h, w = screenshot_gray.shape[:2]
+    piece_w, piece_h = np.median(np.array(feature_bank.piece_sizes, dtype=np.float64), axis=0)
+    scaled = cv2.resize(screenshot_gray, (int(round(piece_w * cols)), int(round(piece_h * rows))),
+                        interpolation=cv2.INTER_AREA if piece_w * cols < w else cv2.INTER_LINEAR)
+    detector = create_detector(feature_bank.kind, max_features=FEATURES_PER_PIECE * rows * cols)
+    with profiler.span('detect_features', kind=feature_bank.kind) as span_args:
+        keypoints, descriptors = detector.detectAndCompute(scaled, None)
+        span_args['keypoints'] = len(keypoints)
+    if descriptors is None:
+        return votes
+
+    with profiler.span('match_features'):
+        with feature_bank.lock:
+            knn = feature_bank.matcher.knnMatch(descriptors, k=2)
+    query = []
+    train = []
+    for pair in knn:
+        if len(pair) == 2 and pair[0].distance < RATIO * pair[1].distance:
+            query.append(pair[0].queryIdx)
+            train.append(pair[0].trainIdx)
+    if not query:
+        return votes
+
+    points = np.array([keypoints[i].pt for i in query], dtype=np.float32)
+    col = np.clip((points[:, 0] / piece_w).astype(np.int32), 0, cols - 1)
+    row = np.clip((points[:, 1] / piece_h).astype(np.int32), 0, rows - 1)
+    offset = np.stack([points[:, 0] / piece_w - col, points[:, 1] / piece_h - row], axis=1)
+    train = np.array(train)
+    consistent = np.all(np.abs(offset - feature_bank.points[train]) < POSITION_TOLERANCE, axis=1)
+    np.add.at(votes, (row[consistent] * cols + col[consistent], feature_bank.piece_ids[train[consistent]]), 1)
+    return votes
+
+
+def match_features(screenshot_area, bank, kind='orb', rows=3, cols=4):
+    # 与 score_reference_pieces 的返回格式一致：每个碎片的 (匹配度, 中心坐标)；匹配度为该格子中投给该碎片的票数占比
+    feature_bank = get_feature_bank(bank, kind)
+    with profiler.span('preprocess'):
+        screenshot_gray = preprocess_image(screenshot_area)
+    votes = feature_vote_matrix(screenshot_gray, feature_bank, rows, cols)
+    return assign_votes(votes, screenshot_gray.shape, cols)
+
+
+def assign_votes(votes, shape, cols=4):
+    # 匈牙利算法按票数分配，保证每个格子对应唯一碎片
+    rows = votes.shape[0] // cols
+    cell_idx, ref_idx = linear_assignment(-votes)
+
+    h, w = shape[:2]
+    block_h = h // rows
+    block_w = w // cols
+    cell_totals = votes.sum(axis=1)
+    piece_scores = [(0, None)] * votes.shape[1]
+    for cell, ref in zip(cell_idx, ref_idx):
+        center = ((cell % cols) * block_w + block_w // 2, (cell // cols) * block_h + block_h // 2)
+        piece_scores[ref] = (float(votes[cell, ref] / cell_totals[cell]) if cell_totals[cell] else 0.0, center)
+    return piece_scores
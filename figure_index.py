@@ -0,0 +1,189 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import numpy as np
+import os
+
+from image_core import load_reference_pieces
+from puzzle_core import load_grid, discover_figures, reference_sources
+
+INDEX_VERSION = 1
+THUMB_SIZE = (16, 12)  # 缩略图 (宽, 高)
+HIST_BINS = [16, 8, 8]
+LOCATE_SIZE = 512  # 未裁剪的截图识别前缩小到的最大边长
+_indexes = {}
+
+
+def color_histogram(image):
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, HIST_BINS, [0, 180, 0, 256, 0, 256]).ravel()
+    return hist / max(hist.sum(), 1)
+
+
+def thumbnail(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return cv2.resize(gray, THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+
+
+def normalize_rows(stack):
+    stack = np.asarray(stack, dtype=np.float32)
+    stack = stack - stack.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(stack, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return stack / norms
+
+
+# 所有拼图碎片的全局描述子：每个碎片一个灰度缩略图，每幅图一个颜色直方图(所有碎片之和，与碎片顺序无关)
+class FigureIndex:
+    def __init__(self, ref_root='reference_patches', cache_path=None):
+        self.ref_root = ref_root
+        self.cache_path = cache_path or os.path.join(ref_root, '.cache', 'figure_index.npz')
+        self.figures = discover_figures(ref_root)
+        self.ref_paths = []
+        for ref_dir in self.figures.values():
+            self.ref_paths.extend(reference_sources(ref_dir))
+        self.labels = []
+        self.thumbs = None
+        self.histograms = None
+        self.stats = None
+        if not self._load_cache():
+            self._build()
+        self.piece_groups = {figure_label: [i for i, label in enumerate(self.labels) if label == figure_label]
+                             for figure_label in self.figures}
+        self.grids = {figure_label: load_grid(ref_dir, len(self.piece_groups[figure_label]))
+                      for figure_label, ref_dir in self.figures.items()}
+
+    def _signature(self):
+        stats = []
+        for path in self.ref_paths:
+            st = os.stat(path)
+            stats.append((st.st_size, st.st_mtime_ns))
+        return np.array(stats, dtype=np.int64).reshape(-1, 2)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path) as data:
+                if int(data['version']) != INDEX_VERSION:
+                    return False
+                if [str(p) for p in data['paths']] != [os.path.relpath(p, self.ref_root) for p in self.ref_paths]:
+                    return False
+                stats = self._signature()
+                if not np.array_equal(data['stats'], stats):
+                    return False
+                self.stats = stats
+                self.labels = [str(label) for label in data['labels']]
+                self.thumbs = data['thumbs']
+                self.histograms = data['histograms']
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _build(self):
+        labels = []
+        thumbs = []
+        histograms = {}
+        for figure_label, ref_dir in self.figures.items():
+            # 图包中的碎片一次读入，碎片目录逐个解码 PNG
+            for ref_img in load_reference_pieces(ref_dir):
+                if ref_img is None:
+                    raise ValueError(f"无法加载参考碎片: {ref_dir}")
+                labels.append(figure_label)
+                thumbs.append(thumbnail(ref_img))
+                histograms[figure_label] = histograms.get(figure_label, 0) + color_histogram(ref_img)
+        self.labels = labels
+        self.thumbs = normalize_rows(thumbs) if thumbs else np.zeros((0, THUMB_SIZE[0] * THUMB_SIZE[1]), np.float32)
+        self.histograms = np.array([histograms[label] / labels.count(label) for label in self.figures],
+                                   dtype=np.float32)
+        self.stats = self._signature()
+        self._save()
+
+    def _save(self):
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f,
+                         version=np.array(INDEX_VERSION),
+                         paths=np.array([os.path.relpath(p, self.ref_root) for p in self.ref_paths]),
+                         stats=self.stats,
+                         labels=np.array(self.labels),
+                         thumbs=self.thumbs,
+                         histograms=self.histograms)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"拼图索引缓存写入失败: {e}")
+
+    def is_stale(self):
+        paths = []
+        for ref_dir in discover_figures(self.ref_root).values():
+            paths.extend(reference_sources(ref_dir))
+        if paths != self.ref_paths:
+            return True
+        try:
+            return not np.array_equal(self.stats, self._signature())
+        except OSError:
+            return True
+
+    def identify(self, screenshot_area, auto_crop=False):
+        # 返回 (拼图编号, {拼图编号: 得分})，得分越高越可能是该图
+        # auto_crop 时截图未裁剪，拼图区域外的内容会干扰整图的描述子：按每幅图的行列数和碎片定位拼图区域，
+        # 只在各自裁剪出的区域上计算该图的得分
+        if not auto_crop:
+            return self._best(self.score(screenshot_area, self.figures))
+        from board_locator import crop_board
+        from template_bank import get_template_bank
+        # 描述子只用 256 像素的缩略图，定位也在小图上粗略进行即可
+        h, w = screenshot_area.shape[:2]
+        scale = min(1.0, LOCATE_SIZE / max(h, w))
+        small = cv2.resize(screenshot_area, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        scores = {}
+        for figure_label, ref_dir in self.figures.items():
+            crop, _ = crop_board(small, get_template_bank(ref_dir), work_size=LOCATE_SIZE // 2, steps=8, refine=False)
+            scores.update(self.score(crop, [figure_label]))
+        return self._best(scores)
+
+    @staticmethod
+    def _best(scores):
+        best = max(scores, key=scores.get) if scores else None
+        return best, scores
+
+    def score(self, screenshot_area, figure_labels):
+        h, w = screenshot_area.shape[:2]
+        scale = min(1.0, 256 / max(h, w))
+        small = cv2.resize(screenshot_area, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        sh, sw = small.shape[:2]
+
+        # 不同的图行列数可能不同，每种网格只切分一次
+        similarities = {}
+        for rows, cols in set(self.grids[figure_label] for figure_label in figure_labels):
+            cells = [thumbnail(small[r * sh // rows:(r + 1) * sh // rows, c * sw // cols:(c + 1) * sw // cols])
+                     for r in range(rows) for c in range(cols)]
+            similarities[rows, cols] = normalize_rows(cells) @ self.thumbs.T
+        hist = color_histogram(small).astype(np.float32)
+
+        scores = {}
+        for fig_idx, figure_label in enumerate(self.figures):
+            if figure_label not in figure_labels:
+                continue
+            pieces = self.piece_groups[figure_label]
+            similarity = similarities[self.grids[figure_label]]
+            # 每个格子取该图中最相似碎片的相关系数，再加上整体颜色分布的相似度
+            thumb_score = float(similarity[:, pieces].max(axis=1).mean())
+            hist_distance = cv2.compareHist(hist, self.histograms[fig_idx], cv2.HISTCMP_BHATTACHARYYA)
+            scores[figure_label] = thumb_score + (1 - hist_distance)
+        return scores
+
+
+def get_figure_index(ref_root='reference_patches'):
+    key = os.path.abspath(ref_root)
+    index = _indexes.get(key)
+    if index is None or index.is_stale():
+        index = FigureIndex(ref_root)
+        _indexes[key] = index
+    return index
+
+
+def identify_figure(screenshot_area, ref_root='reference_patches', auto_crop=False):
+    return get_figure_index(ref_root).identify(screenshot_area, auto_crop)
@@ -0,0 +1,232 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import io
+import os
+import sys
+import json
+import zipfile
+import argparse
+
+import cv2
+import numpy as np
+
+from image_core import preprocess_image
+from cell_matcher import cut_grid_cells
+from feature_matcher import compute_features, create_detector, FEATURE_VERSION, DETECTORS
+from template_bank import BANK_VERSION, file_sha1
+from puzzle_core import (FIGURE_PACK_EXT, PACK_META, DEFAULT_GRID, load_grid, read_pack_meta, reference_sources,
+                         is_figure_pack)
+
+# 图包：一幅图的所有碎片打包成一个 zip 文件(不压缩，加载时一次读入)，包含
+#   meta.json      名称、行列数、碎片名以及模板和描述子的版本
+#   pieces.npy     统一大小的彩色碎片 (碎片数, 高, 宽, 3)
+#   templates.npy  预处理后的灰度模板 (碎片数, 高, 宽)
+#   <特征>_descriptors.npy / _piece_ids.npy / _points.npy  特征点描述子
+PACK_VERSION = 1
+MAX_PIECE_WIDTH = 400  # 碎片宽度超过该值时等比例缩小，与手工切的参考碎片分辨率相当
+_packs = {}
+
+
+# 加载后的图包，所有数组都在内存中
+class FigurePack:
+    def __init__(self, path):
+        self.path = os.path.normpath(path)
+        st = os.stat(path)
+        self.stat = (st.st_size, st.st_mtime_ns)
+        with zipfile.ZipFile(path) as pack:
+            meta = json.loads(pack.read(PACK_META).decode('utf-8'))
+            if meta.get('version') != PACK_VERSION:
+                raise ValueError(f"图包版本不支持: {path}")
+            arrays = {name[:-4]: np.load(io.BytesIO(pack.read(name)))
+                      for name in pack.namelist() if name.endswith('.npy')}
+        self.name = meta.get('name', '')
+        self.rows, self.cols = int(meta['rows']), int(meta['cols'])
+        self.piece_names = list(meta['piece_names'])
+        self.pieces = list(arrays['pieces'])
+        # 预处理或特征提取的方式改过之后，图包中的模板和描述子作废，加载时由碎片重新计算
+        self.templates = list(arrays['templates']) if meta.get('bank_version') == BANK_VERSION else None
+        self.features = {}
+        if self.templates is not None:
+            for kind, version in meta.get('features', {}).items():
+                if version == FEATURE_VERSION and f'{kind}_descriptors' in arrays:
+                    self.features[kind] = (arrays[f'{kind}_descriptors'], arrays[f'{kind}_piece_ids'],
+                                           arrays[f'{kind}_points'])
+
+    def __len__(self):
+        return len(self.pieces)
+
+
+def get_figure_pack(path):
+    # 进程内复用已加载的图包，文件有变动时重新加载
+    key = os.path.abspath(path)
+    pack = _packs.get(key)
+    st = os.stat(path)
+    if pack is None or pack.stat != (st.st_size, st.st_mtime_ns):
+        pack = FigurePack(path)
+        _packs[key] = pack
+    return pack
+
+
+def normalize_pieces(pieces, max_width=MAX_PIECE_WIDTH):
+    # 所有碎片缩放到相同大小(各碎片宽高的中位数)，太大时再等比例缩小到 max_width 宽
+    sizes = np.array([(piece.shape[1], piece.shape[0]) for piece in pieces])
+    width, height = np.median(sizes, axis=0)
+    if max_width and width > max_width:
+        width, height = max_width, height * max_width / width
+    size = (int(round(width)), int(round(height)))
+    return [piece if (piece.shape[1], piece.shape[0]) == size else
+            cv2.resize(piece, size, interpolation=cv2.INTER_AREA if piece.shape[1] > size[0] else cv2.INTER_LINEAR)
+            for piece in pieces]
+
+
+def slice_solved_screenshot(image, rows=3, cols=4, box=None):
+    # 已经拼好的整幅图截图按网格切成碎片，编号按从左到右、从上到下的顺序；box 为拼图区域 (x, y, 宽, 高)
+    if box is not None:
+        x, y, w, h = box
+        image = image[y:y + h, x:x + w]
+    return [cell.copy() for cell in cut_grid_cells(image, rows, cols)]
+
+
+def save_npy(pack, name, array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array))
+    pack.writestr(name + '.npy', buffer.getvalue())
+
+
+def write_figure_pack(path, pieces, rows, cols, name='', piece_names=None, source=None, max_width=MAX_PIECE_WIDTH):
+    # 碎片按编号顺序给出；模板和描述子在这里一次算好，之后加载图包时直接使用
+    if len(pieces) != rows * cols:
+        raise ValueError(f"碎片数 {len(pieces)} 与 {rows} 行 {cols} 列不一致")
+    pieces = normalize_pieces(pieces, max_width)
+    templates = [preprocess_image(piece) for piece in pieces]
+    meta = {
+        'version': PACK_VERSION,
+        'name': name,
+        'rows': rows,
+        'cols': cols,
+        'piece_names': piece_names or [f'{i:02d}' for i in range(1, len(pieces) + 1)],
+        'source': source,
+        'bank_version': BANK_VERSION,
+        'features': {},
+    }
+    features = {}
+    for kind in DETECTORS:
+        try:
+            create_detector(kind)
+        except ValueError:
+            # 当前 OpenCV 不支持的特征类型不打包，使用时再计算
+            continue
+        features[kind] = compute_features(templates, kind)
+        meta['features'][kind] = FEATURE_VERSION
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as pack:
+        pack.writestr(PACK_META, json.dumps(meta, ensure_ascii=False, indent=2))
+        save_npy(pack, 'pieces', np.stack(pieces))
+        save_npy(pack, 'templates', np.stack(templates))
+        for kind, (descriptors, piece_ids, points) in features.items():
+            save_npy(pack, f'{kind}_descriptors', descriptors)
+            save_npy(pack, f'{kind}_piece_ids', piece_ids)
+            save_npy(pack, f'{kind}_points', points)
+    os.replace(tmp_path, path)
+    return meta
+
+
+def pack_from_screenshot(screenshot_path, pack_path, rows=3, cols=4, name='', box=None, max_width=MAX_PIECE_WIDTH):
+    image = cv2.imread(screenshot_path)
+    if image is None:
+        raise ValueError(f"无法加载截图图像: {screenshot_path}")
+    pieces = slice_solved_screenshot(image, rows, cols, box)
+    source = {'screenshot': os.path.basename(screenshot_path), 'sha1': file_sha1(screenshot_path), 'box': box}
+    return write_figure_pack(pack_path, pieces, rows, cols, name, source=source, max_width=max_width)
+
+
+def pack_from_directory(ref_dir, pack_path, name='', max_width=MAX_PIECE_WIDTH):
+    # 把手工切好的参考碎片目录(以及其中的 grid.json)转换为图包
+    ref_paths = reference_sources(ref_dir)
+    if not ref_paths:
+        raise ValueError(f"参考碎片目录不存在或为空: {ref_dir}")
+    pieces = []
+    for ref_path in ref_paths:
+        piece = cv2.imread(ref_path)
+        if piece is None:
+            raise ValueError(f"无法加载参考碎片: {ref_path}")
+        pieces.append(piece)
+    rows, cols = load_grid(ref_dir, len(pieces))
+    piece_names = [os.path.splitext(os.path.basename(p))[0] for p in ref_paths]
+    source = {'directory': os.path.basename(os.path.normpath(ref_dir))}
+    return write_figure_pack(pack_path, pieces, rows, cols, name, piece_names, source, max_width)
+
+
+def grid_arg(value):
+    try:
+        rows, cols = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("网格格式应为 行x列，例如 3x4")
+    return rows, cols
+
+
+def box_arg(value):
+    try:
+        box = tuple(int(v) for v in value.split(','))
+    except ValueError:
+        box = ()
+    if len(box) != 4:
+        raise argparse.ArgumentTypeError("拼图区域格式应为 x,y,宽,高")
+    return box
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='制作图包：把一幅拼图的碎片、预处理模板和特征描述子打包成一个文件')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = sub.add_parser('build', help='由拼好的整幅图截图切分碎片并生成图包')
+    build_parser.add_argument('screenshot', help='已经拼好的整幅图截图')
+    build_parser.add_argument('figure_label', help='图编号，例如 08')
+    build_parser.add_argument('--name', default='', help='拼图名称，显示在界面的拼图列表中')
+    build_parser.add_argument('--grid', type=grid_arg, default=DEFAULT_GRID, help='行x列，默认 3x4')
+    build_parser.add_argument('--box', type=box_arg, default=None, help='截图未裁剪时拼图区域的 x,y,宽,高')
+
+    convert_parser = sub.add_parser('convert', help='把已有的参考碎片目录转换为图包')
+    convert_parser.add_argument('figure_label', help='图编号，例如 01')
+    convert_parser.add_argument('--name', default='', help='拼图名称')
+
+    list_parser = sub.add_parser('list', help='列出参考碎片目录下的所有图包')
+    for p in (build_parser, convert_parser):
+        p.add_argument('--max-width', type=int, default=MAX_PIECE_WIDTH, help='碎片最大宽度，0 表示不缩小')
+        p.add_argument('--force', action='store_true', help='图包已存在时覆盖')
+    for p in (build_parser, convert_parser, list_parser):
+        p.add_argument('--ref-root', default='reference_patches')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for path in sorted(os.path.join(args.ref_root, f) for f in os.listdir(args.ref_root)):
+            if is_figure_pack(path):
+                meta = read_pack_meta(path)
+                print(f"{os.path.basename(path)}: {meta.get('name') or '(未命名)'}，"
+                      f"{meta['rows']} 行 {meta['cols']} 列，来源 {meta.get('source')}")
+        return 0
+
+    figure_label = args.figure_label.zfill(2)
+    pack_path = os.path.join(args.ref_root, f'fig{figure_label}{FIGURE_PACK_EXT}')
+    if os.path.exists(pack_path) and not args.force:
+        print(f"图包已存在: {pack_path}，覆盖请加 --force")
+        return 1
+    try:
+        if args.command == 'build':
+            rows, cols = args.grid
+            meta = pack_from_screenshot(args.screenshot, pack_path, rows, cols, args.name, args.box, args.max_width)
+        else:
+            ref_dir = os.path.join(args.ref_root, f'fig{figure_label}')
+            meta = pack_from_directory(ref_dir, pack_path, args.name, args.max_width)
+    except ValueError as e:
+        print(f"生成图包失败: {e}")
+        return 1
+    print(f"图包已保存至: {pack_path}({meta['rows']} 行 {meta['cols']} 列，{len(meta['piece_names'])} 个碎片，"
+          f"特征: {', '.join(meta['features']) or '无'})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
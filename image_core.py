@@ -0,0 +1,225 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import numpy as np
+
+import profiler
+from puzzle_core import is_figure_pack, reference_sources
+
+# 图像预处理、模板匹配和整幅截图匹配，命令行、界面、服务以及各匹配模块共用
+
+# auto: 先用整格相关系数快速分配，只有不确定的格子才退回到窗口内模板匹配
+DEFAULT_MATCHER = 'auto'
+MATCHERS = ('auto', 'template', 'cells', 'orb', 'akaze')
+# 金字塔最粗一层的模板边长下限：模板缩得太小(例如 20 像素)时缩小图上别处的峰值可能高于真实位置，
+# 只在原图上精确匹配一个候选就会选错，层数因此按模板大小封顶
+MIN_PYRAMID_TEMPLATE = 32
+
+
+def preprocess_image(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.equalizeHist(gray)
+    gray = cv2.GaussianBlur(gray, (3, 3), 0)
+    return gray
+
+
+def auto_pyramid_levels(shape, target_size=400):
+    # 让最粗一层的长边不超过 target_size，使匹配耗时基本与截图分辨率无关
+    levels = 0
+    size = max(shape[:2])
+    while size > target_size:
+        size //= 2
+        levels += 1
+    return levels
+
+
+def effective_pyramid_levels(shape, template_shape, pyramid_levels=0, min_template_size=MIN_PYRAMID_TEMPLATE):
+    # 模板缩小后不能小于 min_template_size，否则减少层数
+    if pyramid_levels == 'auto':
+        pyramid_levels = auto_pyramid_levels(shape)
+    th, tw = template_shape[:2]
+    levels = 0
+    while levels < pyramid_levels and min(th, tw) >> (levels + 1) >= min_template_size:
+        levels += 1
+    return levels
+
+
+def match_template(screenshot_gray, template, method, pyramid_levels=0, candidates=1,
+                   min_template_size=MIN_PYRAMID_TEMPLATE):
+    # 返回整图上的 (最高匹配度, 左上角坐标)；pyramid_levels > 0 时先在缩小图上找候选位置，再在原图小窗口内精确匹配
+    th, tw = template.shape[:2]
+    levels = effective_pyramid_levels(screenshot_gray.shape, template.shape, pyramid_levels, min_template_size)
+
+    if levels == 0:
+        result = cv2.matchTemplate(screenshot_gray, template, method)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    small_gray = screenshot_gray
+    small_template = template
+    for _ in range(levels):
+        small_gray = cv2.pyrDown(small_gray)
+        small_template = cv2.pyrDown(small_template)
+    coarse = cv2.matchTemplate(small_gray, small_template, method)
+
+    scale = 2 ** levels
+    radius = scale
+    h, w = screenshot_gray.shape[:2]
+    sh, sw = small_template.shape[:2]
+    best_val = -1.0
+    best_loc = None
+    for _ in range(candidates):
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(coarse)
+        x0 = max(max_loc[0] * scale - radius, 0)
+        y0 = max(max_loc[1] * scale - radius, 0)
+        x1 = min(max_loc[0] * scale + tw + radius, w)
+        y1 = min(max_loc[1] * scale + th + radius, h)
+        window = screenshot_gray[y0:y1, x0:x1]
+        if window.shape[0] >= th and window.shape[1] >= tw:
+            result = cv2.matchTemplate(window, template, method)
+            min_val, max_val, min_loc, max_loc_fine = cv2.minMaxLoc(result)
+            if max_val > best_val:
+                best_val = max_val
+                best_loc = (max_loc_fine[0] + x0, max_loc_fine[1] + y0)
+        # 屏蔽已检查候选附近的区域，下一个候选取别处的峰值
+        coarse[max(max_loc[1] - sh // 2, 0):max_loc[1] + sh // 2 + 1,
+               max(max_loc[0] - sw // 2, 0):max_loc[0] + sw // 2 + 1] = -1
+    return best_val, best_loc
+
+
+def prepare_templates(screenshot_gray, ref_pieces=None, bank=None, rows=3, cols=4):
+    # 参考碎片缩放到截图中一个格子的大小
+    h, w = screenshot_gray.shape[:2]
+    if bank is not None:
+        return bank.resized((w // cols, h // rows))
+    return [cv2.resize(preprocess_image(ref_piece), (w // cols, h // rows)) for ref_piece in ref_pieces]
+
+
+def score_reference_pieces(screenshot_area, ref_pieces, bank=None, pyramid_levels=0, rows=3, cols=4):
+    # 每个碎片只匹配一次，缓存最高匹配度及中心坐标，供不同阈值复用
+    with profiler.span('preprocess'):
+        screenshot_gray = preprocess_image(screenshot_area)
+        ref_templates = prepare_templates(screenshot_gray, ref_pieces, bank, rows, cols)
+    return score_templates(screenshot_gray, ref_templates, pyramid_levels)
+
+
+def score_templates(screenshot_gray, ref_templates, pyramid_levels=0):
+    if ref_templates and effective_pyramid_levels(screenshot_gray.shape, ref_templates[0].shape, pyramid_levels) == 0:
+        # 不用金字塔时所有碎片共用一次截图 DFT 和预分配的缓冲区，结果与逐个碎片 matchTemplate 相同
+        from match_kernel import get_match_kernel
+        best_results = get_match_kernel(ref_templates, screenshot_gray.shape).score(screenshot_gray)
+    else:
+        best_results = [match_piece(screenshot_gray, ref_resized, pyramid_levels, ref_idx)
+                        for ref_idx, ref_resized in enumerate(ref_templates)]
+
+    piece_scores = []
+    for (best_match_val, best_match_loc), ref_resized in zip(best_results, ref_templates):
+        center = None
+        if best_match_loc is not None:
+            center = (best_match_loc[0] + ref_resized.shape[1] // 2,
+                      best_match_loc[1] + ref_resized.shape[0] // 2)
+        piece_scores.append((best_match_val, center))
+    return piece_scores
+
+
+def match_piece(screenshot_gray, ref_resized, pyramid_levels=0, ref_idx=0):
+    methods = [cv2.TM_CCOEFF_NORMED, cv2.TM_CCORR_NORMED]
+
+    best_match_val = 0
+    best_match_loc = None
+
+    with profiler.span('match_piece', piece=ref_idx + 1) as span_args:
+        for method in methods:
+            max_val, max_loc = match_template(screenshot_gray, ref_resized, method, pyramid_levels)
+
+            if max_val > best_match_val:
+                best_match_val = max_val
+                best_match_loc = max_loc
+        span_args['score'] = float(best_match_val)
+    return best_match_val, best_match_loc
+
+
+def select_matches(piece_scores, threshold, verbose=True):
+    matches = {}
+    for ref_idx, (best_match_val, center) in enumerate(piece_scores):
+        if best_match_val >= threshold:
+            matches[center] = ref_idx + 1
+        elif verbose:
+            print(f"未找到碎片 {ref_idx + 1}, 最高匹配度: {best_match_val:.2f}")
+    return matches
+
+
+def sweep_thresholds(piece_scores, verbose=True):
+    # 在缓存的匹配度上扫描阈值，保留找到碎片最多的一组
+    best_matches = {}
+    best_threshold = None
+    with profiler.span('sweep_thresholds') as span_args:
+        for threshold in np.arange(0.4, 0.8, 0.05):
+            matches = select_matches(piece_scores, threshold, verbose=False)
+
+            if len(matches) > len(best_matches):
+                best_matches = matches
+                best_threshold = threshold
+        span_args['threshold'] = None if best_threshold is None else round(float(best_threshold), 2)
+    if verbose and best_threshold is not None:
+        select_matches(piece_scores, best_threshold)
+    return best_matches
+
+
+def find_pieces_with_improved_matching(screenshot_area, ref_pieces, threshold=0.6, bank=None, pyramid_levels=0,
+                                       rows=3, cols=4):
+    piece_scores = score_reference_pieces(screenshot_area, ref_pieces, bank, pyramid_levels, rows, cols)
+    return select_matches(piece_scores, threshold)
+
+
+def load_reference_pieces(ref_dir):
+    if is_figure_pack(ref_dir):
+        from figure_pack import get_figure_pack
+        return list(get_figure_pack(ref_dir).pieces)
+    ref_files = reference_sources(ref_dir)
+
+    ref_pieces = []
+    for ref_path in ref_files:
+        ref_img = cv2.imread(ref_path)
+        ref_pieces.append(ref_img)
+    return ref_pieces
+
+
+def match_screenshot(screenshot_area, ref_pieces=None, bank=None, single_pass=True, matcher=DEFAULT_MATCHER,
+                     pyramid_levels=0, rows=3, cols=4):
+    # 返回 (中心坐标 -> 碎片编号, 每个碎片的 (匹配度, 中心坐标), 每个格子的置信度)
+    # 逐阈值重新匹配时不保留匹配度；只有按格子分配的方式(cells/auto)给出格子置信度
+    best_matches = {}
+    piece_scores = None
+    margins = None
+
+    if matcher in ('cells', 'auto'):
+        # 按格子切分后一次算出相关系数矩阵，再用匈牙利算法分配，保证每个格子对应唯一碎片
+        # auto 时不确定的格子再做窗口内模板匹配
+        from cell_matcher import match_cells
+        piece_scores, margins = match_cells(screenshot_area, ref_pieces, bank, rows, cols, matcher == 'auto',
+                                            pyramid_levels)
+        for ref_idx, (score, center) in enumerate(piece_scores):
+            if center is not None:
+                best_matches[center] = ref_idx + 1
+    elif matcher in ('orb', 'akaze'):
+        # 特征点匹配：对光照、轻微缩放和压缩失真更稳健，参考碎片的描述子按图缓存
+        from feature_matcher import match_features
+        if bank is None:
+            raise ValueError("特征点匹配需要使用模板库")
+        piece_scores = match_features(screenshot_area, bank, matcher, rows, cols)
+        for ref_idx, (score, center) in enumerate(piece_scores):
+            if center is not None:
+                best_matches[center] = ref_idx + 1
+    elif single_pass:
+        # 匹配度只计算一次，再在缓存结果上扫描阈值，结果与逐阈值重新匹配一致
+        piece_scores = score_reference_pieces(screenshot_area, ref_pieces, bank, pyramid_levels, rows, cols)
+        best_matches = sweep_thresholds(piece_scores)
+    else:
+        for threshold in np.arange(0.4, 0.8, 0.05):
+            matches = find_pieces_with_improved_matching(screenshot_area, ref_pieces, threshold, bank,
+                                                         pyramid_levels, rows, cols)
+
+            if len(matches) > len(best_matches):
+                best_matches = matches
+    return best_matches, piece_scores, margins
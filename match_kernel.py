@@ -0,0 +1,138 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import profiler
+from memory_budget import budget_bytes, memory_budget_mb
+
+MAX_SPECTRA_BYTES = 64 * 1024 * 1024  # 缓存的模板频谱总大小上限，超过时每次匹配重新计算模板频谱
+_kernels = OrderedDict()
+_kernels_lock = threading.Lock()
+KERNEL_CACHE_SIZE = 4
+
+
+def normalize_scores(num, norms, template_norm, out):
+    # 分子除以 (截图窗口的模长 * 模板的模长)；与 OpenCV 的处理一致，分母接近 0(平坦区域)时，
+    # |分子| 明显超过分母的位置记为 0，其余截断到 [-1, 1]
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.divide(num, norms, out=out)
+        out *= np.float32(1 / template_norm) if template_norm > 0 else np.float32(np.inf)
+    out[~(np.abs(out) <= 1.125)] = 0
+    return np.clip(out, -1, 1, out=out)
+
+
+# 同一组尺寸相同的模板与同一尺寸截图的批量匹配：截图只做一次 DFT，每个模板一次频谱相乘和逆变换，
+# 同时得到 TM_CCORR_NORMED 和 TM_CCOEFF_NORMED 两种匹配度(窗口内的和与平方和由积分图求出，所有模板共用)
+class MatchKernel:
+    def __init__(self, templates, screenshot_shape):
+        self.templates = templates
+        self.shape = screenshot_shape[:2]
+        self.template_shape = templates[0].shape[:2] if templates else (0, 0)
+        h, w = self.shape
+        th, tw = self.template_shape
+        self.dft_shape = (cv2.getOptimalDFTSize(h), cv2.getOptimalDFTSize(w))
+        self.result_shape = (h - th + 1, w - tw + 1)
+
+        stack = np.stack(templates).reshape(len(templates), -1).astype(np.float64) if templates else np.zeros((0, 1))
+        self.means = stack.mean(axis=1)
+        sq_sums = (stack * stack).sum(axis=1)
+        self.norms = np.sqrt(sq_sums)  # 模板的模长，TM_CCORR_NORMED 的分母
+        self.centered_norms = np.sqrt(np.maximum(sq_sums - stack.sum(axis=1) * self.means, 0))  # 去均值后的模长
+        self.spectra = None
+        if len(templates) * self.dft_shape[0] * self.dft_shape[1] * 4 <= budget_bytes(MAX_SPECTRA_BYTES):
+            self.spectra = [self.template_spectrum(t, np.zeros(self.dft_shape, dtype=np.float32))
+                            for t in templates]
+        self._buffers = threading.local()
+
+    def template_spectrum(self, template, padded):
+        th, tw = self.template_shape
+        padded[:th, :tw] = template
+        return cv2.dft(padded)
+
+    def buffers(self):
+        # 每个线程一组预分配的缓冲区，在各模板和各次调用之间复用
+        buffers = getattr(self._buffers, 'value', None)
+        if buffers is None:
+            buffers = {name: np.zeros(self.dft_shape, dtype=np.float32)
+                       for name in ('image', 'template', 'product', 'result')}
+            buffers.update({name: np.zeros(self.result_shape, dtype=np.float32) for name in ('numerator', 'scores')})
+            self._buffers.value = buffers
+        return buffers
+
+    def window_sums(self, screenshot_gray):
+        th, tw = self.template_shape
+        rh, rw = self.result_shape
+        total, sq_total = cv2.integral2(screenshot_gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+        def box(integral):
+            return (integral[th:th + rh, tw:tw + rw] - integral[:rh, tw:tw + rw]
+                    - integral[th:th + rh, :rw] + integral[:rh, :rw])
+        return box(total), box(sq_total)
+
+    def score(self, screenshot_gray):
+        # 返回每个模板的 (最高匹配度, 左上角坐标)，取两种归一化匹配方式中较高的一个
+        rh, rw = self.result_shape
+        if rh <= 0 or rw <= 0:
+            return [(0, None)] * len(self.templates)
+        h, w = self.shape
+        th, tw = self.template_shape
+        buffers = self.buffers()
+        image = buffers['image']
+        image[:h, :w] = screenshot_gray
+        with profiler.span('screenshot_dft'):
+            image_spectrum = cv2.dft(image)
+            sums, sq_sums = self.window_sums(screenshot_gray)
+            # 分母中与截图有关的部分所有模板共用，只算一次；之后都用 float32 计算
+            window_centered_norms = np.sqrt(np.maximum(sq_sums - sums * sums / (th * tw), 0)).astype(np.float32)
+            window_norms = np.sqrt(sq_sums).astype(np.float32)
+            sums = sums.astype(np.float32)
+
+        piece_scores = []
+        for ref_idx, template in enumerate(self.templates):
+            with profiler.span('match_piece', piece=ref_idx + 1) as span_args:
+                if self.spectra is not None:
+                    spectrum = self.spectra[ref_idx]
+                else:
+                    spectrum = self.template_spectrum(template, buffers['template'])
+                cv2.mulSpectrums(image_spectrum, spectrum, 0, buffers['product'], conjB=True)
+                cv2.idft(buffers['product'], buffers['result'], cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+                corr = buffers['result'][:rh, :rw]
+
+                # TM_CCOEFF_NORMED: 去均值后的互相关 = 互相关 - 模板均值 * 窗口内的和
+                numerator = buffers['numerator']
+                np.multiply(sums, np.float32(self.means[ref_idx]), out=numerator)
+                np.subtract(corr, numerator, out=numerator)
+                best_val = 0
+                best_loc = None
+                for num, window_norm, template_norm in ((numerator, window_centered_norms,
+                                                         self.centered_norms[ref_idx]),
+                                                        (corr, window_norms, self.norms[ref_idx])):
+                    scores = normalize_scores(num, window_norm, template_norm, buffers['scores'])
+                    _, max_val, _, max_loc = cv2.minMaxLoc(scores)
+                    if max_val > best_val:
+                        best_val = max_val
+                        best_loc = max_loc
+                span_args['score'] = float(best_val)
+            piece_scores.append((best_val, best_loc))
+        return piece_scores
+
+
+def get_match_kernel(templates, screenshot_shape):
+    # 模板列表来自模板库的缩放缓存时对象不变，按 (模板列表, 截图尺寸) 复用已计算的模板频谱
+    key = (id(templates), tuple(screenshot_shape[:2]))
+    with _kernels_lock:
+        kernel = _kernels.get(key)
+        if kernel is not None and kernel.templates is templates:
+            _kernels.move_to_end(key)
+            return kernel
+    kernel = MatchKernel(templates, screenshot_shape)
+    with _kernels_lock:
+        _kernels[key] = kernel
+        # 内存受限模式下只保留最近一个，缓冲区和频谱不在多个截图尺寸之间累积
+        while len(_kernels) > (1 if memory_budget_mb() is not None else KERNEL_CACHE_SIZE):
+            _kernels.popitem(last=False)
+    return kernel
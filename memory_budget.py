@@ -0,0 +1,112 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import sys
+import struct
+
+import cv2
+
+# 内存受限模式：截图解码时直接缩小到够用的分辨率，模板频谱少缓存，并记录每张截图处理时的峰值内存
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+_budget_mb = None
+
+
+def set_memory_budget(budget_mb):
+    # None 表示不限制；批量处理的子进程在启动时设置
+    global _budget_mb
+    _budget_mb = budget_mb
+
+
+def memory_budget_mb():
+    return _budget_mb
+
+
+def budget_bytes(default):
+    # 受内存预算限制的缓存上限：不限制时为 default，否则不超过预算的 1/4
+    if _budget_mb is None:
+        return default
+    return min(default, int(_budget_mb * 1024 * 1024 / 4))
+
+
+def image_size(path):
+    # 只读文件头得到 (宽, 高)，不解码图像；目前支持 PNG 和 JPEG，其它格式返回 None
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(24)
+            if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if head[:2] != b'\xff\xd8':
+                return None
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                length = struct.unpack('>H', f.read(2))[0]
+                # SOF0~SOF15 中除 DHT(C4)、JPG(C8)、DAC(CC) 以外的段记录了图像尺寸
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def reduce_factor(size, min_size):
+    # 缩小后宽高仍不小于 min_size(参考碎片拼成整幅图的大小)的最大缩小倍数，匹配精度不受影响
+    if size is None or min_size is None:
+        return 1
+    for factor, _ in REDUCED_FLAGS:
+        if size[0] // factor >= min_size[0] and size[1] // factor >= min_size[1]:
+            return factor
+    return 1
+
+
+def load_screenshot(path, min_size=None, reduce=None):
+    # 返回 (截图, 缩小倍数)；reduce 为 None 时只在设置了内存预算时缩小解码
+    # JPEG 用 libjpeg 的 DCT 缩放直接解码出小图，不会先得到整幅大图
+    if reduce is None:
+        reduce = _budget_mb is not None
+    factor = reduce_factor(image_size(path), min_size) if reduce else 1
+    flag = dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    return cv2.imread(path, flag), factor
+
+
+def reset_peak_rss():
+    # Linux 上把进程的峰值内存(VmHWM)重置为当前值，之后读到的就是这一段处理的峰值；其它平台不支持时返回 False
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows 没有 resource 模块
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def jobs_for_budget(budget_mb, jobs=None):
+    # 按可用内存限制并行进程数，保证每个进程都能用到 budget_mb；读不到可用内存时不限制
+    try:
+        with open('/proc/meminfo') as f:
+            available = next(int(line.split()[1]) / 1024 for line in f if line.startswith('MemAvailable:'))
+    except (OSError, StopIteration):
+        return jobs
+    jobs = jobs or os.cpu_count() or 1
+    return max(1, min(jobs, int(available // budget_mb)))
@@ -0,0 +1,113 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import queue
+import atexit
+import threading
+
+import cv2
+
+import profiler
+from memory_budget import memory_budget_mb
+
+# 标注图的保存格式：same 与截图相同，none 只输出碎片顺序等结果，不保存标注图
+OUTPUT_FORMATS = ('same', 'png', 'jpg', 'webp', 'none')
+EXTENSIONS = {'png': '.png', 'jpg': '.jpg', 'webp': '.webp'}
+DEFAULT_OUTPUT_OPTIONS = {'format': 'same', 'quality': None, 'png_level': None}
+MAX_PENDING = 4  # 排队等待保存的标注图数量上限，每张都占着一幅整图的内存
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def output_path_for(output_dir, screenshot_path, output_format='same'):
+    # output/figXX/<截图名>_annotated.<扩展名>；不保存标注图时返回 None
+    if output_format == 'none':
+        return None
+    name, ext = os.path.splitext(os.path.basename(screenshot_path))
+    return os.path.join(output_dir, f"{name}_annotated{EXTENSIONS.get(output_format, ext)}")
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='same',
+                        help='标注图格式：same 与截图相同，none 只输出碎片顺序，不保存标注图')
+    parser.add_argument('--quality', type=int, default=None, help='JPEG/WebP 标注图的质量(1~100)')
+    parser.add_argument('--png-level', type=int, choices=range(10), default=None, metavar='0-9',
+                        help='PNG 标注图的压缩级别，越大文件越小、保存越慢；不指定时用 OpenCV 默认的快速压缩')
+
+
+def output_options_from_args(args):
+    return {'format': args.output_format, 'quality': args.quality, 'png_level': args.png_level}
+
+
+def encode_params(output_path, quality=None, png_level=None):
+    # quality 用于 JPEG/WebP(1~100)，png_level 为 PNG 压缩级别(0~9，越大越慢、文件越小)；不指定时用 OpenCV 的默认值
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext in ('.jpg', '.jpeg') and quality is not None:
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if ext == '.webp' and quality is not None:
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if ext == '.png' and png_level is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(png_level)]
+    return []
+
+
+# 后台保存标注图：绘制和编码在单独的线程中进行，下一张截图的匹配与上一张的编码、写盘同时进行
+# 队列有上限，编码跟不上时 submit 会等待，排队的整图不会无限堆积
+class OutputWriter:
+    def __init__(self, max_pending=MAX_PENDING):
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.failures = []
+        self.thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, on_done=None):
+        # 在后台线程中执行 func(*args)，成功后再调用 on_done()(例如写入结果缓存)
+        self.queue.put((func, args, on_done))
+
+    def _run(self):
+        while True:
+            func, args, on_done = self.queue.get()
+            try:
+                func(*args)
+                if on_done is not None:
+                    on_done()
+            except Exception as e:
+                print(f"标注图保存失败: {e}")
+                self.failures.append(str(e))
+            finally:
+                self.queue.task_done()
+
+    def notify(self, callback):
+        # 不等待：排在已提交的保存之后调用 callback(failures)，failures 为上次通知以来保存失败的信息
+        self.queue.put((self._notify, (callback,), None))
+
+    def _notify(self, callback):
+        failures, self.failures = self.failures, []
+        callback(failures)
+
+    def flush(self):
+        # 等待已提交的标注图全部保存完，返回这期间保存失败的信息
+        with profiler.span('flush_output'):
+            self.queue.join()
+        failures, self.failures = self.failures, []
+        return failures
+
+
+def get_output_writer():
+    # 每个进程一个后台线程；进程退出前保存完排队的标注图(批量处理的子进程由 multiprocessing 的退出清理负责)
+    global _writer
+    with _writer_lock:
+        # fork 出的子进程继承了父进程的对象但没有后台线程，需要重新创建
+        if _writer is None or _writer.pid != os.getpid():
+            from multiprocessing import util
+            # 内存受限模式下最多只有一张标注图在排队
+            _writer = OutputWriter(1 if memory_budget_mb() is not None else MAX_PENDING)
+            atexit.register(_writer.flush)
+            util.Finalize(_writer, _writer.flush, exitpriority=10)
+    return _writer
+
+
+def flush_output():
+    # 没有提交过标注图时不创建后台线程
+    return _writer.flush() if _writer is not None and _writer.pid == os.getpid() else []
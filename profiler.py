@@ -0,0 +1,109 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import csv
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+# 开启方式: 设置环境变量 SWAP_SORT_PROFILE=输出路径，或命令行加 --profile 输出路径
+# 输出路径以 .csv 结尾时写成表格，否则写成 Chrome trace 格式的 JSON(可在 chrome://tracing 或 Perfetto 中打开)
+ENV_VAR = 'SWAP_SORT_PROFILE'
+
+_events = []
+_lock = threading.Lock()
+_enabled = False
+_output_path = None
+
+
+def enable(output_path=None):
+    # 不给输出路径时只收集，不写文件(例如批量处理的子进程，由主进程汇总后统一写出)
+    global _enabled, _output_path
+    _enabled = True
+    if output_path:
+        _output_path = output_path
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+@contextmanager
+def span(name, **args):
+    # 记录一段耗时，yield 出的字典可以在代码块内补充结果(例如匹配度)，一起写入该段的 args
+    if not _enabled:
+        yield {}
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        event = {
+            'name': name,
+            'cat': name.split('.')[0],
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with _lock:
+            _events.append(event)
+
+
+def take_events():
+    # 取出并清空已记录的事件
+    global _events
+    with _lock:
+        events, _events = _events, []
+    return events
+
+
+def add_events(events):
+    with _lock:
+        _events.extend(events)
+
+
+def save(output_path=None):
+    output_path = output_path or _output_path
+    if not output_path:
+        return None
+    with _lock:
+        events = sorted(_events, key=lambda e: e['ts'])
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if output_path.lower().endswith('.csv'):
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'pid', 'tid', 'start_ms', 'duration_ms', 'args'])
+            t0 = events[0]['ts'] if events else 0
+            for e in events:
+                writer.writerow([e['name'], e['pid'], e['tid'], f"{(e['ts'] - t0) / 1000:.3f}",
+                                 f"{e['dur'] / 1000:.3f}", json.dumps(e['args'], ensure_ascii=False)])
+    else:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+    print(f"性能分析结果已保存至: {output_path}，共 {len(events)} 条记录")
+    return output_path
+
+
+def _save_at_exit():
+    if _enabled and _output_path:
+        save()
+
+
+# 只在主进程中按环境变量开启，子进程继承环境变量时不会各自覆盖同一个输出文件
+# multiprocessing 导入较慢，只在设置了环境变量时才导入
+if os.environ.get(ENV_VAR):
+    import multiprocessing
+    if multiprocessing.parent_process() is None:
+        enable(os.environ[ENV_VAR])
+atexit.register(_save_at_exit)
@@ -0,0 +1,295 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+# 不依赖 OpenCV、numpy 和 PyQt5 的核心逻辑：网格配置、碎片顺序和交换步骤。
+# 命令行、批量处理、HTTP 服务和界面共用这里的实现，只需要交换步骤时不必加载图像处理相关的库
+import os
+import re
+import glob
+import json
+import time
+import heapq
+import zipfile
+
+import profiler
+
+
+GRID_CONFIG = 'grid.json'
+DEFAULT_GRID = (3, 4)
+FIGURE_PACK_EXT = '.figpack'  # 图包：一幅图的碎片、预处理模板、特征描述子和名称、行列数打包成的单个文件
+PACK_META = 'meta.json'
+
+
+def natural_sort_key(s):
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+
+
+def is_figure_pack(ref_dir):
+    return os.path.normpath(ref_dir).endswith(FIGURE_PACK_EXT) and os.path.isfile(ref_dir)
+
+
+def read_pack_meta(pack_path):
+    # 图包是 zip 文件，元数据单独存为 JSON，只读名称和行列数时不需要 numpy
+    with zipfile.ZipFile(pack_path) as pack:
+        return json.loads(pack.read(PACK_META).decode('utf-8'))
+
+
+def reference_sources(ref_dir):
+    # 一幅图的参考碎片源文件：图包就是它本身，碎片目录为其中按自然顺序排列的 PNG
+    if is_figure_pack(ref_dir):
+        return [os.path.normpath(ref_dir)]
+    return sorted(glob.glob(os.path.join(ref_dir, '*.png')), key=natural_sort_key)
+
+
+def discover_figures(ref_root):
+    # 返回 {拼图编号: 参考碎片目录或图包}；figXX 目录和 figXX.figpack 图包同时存在时使用图包
+    figures = {}
+    for path in glob.glob(os.path.join(ref_root, 'fig*')):
+        match = re.fullmatch(r'fig(\d+)(' + re.escape(FIGURE_PACK_EXT) + ')?', os.path.basename(path))
+        if not match or not (os.path.isfile(path) if match.group(2) else os.path.isdir(path)):
+            continue
+        if match.group(2) or match.group(1) not in figures:
+            figures[match.group(1)] = path
+    return {label: figures[label] for label in sorted(figures, key=natural_sort_key)}
+
+
+def figure_path(ref_root, figure_label):
+    # 编号对应的参考碎片目录或图包，都不存在时返回目录路径，由调用方报错
+    return discover_figures(ref_root).get(figure_label, os.path.join(ref_root, f'fig{figure_label}'))
+
+
+def figure_name(ref_dir):
+    # 图包中记录的拼图名称，碎片目录没有名称时返回 None
+    if not is_figure_pack(ref_dir):
+        return None
+    return read_pack_meta(ref_dir).get('name') or None
+
+
+def load_grid(ref_dir, piece_count=None):
+    # 每幅图的行列数写在参考碎片目录的 grid.json 中，例如 {"rows": 6, "cols": 6}；图包的行列数在元数据中
+    # 没有配置文件时默认 3 行 4 列；碎片数不是 12 但恰好是平方数时按正方形网格处理
+    if is_figure_pack(ref_dir):
+        meta = read_pack_meta(ref_dir)
+        return int(meta['rows']), int(meta['cols'])
+    config_path = os.path.join(ref_dir, GRID_CONFIG)
+    if os.path.exists(config_path):
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+        return int(config['rows']), int(config['cols'])
+    if piece_count and piece_count != DEFAULT_GRID[0] * DEFAULT_GRID[1]:
+        side = int(round(piece_count ** 0.5))
+        if side * side == piece_count:
+            return side, side
+    return DEFAULT_GRID
+
+
+def get_piece_order(screenshot_area, matches, rows=3, cols=4):
+    h, w = screenshot_area.shape[:2]
+    block_h = h // rows
+    block_w = w // cols
+    piece_order = [0] * (rows * cols)
+    with profiler.span('piece_order', pieces=len(matches)):
+        for (x, y), number in matches.items():
+            row = y // block_h
+            col = x // block_w
+            if 0 <= row < rows and 0 <= col < cols:
+                piece_order[row * cols + col] = number
+    return piece_order
+
+
+def min_swap_sort(arr, **options):
+    # options 与 plan_swaps 相同；返回 (交换步骤, 原数组)
+    with profiler.span('swap_plan', pieces=len(arr), planner=options.get('planner', 'cycles')) as span_args:
+        swaps = plan_swaps(arr, **options)
+        span_args['swaps'] = len(swaps)
+    return swaps, arr
+
+
+def grid_cols(n):
+    # 没有给出列数时按碎片数推断，与 load_grid 的默认规则一致
+    if n == DEFAULT_GRID[0] * DEFAULT_GRID[1]:
+        return DEFAULT_GRID[1]
+    side = int(round(n ** 0.5))
+    return side if side * side == n else n
+
+
+SWAP_COSTS = ('count', 'distance')
+
+
+def swap_cost_fn(cost='count', cols=4):
+    # count: 每次交换代价为 1；distance: 两个格子的曼哈顿距离，相邻交换最便宜；也可以直接传入 cost(i, j) 函数
+    if callable(cost):
+        return cost
+    if cost == 'count':
+        return lambda i, j: 1
+    if cost == 'distance':
+        return lambda i, j: abs(i // cols - j // cols) + abs(i % cols - j % cols)
+    raise ValueError(f"未知的交换代价: {cost}")
+
+
+def target_positions(arr, locked=()):
+    # 每个位置上的碎片应当移到的位置：编号 k 的碎片属于第 k-1 个位置
+    # 0(未识别)、重复和超出范围的编号没有确定的位置，依次填入没有碎片认领的空位，已经在空位上的保持不动
+    # locked 中的位置不能移动，保持当前的碎片
+    n = len(arr)
+    locked = set(locked)
+    targets = [None] * n
+    claimed = set(locked)
+    for i in locked:
+        targets[i] = i
+    # 已经在正确位置上的碎片优先认领该位置，重复编号时其余的视为未识别
+    for i, x in enumerate(arr):
+        if i not in locked and x == i + 1:
+            targets[i] = i
+            claimed.add(i)
+    for i, x in enumerate(arr):
+        if targets[i] is None and 1 <= x <= n and x - 1 not in claimed:
+            targets[i] = x - 1
+            claimed.add(x - 1)
+    free = [i for i in range(n) if i not in claimed]
+    free_set = set(free)
+    for i in range(n):
+        if targets[i] is None and i in free_set:
+            targets[i] = i
+            free_set.discard(i)
+    free = [i for i in free if i in free_set]
+    for i in range(n):
+        if targets[i] is None:
+            targets[i] = free.pop(0)
+    return targets
+
+
+def plan_swaps(arr, planner='cycles', cols=None, cost='count', locked=(), budget_ms=200):
+    # 交换步骤规划的统一入口，planner 为 PLANNERS 中注册的名字：
+    # cycles: 按环分解，交换次数最少；astar: 在给定交换代价下用 A* 搜索总代价最小的交换步骤，
+    # 超过 budget_ms 时从最有希望的搜索状态出发贪心补全，结果不比按环分解差
+    # 锁定的位置也传给规划方式，任何一步都不会交换这些位置
+    if not arr:
+        return []
+    if planner not in PLANNERS:
+        raise ValueError(f"未知的交换规划方式: {planner}")
+    bad = [i + 1 for i in locked if not 0 <= i < len(arr)]
+    if bad:
+        raise ValueError(f"锁定的位置超出范围(1~{len(arr)}): {', '.join(map(str, bad))}")
+    targets = target_positions(arr, locked)
+    cost_fn = swap_cost_fn(cost, cols or grid_cols(len(arr)))
+    return PLANNERS[planner](targets, cost_fn, budget_ms, frozenset(locked))
+
+
+def plan_cycles(targets, cost_fn=None, budget_ms=None, locked=frozenset()):
+    # 按环分解求最少交换次数，O(n)：每个长度为 k 的环需要 k-1 次交换，都与环的第一个位置交换
+    # 锁定位置的目标就是自身，不在任何环中
+    n = len(targets)
+    visited = [False] * n
+    swaps = []
+    for i in range(n):
+        if visited[i]:
+            continue
+        visited[i] = True
+        cur = targets[i]
+        while not visited[cur]:
+            visited[cur] = True
+            swaps.append((i, cur))
+            cur = targets[cur]
+    return swaps
+
+
+def plan_astar(targets, cost_fn, budget_ms=200, locked=frozenset()):
+    # 状态为每个位置上的碎片应去的位置；搜索任意两个位置的交换(按代价计算时，先把碎片换到中间位置有时更便宜)，
+    # 状态按已知最小代价记忆
+    # 启发函数：每个碎片到目标位置的代价之和的一半(一次交换移动两个碎片)，代价满足三角不等式时不会高估，
+    # 在时间预算内搜索完时得到的是总代价最小的步骤
+    n = len(targets)
+    costs = [[cost_fn(i, j) if i != j else 0 for j in range(n)] for i in range(n)]
+    if len({costs[i][j] for i in range(n) for j in range(n) if i != j}) <= 1:
+        # 每次交换代价相同时按环分解就是最优的，分支太多的 A* 反而会超时
+        return plan_cycles(targets, cost_fn, budget_ms, locked)
+    pairs = [(i, j) for i in range(n) if i not in locked for j in range(i + 1, n) if j not in locked]
+    start = tuple(targets)
+    start_h = sum(costs[i][t] for i, t in enumerate(start)) / 2
+    best_g = {start: 0}
+    came_from = {start: None}
+    counter = 0
+    # f 相同时优先展开已走得更远(g 更大)的状态，距离代价下 f 相同的状态很多，这样能更快到达终点
+    open_heap = [(start_h, 0, counter, start)]
+    deadline = time.perf_counter() + budget_ms / 1000
+    while open_heap:
+        f, neg_g, _, state = heapq.heappop(open_heap)
+        g = -neg_g
+        if g > best_g[state]:
+            continue
+        h = f - g
+        if h == 0 and all(t == i for i, t in enumerate(state)):
+            return reconstruct_plan(came_from, state)
+        if time.perf_counter() > deadline:
+            # 超时：从当前最有希望的状态出发贪心补全
+            return budget_fallback(targets, came_from, state, costs, locked)
+        for k, (i, j) in enumerate(pairs):
+            if k % 1024 == 1023 and time.perf_counter() > deadline:
+                # 碎片很多时展开一个状态就要很久，展开途中也检查是否超时
+                return budget_fallback(targets, came_from, state, costs, locked)
+            new_state = list(state)
+            new_state[i], new_state[j] = new_state[j], new_state[i]
+            new_state = tuple(new_state)
+            new_g = g + costs[i][j]
+            if new_g >= best_g.get(new_state, float('inf')):
+                continue
+            best_g[new_state] = new_g
+            came_from[new_state] = (state, (i, j))
+            new_h = h + (costs[i][state[j]] + costs[j][state[i]] - costs[i][state[i]] - costs[j][state[j]]) / 2
+            counter += 1
+            heapq.heappush(open_heap, (new_g + new_h, -new_g, counter, new_state))
+    return []
+
+
+def budget_fallback(targets, came_from, state, costs, locked=frozenset()):
+    # 已搜索的步骤加上贪心补全，总代价不如按环分解时改用按环分解的结果
+    swaps = reconstruct_plan(came_from, state) + greedy_plan(list(state), costs, locked)
+    cycles = plan_cycles(targets, locked=locked)
+    if sum(costs[i][j] for i, j in cycles) < sum(costs[i][j] for i, j in swaps):
+        return cycles
+    return swaps
+
+
+def fixing_swaps(state, locked=frozenset()):
+    moves = set()
+    for i, t in enumerate(state):
+        if t != i and i not in locked and t not in locked:
+            moves.add((min(i, t), max(i, t)))
+    return sorted(moves)
+
+
+def reconstruct_plan(came_from, state):
+    swaps = []
+    while came_from[state] is not None:
+        state, swap = came_from[state]
+        swaps.append(swap)
+    swaps.reverse()
+    return swaps
+
+
+def greedy_plan(state, costs, locked=frozenset()):
+    # 每次选每单位代价让各碎片离目标最近的交换，直到全部归位
+    swaps = []
+    while True:
+        best = None
+        for i, j in fixing_swaps(state, locked):
+            gain = costs[i][state[i]] + costs[j][state[j]] - costs[i][state[j]] - costs[j][state[i]]
+            score = (gain / costs[i][j] if costs[i][j] else float('inf'), -costs[i][j])
+            if best is None or score > best[0]:
+                best = (score, i, j)
+        if best is None:
+            return swaps
+        _, i, j = best
+        state[i], state[j] = state[j], state[i]
+        swaps.append((i, j))
+
+
+# 交换规划方式，签名为 planner(各位置碎片的目标位置, 交换代价函数, 时间预算(毫秒), 锁定的位置) -> 交换步骤
+PLANNERS = {
+    'cycles': plan_cycles,
+    'astar': plan_astar,
+}
+
+
+def register_planner(name, planner):
+    PLANNERS[name] = planner
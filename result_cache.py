@@ -0,0 +1,123 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import glob
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from puzzle_core import reference_sources
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_PATH = os.path.join('output', '.cache', 'results.sqlite')
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def reference_fingerprint(ref_dir):
+    # 参考碎片(或图包)的文件名、大小、修改时间以及 grid.json，任何一个变化都会使旧的结果失效
+    digest = hashlib.sha1()
+    for path in sorted(reference_sources(ref_dir) + glob.glob(os.path.join(ref_dir, 'grid.json'))):
+        st = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def make_key(image_sha1, ref_dir, **params):
+    # 键 = 截图内容哈希 + 拼图(参考碎片指纹) + 影响结果的匹配参数
+    payload = json.dumps({
+        'version': CACHE_VERSION,
+        'image': image_sha1,
+        'figure': os.path.basename(os.path.normpath(ref_dir)),
+        'reference': reference_fingerprint(ref_dir),
+        'params': params,
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def encode_matches(matches):
+    return [[int(x), int(y), int(number)] for (x, y), number in matches.items()]
+
+
+def decode_matches(items):
+    return {(x, y): number for x, y, number in items}
+
+
+# 标注结果缓存(碎片顺序、匹配度、交换步骤等)，SQLite 单文件存储，总大小超过上限时淘汰最久未使用的结果
+class ResultCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.disabled = False
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with self._connect() as conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                             'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                             'accessed REAL NOT NULL)')
+        except (OSError, sqlite3.Error) as e:
+            # 缓存不可用时不影响标注，只是每次都重新匹配
+            print(f"结果缓存不可用: {e}")
+            self.disabled = True
+
+    def _connect(self):
+        # 每次操作单独连接，GUI 线程、线程池和多进程中都可以安全使用
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        if self.disabled:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error as e:
+            print(f"结果缓存读取失败: {e}")
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        if self.disabled:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                             (key, data, len(data), time.time()))
+                total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+                if total > self.max_bytes:
+                    self._evict(conn, total)
+        except sqlite3.Error as e:
+            print(f"结果缓存写入失败: {e}")
+
+    def _evict(self, conn, total):
+        # 淘汰到上限的 80%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.8
+        evicted = []
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY accessed'):
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def clear(self):
+        if self.disabled:
+            return
+        with self._connect() as conn:
+            conn.execute('DELETE FROM results')
+
+
+def get_result_cache(path=DEFAULT_CACHE_PATH):
+    key = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = ResultCache(path)
+            _caches[key] = cache
+    return cache
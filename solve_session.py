@@ -0,0 +1,143 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import numpy as np
+
+import profiler
+from image_core import match_screenshot, preprocess_image, DEFAULT_MATCHER
+from cell_matcher import cut_grid_cells, normalize_rows, linear_assignment, MIN_MARGIN, MIN_SCORE
+from puzzle_core import get_piece_order, min_swap_sort
+
+CELL_SIGNATURE = 16  # 每个格子缩成 16x16 的缩略图用来判断是否有变化
+CELL_CHANGE_THRESHOLD = 8.0  # 格子缩略图的平均灰度差超过该值才认为这个格子换了碎片
+MAX_CHANGED_RATIO = 0.5  # 变化的格子超过一半时不如整幅重新匹配
+
+
+def cell_signatures(screenshot_area, rows=3, cols=4):
+    # 返回 (格子数, CELL_SIGNATURE, CELL_SIGNATURE) 的缩略图，截图大小略有不同时也能逐格比较
+    gray = cv2.cvtColor(screenshot_area, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (cols * CELL_SIGNATURE, rows * CELL_SIGNATURE), interpolation=cv2.INTER_AREA)
+    small = small.astype(np.float32).reshape(rows, CELL_SIGNATURE, cols, CELL_SIGNATURE)
+    return small.transpose(0, 2, 1, 3).reshape(rows * cols, CELL_SIGNATURE, CELL_SIGNATURE)
+
+
+def cell_center(cell, shape, rows=3, cols=4):
+    block_h = shape[0] // rows
+    block_w = shape[1] // cols
+    return (cell % cols) * block_w + block_w // 2, (cell // cols) * block_h + block_h // 2
+
+
+def remaining_plan(previous_order, previous_swaps, piece_order):
+    # 新的顺序恰好是按上次的交换步骤做了前几步的结果时，返回 (已完成的步数, 剩下的步骤)，否则返回 None
+    state = list(previous_order)
+    for done, (i, j) in enumerate(previous_swaps):
+        if state == piece_order:
+            return done, previous_swaps[done:]
+        state[i], state[j] = state[j], state[i]
+    if state == piece_order:
+        return len(previous_swaps), []
+    return None
+
+
+# 连续截图求解：保留上一次的棋盘作为先验，只重新识别像素有变化的格子，交换步骤也尽量沿用上一次的
+# 同一局拼图的截图依次交给 solve；换了图或开始新的一局时调用 reset
+class SolveSession:
+    def __init__(self, bank, matcher=DEFAULT_MATCHER, pyramid_levels=0, plan_options=None,
+                 change_threshold=CELL_CHANGE_THRESHOLD):
+        self.bank = bank
+        self.rows = bank.rows
+        self.cols = bank.cols
+        self.matcher = matcher
+        self.pyramid_levels = pyramid_levels
+        self.plan_options = dict(plan_options or {})
+        self.plan_options.setdefault('cols', self.cols)
+        self.change_threshold = change_threshold
+        self.reset()
+
+    def reset(self):
+        self.order = None
+        self.swaps = None
+        self.signatures = None
+        self.margins = None
+
+    def solve_full(self, screenshot_area):
+        # 整幅重新匹配，返回 (碎片顺序, 置信度)
+        best_matches, _, margins = match_screenshot(screenshot_area, bank=self.bank, matcher=self.matcher,
+                                                    pyramid_levels=self.pyramid_levels, rows=self.rows, cols=self.cols)
+        return get_piece_order(screenshot_area, best_matches, self.rows, self.cols), margins
+
+    def solve(self, screenshot_area, full_solve=None):
+        # full_solve(截图) -> (碎片顺序, 置信度) 用于第一次和需要整幅重新匹配时，默认为 solve_full
+        # 返回 {'order', 'swaps'(还需的交换步骤), 'matches'(中心坐标 -> 碎片编号), 'margins',
+        #       'changed'(重新识别的格子), 'incremental'(是否只重新识别了变化的格子), 'steps_done'(沿用上次步骤时已完成的步数)}
+        signatures = cell_signatures(screenshot_area, self.rows, self.cols)
+        changed = None
+        if self.order is not None:
+            with profiler.span('cell_diff', cells=len(signatures)) as span_args:
+                diff = np.abs(signatures - self.signatures).mean(axis=(1, 2))
+                changed = np.nonzero(diff > self.change_threshold)[0].tolist()
+                span_args['changed'] = len(changed)
+
+        piece_order = None
+        margins = None
+        if changed is not None and len(changed) <= len(signatures) * MAX_CHANGED_RATIO:
+            piece_order, margins = self._rematch(screenshot_area, changed)
+        incremental = piece_order is not None
+        if not incremental:
+            changed = list(range(self.rows * self.cols))
+            piece_order, margins = (full_solve or self.solve_full)(screenshot_area)
+
+        steps_done = None
+        progress = remaining_plan(self.order, self.swaps, piece_order) if self.order is not None else None
+        if progress is not None:
+            steps_done, swaps = progress
+        else:
+            swaps, _ = min_swap_sort(piece_order, **self.plan_options)
+        # 状态只整体替换不原地修改，浅复制出的会话(例如界面每个工作线程的副本)之间互不影响
+        self.order = piece_order
+        self.swaps = swaps
+        self.signatures = signatures
+        self.margins = margins
+        matches = {cell_center(cell, screenshot_area.shape, self.rows, self.cols): number
+                   for cell, number in enumerate(piece_order) if number}
+        return {
+            'order': piece_order,
+            'swaps': swaps,
+            'matches': matches,
+            'margins': margins,
+            'changed': changed,
+            'incremental': incremental,
+            'steps_done': steps_done,
+        }
+
+    def _rematch(self, screenshot_area, changed):
+        # 只在变化的格子之间重新分配它们原来的碎片(交换只会在格子之间互换碎片)，返回 (碎片顺序, 置信度)
+        # 原来是空格、重新分配后仍不确定时返回 (None, None)，由调用方整幅重新匹配
+        margins = list(self.margins) if self.margins is not None else None
+        if not changed:
+            return list(self.order), margins
+        refs = [self.order[cell] - 1 for cell in changed]
+        if min(refs) < 0:
+            return None, None
+        with profiler.span('rematch_cells', cells=len(changed)):
+            # 格子缩小到不超过参考碎片原始大小后逐格预处理，截图分辨率很高时也只处理这几个格子
+            h, w = screenshot_area.shape[:2]
+            board_w, board_h = self.bank.board_size
+            size = (min(w, board_w) // self.cols, min(h, board_h) // self.rows)
+            templates = self.bank.resized(size)
+            grid = cut_grid_cells(screenshot_area, self.rows, self.cols)
+            cells = [preprocess_image(cv2.resize(grid[cell], size, interpolation=cv2.INTER_AREA)) for cell in changed]
+            scores = normalize_rows(np.stack(cells)) @ normalize_rows(np.stack([templates[ref] for ref in refs])).T
+            cell_idx, ref_idx = linear_assignment(-scores)
+        if len(cell_idx) < len(changed):
+            return None, None
+        piece_order = list(self.order)
+        for i, j in zip(cell_idx.tolist(), ref_idx.tolist()):
+            others = np.delete(scores[i], j)
+            margin = float(scores[i, j] - others.max()) if len(others) else float(scores[i, j])
+            if scores[i, j] < MIN_SCORE or (len(others) and margin < MIN_MARGIN):
+                return None, None
+            piece_order[changed[i]] = refs[j] + 1
+            if margins is not None:
+                margins[changed[i]] = round(margin, 4)
+        return piece_order, margins
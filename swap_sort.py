@@ -1,174 +1,538 @@
-# coding=utf-8
-# @Author    : ssss要加油哦
-import cv2
-import numpy as np
-import os
-import glob
-import re
-
-
-def natural_sort_key(s):
-    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
-
-
-def preprocess_image(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.equalizeHist(gray)
-    gray = cv2.GaussianBlur(gray, (3, 3), 0)
-    return gray
-
-
-def find_pieces_with_improved_matching(screenshot_area, ref_pieces, threshold=0.6):
-    matches = {}
-    screenshot_gray = preprocess_image(screenshot_area)
-    for ref_idx, ref_piece in enumerate(ref_pieces):
-        ref_gray = preprocess_image(ref_piece)
-        h, w = screenshot_gray.shape[:2]
-        ref_resized = cv2.resize(ref_gray, (w // 4, h // 3))
-        methods = [cv2.TM_CCOEFF_NORMED, cv2.TM_CCORR_NORMED]
-
-        best_match_val = 0
-        best_match_loc = None
-
-        for method in methods:
-            result = cv2.matchTemplate(screenshot_gray, ref_resized, method)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-
-            if max_val > best_match_val:
-                best_match_val = max_val
-                best_match_loc = max_loc
-        if best_match_val >= threshold:
-            center_x = best_match_loc[0] + ref_resized.shape[1] // 2
-            center_y = best_match_loc[1] + ref_resized.shape[0] // 2
-            matches[(center_x, center_y)] = ref_idx + 1
-        else:
-            print(f"未找到碎片 {ref_idx + 1}, 最高匹配度: {best_match_val:.2f}")
-
-    return matches
-
-
-def annotate_screenshot_directly(screenshot_area_path, ref_dir, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
-
-    screenshot_area = cv2.imread(screenshot_area_path)
-    ref_files = sorted(glob.glob(os.path.join(ref_dir, "*.png")), key=natural_sort_key)
-
-    ref_pieces = []
-    for ref_path in ref_files:
-        ref_img = cv2.imread(ref_path)
-        ref_pieces.append(ref_img)
-    best_matches = {}
-
-    for threshold in np.arange(0.4, 0.8, 0.05):
-        matches = find_pieces_with_improved_matching(screenshot_area, ref_pieces, threshold)
-
-        if len(matches) > len(best_matches):
-            best_matches = matches
-
-    piece_order = get_piece_order(screenshot_area, best_matches)
-
-    # 标注数字
-    annotated_img = screenshot_area.copy()
-    for (x, y), number in best_matches.items():
-        cv2.putText(annotated_img,
-                    str(number),
-                    (x - 10, y + 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    1.8,
-                    (0, 0, 255),
-                    8,
-                    cv2.LINE_AA)
-
-    screenshot_filename = os.path.basename(screenshot_area_path)
-    name, ext = os.path.splitext(screenshot_filename)
-    output_path = os.path.join(output_dir, f"{name}_annotated{ext}")
-    cv2.imwrite(output_path, annotated_img)
-    print(f"标注完成！找到 {len(best_matches)} 个碎片，保存至: {output_path}")
-    return piece_order
-
-
-def get_piece_order(screenshot_area, matches):
-    h, w = screenshot_area.shape[:2]
-    block_h = h // 3
-    block_w = w // 4
-    grid = [[0 for _ in range(4)] for _ in range(3)]
-    for (x, y), number in matches.items():
-        row = y // block_h
-        col = x // block_w
-        if 0 <= row < 3 and 0 <= col < 4:
-            grid[row][col] = number
-
-    piece_order = []
-    for row in grid:
-        for number in row:
-            piece_order.append(number)
-    return piece_order
-
-
-def min_swap_sort(arr):
-    n = len(arr)
-    sorted_arr = sorted(arr)
-    pos_map = {}
-    for idx, val in enumerate(sorted_arr):
-        pos_map[val] = idx
-    target = [pos_map[x] for x in arr]
-
-    visited = [False] * n
-    cycles = []
-
-    for i in range(n):
-        if not visited[i]:
-            cycle = []
-            cur = i
-            while not visited[cur]:
-                visited[cur] = True
-                cycle.append(cur)
-                cur = target[cur]
-            cycles.append(cycle)
-
-    swaps = []
-    result_arr = arr.copy()
-    for cycle in cycles:
-        if len(cycle) <= 1:
-            continue
-
-        for j in range(1, len(cycle)):
-            idx1, idx2 = cycle[0], cycle[j]
-            result_arr[idx1], result_arr[idx2] = result_arr[idx2], result_arr[idx1]
-            swaps.append((idx1, idx2))
-    return swaps, arr
-
-
-
-def running(figure_label, screenshot_figure_name, po=None):
-    if po is not None:
-        print("\n原始数组:", po)
-        swaps, sorted_data = min_swap_sort(po)
-        print("\n交换步骤:")
-        for step, (idx1, idx2) in enumerate(swaps, 1):
-            print(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}")
-        print("\n总交换次数:", len(swaps))
-    else:
-        # 标注数字
-        piece_order = annotate_screenshot_directly(
-            screenshot_area_path=f'screenshot/fig{figure_label}/{screenshot_figure_name}',
-            ref_dir=f'reference_patches/fig{figure_label}/',
-            output_dir=f'output/fig{figure_label}/',
-        )
-
-        # 交换排序
-        print("\n原始数组:", piece_order)
-        swaps, sorted_data = min_swap_sort(piece_order)
-        print("\n交换步骤:")
-        for step, (idx1, idx2) in enumerate(swaps, 1):
-            print(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}")
-        print("\n总交换次数:", len(swaps))
-    return 0
-
-
-if __name__ == '__main__':
-    figure_label = '02'
-    screenshot_figure_name = 'test01.jpg'
-    po = None  # 自动给图像编号，并给出交换步骤
-    running(figure_label, screenshot_figure_name, po)
-
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import os
+import glob
+import re
+import sys
+import json
+import queue
+import argparse
+import itertools
+
+import profiler
+from output_writer import (DEFAULT_OUTPUT_OPTIONS, output_path_for, encode_params, get_output_writer,
+                           add_output_arguments, output_options_from_args)
+from memory_budget import load_screenshot, memory_budget_mb, set_memory_budget, reset_peak_rss, peak_rss_mb, \
+    jobs_for_budget
+# 网格配置、碎片顺序和交换步骤在 puzzle_core 中，这里一并导出，兼容原来从 swap_sort 导入的用法
+from puzzle_core import (GRID_CONFIG, DEFAULT_GRID, natural_sort_key, load_grid, get_piece_order, min_swap_sort,
+                         plan_swaps, PLANNERS, SWAP_COSTS, swap_cost_fn, grid_cols, figure_path)
+# 预处理和模板匹配在 image_core 中，同样在这里导出
+from image_core import (DEFAULT_MATCHER, MATCHERS, preprocess_image, auto_pyramid_levels, effective_pyramid_levels,
+                        match_template, prepare_templates, score_reference_pieces, score_templates, match_piece,
+                        select_matches, sweep_thresholds, find_pieces_with_improved_matching, load_reference_pieces,
+                        match_screenshot)
+
+
+def draw_annotations(screenshot_area, matches, copy=True):
+    # 标注数字；copy=False 时直接画在传入的图像上，省去一次整图复制
+    annotated_img = screenshot_area.copy() if copy else screenshot_area
+    for (x, y), number in matches.items():
+        cv2.putText(annotated_img,
+                    str(number),
+                    (x - 10, y + 10),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1.8,
+                    (0, 0, 255),
+                    8,
+                    cv2.LINE_AA)
+    return annotated_img
+
+
+def order_confidence(piece_order, scores):
+    # 以放置到格子里的最弱碎片的匹配度作为整体置信度，有空格时为 0
+    if not scores:
+        return 0.0
+    placed = [scores[number - 1] for number in piece_order if number > 0]
+    return min(placed) if len(placed) == len(piece_order) else 0.0
+
+
+def annotate_screenshot_directly(screenshot_area_path, ref_dir, output_dir, single_pass=True, use_bank=True,
+                                 matcher=DEFAULT_MATCHER, pyramid_levels=0, auto_crop=False, use_cache=True,
+                                 output_options=None):
+    result = annotate_screenshot(screenshot_area_path, ref_dir, output_dir, single_pass, use_bank, matcher,
+                                 pyramid_levels, auto_crop, use_cache, output_options)
+    return result['piece_order']
+
+
+def annotate_screenshot(screenshot_area_path, ref_dir, output_dir, single_pass=True, use_bank=True,
+                        matcher=DEFAULT_MATCHER, pyramid_levels=0, auto_crop=False, use_cache=True,
+                        output_options=None, background=False):
+    # output_options: 标注图的格式和压缩参数，见 output_writer.DEFAULT_OUTPUT_OPTIONS
+    # background=True 时标注图交给后台线程保存，函数返回时文件可能还没写完(批量处理用，调用 get_output_writer().flush() 等待)
+    output_options = dict(DEFAULT_OUTPUT_OPTIONS, **(output_options or {}))
+    output_path = output_path_for(output_dir, screenshot_area_path, output_options['format'])
+    if output_path is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    cache_key = None
+    if use_cache and os.path.isfile(screenshot_area_path):
+        # 同一张截图(按内容哈希)、同一幅图和相同参数的结果直接从缓存读取，不再重新匹配
+        from result_cache import get_result_cache, make_key
+        from template_bank import file_sha1
+        with profiler.span('cache_lookup') as span_args:
+            cache_key = make_key(file_sha1(screenshot_area_path), ref_dir, matcher=matcher,
+                                 pyramid_levels=pyramid_levels, auto_crop=auto_crop)
+            cached = get_result_cache().get(cache_key)
+            span_args['hit'] = cached is not None
+        if cached is not None:
+            return cached_annotation(cached, cache_key, screenshot_area_path, output_path,
+                                     screenshot_min_size(ref_dir, auto_crop), output_options, background)
+
+    with profiler.span('load_templates', ref_dir=ref_dir):
+        if use_bank:
+            # 从预处理模板缓存加载，避免每张截图重复解码和预处理参考碎片
+            from template_bank import get_template_bank
+            bank = get_template_bank(ref_dir)
+            ref_pieces = None
+        else:
+            bank = None
+            ref_pieces = load_reference_pieces(ref_dir)
+    rows, cols = (bank.rows, bank.cols) if bank is not None else load_grid(ref_dir, len(ref_pieces))
+    with profiler.span('load_image', path=screenshot_area_path) as span_args:
+        # 内存受限模式下按参考碎片的分辨率缩小解码，scale 为缩小倍数，结果中的坐标仍是原图坐标
+        screenshot_area, scale = load_screenshot(screenshot_area_path, screenshot_min_size(ref_dir, auto_crop, bank))
+        span_args['scale'] = scale
+    if screenshot_area is None:
+        raise ValueError(f"无法加载截图图像: {screenshot_area_path}")
+
+    full_image = screenshot_area
+    board_box = (0, 0, screenshot_area.shape[1], screenshot_area.shape[0])
+    if auto_crop:
+        # 未裁剪的整屏截图先定位拼图区域，后续匹配只在拼图区域内进行
+        from template_bank import get_template_bank
+        from board_locator import crop_board
+        with profiler.span('crop_board'):
+            screenshot_area, board_box = crop_board(screenshot_area, bank or get_template_bank(ref_dir))
+
+    with profiler.span('match', matcher=matcher, pyramid_levels=pyramid_levels) as span_args:
+        best_matches, piece_scores, margins = match_screenshot(screenshot_area, ref_pieces, bank, single_pass,
+                                                               matcher, pyramid_levels, rows, cols)
+        if piece_scores is not None:
+            span_args['scores'] = [round(float(score), 4) for score, _ in piece_scores]
+        if margins is not None:
+            span_args['margins'] = margins
+    piece_order = get_piece_order(screenshot_area, best_matches, rows, cols)
+    swaps, _ = min_swap_sort(piece_order)
+    if scale > 1:
+        best_matches = {(x * scale, y * scale): number for (x, y), number in best_matches.items()}
+        board_box = tuple(v * scale for v in board_box)
+
+    result = {
+        'piece_order': piece_order,
+        'matches': best_matches,
+        'scores': [float(score) for score, _ in piece_scores] if piece_scores is not None else None,
+        'margins': margins,
+        'swaps': [list(swap) for swap in swaps],
+        'output_path': output_path,
+        'board_box': [int(v) for v in board_box],
+        'grid': [rows, cols],
+        'cached': False,
+    }
+    # 结果缓存中记录标注图的大小和修改时间，要等标注图保存完再写入
+    params = encode_params(output_path, output_options['quality'], output_options['png_level']) if output_path else []
+    save_annotation(full_image, best_matches, board_box, output_path, scale, params, background,
+                    (lambda: store_cached_annotation(cache_key, result, params)) if cache_key is not None else None)
+    print(f"标注完成！找到 {len(best_matches)} 个碎片，" +
+          (f"保存至: {output_path}" if output_path else "未保存标注图"))
+    return result
+
+
+def save_annotation(full_image, matches, board_box, output_path, scale, params, background, on_done=None):
+    if output_path is None:
+        if on_done is not None:
+            on_done()
+        return
+    if background:
+        # 绘制和编码都在后台线程中进行；full_image 之后不再使用，直接画在上面
+        get_output_writer().submit(write_annotated_image, full_image, matches, board_box, output_path, scale,
+                                   params, on_done=on_done)
+        return
+    write_annotated_image(full_image, matches, board_box, output_path, scale, params)
+    if on_done is not None:
+        on_done()
+
+
+def write_annotated_image(full_image, matches, board_box, output_path, scale=1, params=()):
+    # 标注直接画在 full_image 上，调用方之后不应再使用它
+    with profiler.span('write_output', path=output_path):
+        # 标注画在原始截图上，坐标需要加上拼图区域的偏移；截图是缩小解码的时候坐标再除以缩小倍数
+        annotated_img = draw_annotations(full_image, {((x + board_box[0]) // scale, (y + board_box[1]) // scale):
+                                                      number for (x, y), number in matches.items()}, copy=False)
+        if not cv2.imwrite(output_path, annotated_img, list(params)):
+            raise ValueError(f"无法保存标注图: {output_path}")
+
+
+def store_cached_annotation(cache_key, result, params=()):
+    from result_cache import get_result_cache, encode_matches
+    value = {key: result[key] for key in ('piece_order', 'scores', 'margins', 'swaps', 'board_box', 'grid',
+                                          'output_path')}
+    value['matches'] = encode_matches(result['matches'])
+    # 记录标注图的大小和修改时间，命中缓存时标注图没被改动就不用重画
+    value['output_stat'] = None
+    value['output_params'] = list(params)
+    if result['output_path'] is not None:
+        st = os.stat(result['output_path'])
+        value['output_stat'] = [st.st_size, st.st_mtime_ns]
+    get_result_cache().put(cache_key, value)
+
+
+def screenshot_min_size(ref_dir, auto_crop=False, bank=None):
+    # 截图缩小解码后至少要有的尺寸；没有设置内存预算时不缩小，也就不必加载模板库
+    if memory_budget_mb() is None:
+        return None
+    if bank is None:
+        from template_bank import get_template_bank
+        bank = get_template_bank(ref_dir)
+    width, height = bank.board_size
+    # 未裁剪的截图中拼图区域只占一部分，按一般不小于整屏的一半留出余量
+    return (width * 2, height * 2) if auto_crop else (width, height)
+
+
+def cached_annotation(cached, cache_key, screenshot_area_path, output_path, min_size=None, output_options=None,
+                      background=False):
+    from result_cache import decode_matches
+    output_options = dict(DEFAULT_OUTPUT_OPTIONS, **(output_options or {}))
+    result = dict(cached)
+    result['matches'] = decode_matches(cached['matches'])
+    result['output_path'] = output_path
+    result['cached'] = True
+    output_stat = None
+    if output_path is not None and os.path.exists(output_path):
+        st = os.stat(output_path)
+        output_stat = [st.st_size, st.st_mtime_ns]
+    params = encode_params(output_path, output_options['quality'], output_options['png_level']) if output_path else []
+    # 标注图不存在、被改动过或者换了保存参数时重画
+    if output_path is not None and (cached['output_path'] != output_path or cached.get('output_stat') != output_stat
+                                    or cached.get('output_params', []) != params):
+        full_image, scale = load_screenshot(screenshot_area_path, min_size)
+        if full_image is None:
+            raise ValueError(f"无法加载截图图像: {screenshot_area_path}")
+        save_annotation(full_image, result['matches'], cached['board_box'], output_path, scale, params, background,
+                        lambda: store_cached_annotation(cache_key, result, params))
+    result.pop('output_stat', None)
+    result.pop('output_params', None)
+    print(f"标注完成(缓存)！找到 {len(result['matches'])} 个碎片，" +
+          (f"保存至: {output_path}" if output_path else "未保存标注图"))
+    return result
+
+
+def detect_figure_label(screenshot_area_path, ref_root='reference_patches', auto_crop=False):
+    from figure_index import identify_figure
+    screenshot_area = cv2.imread(screenshot_area_path)
+    if screenshot_area is None:
+        raise ValueError(f"无法加载截图图像: {screenshot_area_path}")
+    # 截图未裁剪时按每幅图分别定位拼图区域后再比较
+    figure_label, scores = identify_figure(screenshot_area, ref_root, auto_crop)
+    if figure_label is None:
+        raise ValueError(f"没有可用的参考碎片: {ref_root}")
+    print(f"自动识别为第 {figure_label} 幅图")
+    return figure_label
+
+
+def print_swap_cost(swaps, piece_count, plan_options):
+    cost = plan_options.get('cost', 'count')
+    if cost != 'count':
+        cost_fn = swap_cost_fn(cost, plan_options.get('cols') or grid_cols(piece_count))
+        print("总交换代价:", sum(cost_fn(i, j) for i, j in swaps))
+
+
+def running(figure_label, screenshot_figure_name, po=None, matcher=DEFAULT_MATCHER, pyramid_levels=0, auto_crop=False,
+            use_cache=True, plan_options=None, output_options=None):
+    # plan_options: 传给 min_swap_sort 的交换规划参数(planner, cost, locked, budget_ms)
+    plan_options = plan_options or {}
+    if po is not None:
+        print("\n原始数组:", po)
+        try:
+            swaps, sorted_data = min_swap_sort(po, **plan_options)
+        except ValueError as e:
+            print(f"无法规划交换步骤: {e}")
+            return 1
+        print("\n交换步骤:")
+        for step, (idx1, idx2) in enumerate(swaps, 1):
+            print(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}")
+        print("\n总交换次数:", len(swaps))
+        print_swap_cost(swaps, len(po), plan_options)
+    else:
+        if figure_label == 'auto':
+            # 自动识别是第几幅图，此时截图路径相对于 screenshot/
+            screenshot_area_path = f'screenshot/{screenshot_figure_name}'
+            figure_label = detect_figure_label(screenshot_area_path, auto_crop=auto_crop)
+        else:
+            screenshot_area_path = f'screenshot/fig{figure_label}/{screenshot_figure_name}'
+
+        # 标注数字；参考碎片可以是 figXX 目录或 figXX.figpack 图包
+        ref_dir = figure_path('reference_patches', figure_label)
+        piece_order = annotate_screenshot_directly(
+            screenshot_area_path=screenshot_area_path,
+            ref_dir=ref_dir,
+            output_dir=f'output/fig{figure_label}/',
+            matcher=matcher,
+            pyramid_levels=pyramid_levels,
+            auto_crop=auto_crop,
+            use_cache=use_cache,
+            output_options=output_options,
+        )
+
+        # 交换排序
+        print("\n原始数组:", piece_order)
+        plan_options = dict(plan_options)
+        plan_options.setdefault('cols', load_grid(ref_dir, len(piece_order))[1])
+        try:
+            swaps, sorted_data = min_swap_sort(piece_order, **plan_options)
+        except ValueError as e:
+            print(f"无法规划交换步骤: {e}")
+            return 1
+        print("\n交换步骤:")
+        for step, (idx1, idx2) in enumerate(swaps, 1):
+            print(f"步骤 {step}: 交换位置 {idx1 + 1} 和 {idx2 + 1}")
+        print("\n总交换次数:", len(swaps))
+        print_swap_cost(swaps, len(piece_order), plan_options)
+    return 0
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def discover_screenshots(screenshot_root, include_unlabelled=False):
+    # 收集 screenshot/figXX/ 子文件夹中的截图，返回 (图编号, 截图路径)
+    # include_unlabelled 时也收集直接放在 screenshot/ 下的截图，图编号为 None，由自动识别决定
+    tasks = []
+    if include_unlabelled:
+        for path in sorted(os.listdir(screenshot_root), key=natural_sort_key):
+            full_path = os.path.join(screenshot_root, path)
+            if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(full_path):
+                tasks.append((None, full_path))
+    for fig_dir in sorted(glob.glob(os.path.join(screenshot_root, 'fig*')), key=natural_sort_key):
+        match = re.fullmatch(r'fig(\d+)', os.path.basename(fig_dir))
+        if not match or not os.path.isdir(fig_dir):
+            continue
+        for path in sorted(os.listdir(fig_dir), key=natural_sort_key):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                tasks.append((match.group(1), os.path.join(fig_dir, path)))
+    return tasks
+
+
+def annotate_batch_task(task):
+    figure_label, screenshot_path, ref_root, output_root, matcher, pyramid_levels, auto_crop, use_cache, \
+        output_options = task
+    record = {'figure': figure_label, 'screenshot': screenshot_path}
+    # 每张截图单独统计峰值内存：子进程会连续处理多张截图，开始前先把峰值重置为当前占用
+    peak_reset = reset_peak_rss()
+    try:
+        with profiler.span('annotate', screenshot=screenshot_path):
+            if figure_label is None:
+                figure_label = detect_figure_label(screenshot_path, ref_root, auto_crop)
+                record.update({'figure': figure_label, 'figure_detected': True})
+            # 每个子进程通过 get_template_bank 只加载一次该图的参考碎片
+            result = annotate_screenshot(
+                screenshot_area_path=screenshot_path,
+                ref_dir=figure_path(ref_root, figure_label),
+                output_dir=os.path.join(output_root, f'fig{figure_label}'),
+                matcher=matcher,
+                pyramid_levels=pyramid_levels,
+                auto_crop=auto_crop,
+                use_cache=use_cache,
+                output_options=output_options,
+                # 标注图由后台线程保存
+                background=True,
+            )
+            piece_order = result['piece_order']
+        record.update({
+            'order': piece_order,
+            'swaps': result['swaps'],
+            'scores': result['scores'],
+            'confidence': order_confidence(piece_order, result['scores']),
+            'margins': result['margins'],
+            'output': result['output_path'],
+            'board_box': result['board_box'],
+            'grid': result['grid'],
+            'cached': result['cached'],
+        })
+        # 结果清单和监视记录中的 output 必须是已经保存好的文件
+        if _saved_queue is not None:
+            # 不等待保存：记录带上令牌先返回，子进程接着匹配下一张，主进程收到保存完成的通知后再写出记录
+            token = f'{os.getpid()}-{next(_saved_tokens)}'
+            record['pending_output'] = token
+            get_output_writer().notify(lambda failures: _saved_queue.put((token, failures)))
+        else:
+            failures = get_output_writer().flush()
+            if failures:
+                record['error'] = f"标注图保存失败: {'; '.join(failures)}"
+    except Exception as e:
+        record['error'] = str(e)
+    peak = peak_rss_mb()
+    if peak is not None:
+        # 不能重置峰值的平台上记录的是子进程到目前为止的峰值
+        record['peak_rss_mb'] = round(peak, 1)
+        record['peak_rss_scope'] = 'task' if peak_reset else 'process'
+    if profiler.is_enabled():
+        # 子进程中记录的事件随结果返回，由主进程汇总写出
+        record['trace'] = profiler.take_events()
+    return record
+
+
+# 子进程保存完标注图后通过该队列通知主进程，为 None 时返回记录前等待保存完成
+_saved_queue = None
+_saved_tokens = itertools.count()
+
+
+def set_saved_queue(saved_queue):
+    global _saved_queue
+    _saved_queue = saved_queue
+
+
+def collect_saved(saved_queue, waiting, block=False):
+    # 取出标注图已经保存完的记录；waiting 为 令牌 -> 记录，block 时至少等到一条
+    saved = []
+    while waiting:
+        try:
+            token, failures = saved_queue.get(block=block and not saved)
+        except queue.Empty:
+            break
+        record = waiting.pop(token, None)
+        if record is None:
+            continue
+        if failures:
+            record['error'] = f"标注图保存失败: {'; '.join(failures)}"
+        saved.append(record)
+    return saved
+
+
+def init_batch_worker(profile=False, budget_mb=None, saved_queue=None):
+    if profile:
+        profiler.enable()
+    set_memory_budget(budget_mb)
+    set_saved_queue(saved_queue)
+
+
+def run_batch(screenshot_root, jobs=None, ref_root='reference_patches', output_root='output', manifest_path=None,
+              matcher=DEFAULT_MATCHER, pyramid_levels=0, auto_figure=False, auto_crop=False, use_cache=True,
+              budget_mb=None, output_options=None):
+    tasks = [(figure_label, path, ref_root, output_root, matcher, pyramid_levels, auto_crop, use_cache, output_options)
+             for figure_label, path in discover_screenshots(screenshot_root, auto_figure)]
+    if manifest_path is None:
+        manifest_path = os.path.join(output_root, 'manifest.jsonl')
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+
+    # 进程池只在批量处理时用到，单张截图的命令行不必导入
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    if budget_mb is not None:
+        # 每个子进程按预算占用内存，进程数不超过可用内存能容纳的数量
+        jobs = jobs_for_budget(budget_mb, jobs)
+        print(f"内存预算: 每个进程 {budget_mb} MB，进程数: {jobs}")
+    import multiprocessing
+    failed = 0
+    peaks = []
+    saved_queue = multiprocessing.Queue()
+    # 匹配完但标注图还没保存完的记录
+    waiting = {}
+    with open(manifest_path, 'w', encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker,
+                                initargs=(profiler.is_enabled(), budget_mb, saved_queue)) as executor:
+        def write_record(record):
+            nonlocal failed
+            if 'error' in record:
+                failed += 1
+                print(f"处理失败: {record['screenshot']}: {record['error']}")
+            manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+            manifest.flush()
+
+        futures = [executor.submit(annotate_batch_task, task) for task in tasks]
+        for future in as_completed(futures):
+            record = future.result()
+            profiler.add_events(record.pop('trace', []))
+            if 'peak_rss_mb' in record:
+                peaks.append(record['peak_rss_mb'])
+                if budget_mb is not None and record['peak_rss_mb'] > budget_mb:
+                    print(f"超出内存预算: {record['screenshot']} 峰值 {record['peak_rss_mb']:.1f} MB")
+            token = record.pop('pending_output', None)
+            if token is None:
+                write_record(record)
+            else:
+                waiting[token] = record
+            for saved in collect_saved(saved_queue, waiting):
+                write_record(saved)
+        # 子进程退出前会保存完排队的标注图，这里等最后几张的通知
+        while waiting:
+            for saved in collect_saved(saved_queue, waiting, block=True):
+                write_record(saved)
+    print(f"批量处理完成！共 {len(tasks)} 张截图，失败 {failed} 张，结果清单: {manifest_path}")
+    if peaks:
+        print(f"单张截图峰值内存: 最大 {max(peaks):.1f} MB，中位数 {sorted(peaks)[len(peaks) // 2]:.1f} MB")
+    return failed
+
+
+def pyramid_levels_arg(value):
+    return value if value == 'auto' else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='swap_sort', description='拼图截图自动标注并给出交换步骤')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='标注单张截图')
+    run_parser.add_argument('figure_label', help='图编号，例如 01；auto 表示自动识别')
+    run_parser.add_argument('screenshot_figure_name',
+                            help='screenshot/figXX/ 下的截图文件名，自动识别时为相对 screenshot/ 的路径')
+    run_parser.add_argument('--po', type=int, nargs='+', help='直接给出碎片顺序，不做图像识别')
+    run_parser.add_argument('--matcher', choices=MATCHERS, default=DEFAULT_MATCHER, help='匹配方式')
+    run_parser.add_argument('--pyramid-levels', type=pyramid_levels_arg, default=0, help='金字塔层数，auto 表示自动选择')
+    run_parser.add_argument('--auto-crop', action='store_true', help='截图未裁剪时自动定位并裁剪拼图区域')
+    run_parser.add_argument('--no-cache', action='store_true', help='不读写结果缓存，总是重新匹配')
+    run_parser.add_argument('--planner', choices=sorted(PLANNERS), default='cycles',
+                            help='交换规划方式：cycles 交换次数最少，astar 按交换代价搜索总代价最小的步骤')
+    run_parser.add_argument('--swap-cost', choices=SWAP_COSTS, default='count',
+                            help='交换代价：count 每次交换代价相同，distance 按两个格子的距离计算(相邻交换最便宜)')
+    run_parser.add_argument('--locked', type=int, nargs='+', default=[], help='不允许移动的位置(从 1 开始)')
+    add_output_arguments(run_parser)
+    run_parser.add_argument('--memory-budget-mb', type=float, default=None,
+                            help='内存受限模式：截图按参考碎片的分辨率缩小解码，并报告峰值内存')
+    run_parser.add_argument('--plan-budget-ms', type=float, default=200, help='astar 的时间预算(毫秒)，超时后从当前搜索状态贪心补全剩下的步骤')
+    run_parser.add_argument('--profile', default=None, help='记录各阶段耗时并写入该文件(.json 为 Chrome trace，.csv 为表格)')
+
+    batch_parser = subparsers.add_parser('batch', help='批量标注 screenshot/figXX/ 下的所有截图')
+    batch_parser.add_argument('screenshot_root', nargs='?', default='screenshot')
+    batch_parser.add_argument('--jobs', '-j', type=int, default=None, help='进程数，默认为 CPU 核数')
+    batch_parser.add_argument('--ref-root', default='reference_patches')
+    batch_parser.add_argument('--output-root', default='output')
+    batch_parser.add_argument('--manifest', default=None, help='JSONL 结果清单路径，默认 output/manifest.jsonl')
+    batch_parser.add_argument('--matcher', choices=MATCHERS, default=DEFAULT_MATCHER, help='匹配方式')
+    batch_parser.add_argument('--pyramid-levels', type=pyramid_levels_arg, default=0, help='金字塔层数，auto 表示自动选择')
+    batch_parser.add_argument('--auto-figure', action='store_true',
+                              help='同时处理直接放在截图目录下、没有按图分文件夹的截图，自动识别是第几幅图')
+    batch_parser.add_argument('--auto-crop', action='store_true', help='截图未裁剪时自动定位并裁剪拼图区域')
+    batch_parser.add_argument('--no-cache', action='store_true', help='不读写结果缓存，总是重新匹配')
+    add_output_arguments(batch_parser)
+    batch_parser.add_argument('--memory-budget-mb', type=float, default=None,
+                              help='每个进程的内存预算：截图缩小解码、少缓存模板频谱，并按可用内存限制进程数')
+    batch_parser.add_argument('--profile', default=None, help='记录各阶段耗时并写入该文件(.json 为 Chrome trace，.csv 为表格)')
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'profile', None):
+        # 也可以通过环境变量 SWAP_SORT_PROFILE 开启，程序退出时写出
+        profiler.enable(args.profile)
+    if args.command == 'run':
+        plan_options = {'planner': args.planner, 'cost': args.swap_cost,
+                        'locked': [pos - 1 for pos in args.locked], 'budget_ms': args.plan_budget_ms}
+        set_memory_budget(args.memory_budget_mb)
+        status = running(args.figure_label, args.screenshot_figure_name, args.po, args.matcher, args.pyramid_levels,
+                         args.auto_crop, not args.no_cache, plan_options, output_options_from_args(args))
+        if args.memory_budget_mb is not None and peak_rss_mb() is not None:
+            print(f"峰值内存: {peak_rss_mb():.1f} MB(预算 {args.memory_budget_mb:g} MB)")
+        return status
+    if args.command == 'batch':
+        failed = run_batch(args.screenshot_root, args.jobs, args.ref_root, args.output_root, args.manifest,
+                           args.matcher, args.pyramid_levels, args.auto_figure, args.auto_crop, not args.no_cache,
+                           args.memory_budget_mb, output_options_from_args(args))
+        return 1 if failed else 0
+
+    figure_label = '02'
+    screenshot_figure_name = 'test01.jpg'
+    po = None  # 自动给图像编号，并给出交换步骤
+    return running(figure_label, screenshot_figure_name, po)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import cv2
+import numpy as np
+import os
+import hashlib
+import zipfile
+import threading
+from collections import OrderedDict
+
+from image_core import preprocess_image
+from puzzle_core import load_grid, reference_sources, is_figure_pack
+
+BANK_VERSION = 2
+_banks = {}
+
+
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def default_cache_path(ref_dir):
+    # reference_patches/fig01 -> reference_patches/.cache/fig01.npz
+    ref_dir = os.path.normpath(ref_dir)
+    return os.path.join(os.path.dirname(ref_dir), '.cache', f"{os.path.basename(ref_dir)}.npz")
+
+
+def pixels_path(cache_path):
+    # 模板像素单独存为 .npy，以只读内存映射方式加载，批量处理的各个子进程共用同一份物理内存(页缓存)
+    return os.path.splitext(cache_path)[0] + '_pixels.npy'
+
+
+# 一幅图的预处理灰度模板，磁盘上缓存为单个 .npz 文件，并按目标格子尺寸缓存缩放结果
+# ref_dir 也可以是图包(figXX.figpack)，模板直接从图包中读取，不需要缓存
+class TemplateBank:
+    def __init__(self, ref_dir, cache_path=None, lru_size=8):
+        self.ref_dir = os.path.normpath(ref_dir)
+        self.cache_path = cache_path or default_cache_path(ref_dir)
+        self.lru_size = lru_size
+        self.ref_paths = reference_sources(self.ref_dir)
+        self.pack = None
+        self.templates = []
+        self.stats = None
+        self._resized = OrderedDict()
+        self._lock = threading.Lock()
+        if is_figure_pack(self.ref_dir):
+            self._load_pack()
+        elif not self._load_cache():
+            self._build()
+        self.rows, self.cols = load_grid(self.ref_dir, len(self.templates))
+
+    def __len__(self):
+        return len(self.templates)
+
+    @property
+    def piece_sizes(self):
+        return [(t.shape[1], t.shape[0]) for t in self.templates]
+
+    @property
+    def board_size(self):
+        # 参考碎片拼成整幅图的 (宽, 高)，截图缩小解码时不小于该尺寸
+        if not self.templates:
+            return None
+        piece_w, piece_h = np.median(np.array(self.piece_sizes), axis=0)
+        return int(piece_w * self.cols), int(piece_h * self.rows)
+
+    def _source_stats(self):
+        stats = []
+        for path in self.ref_paths:
+            st = os.stat(path)
+            stats.append((st.st_size, st.st_mtime_ns))
+        return np.array(stats, dtype=np.int64).reshape(-1, 2)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path) as data:
+                if int(data['version']) != BANK_VERSION:
+                    return False
+                names = [str(n) for n in data['names']]
+                if names != [os.path.basename(p) for p in self.ref_paths]:
+                    return False
+                stats = self._source_stats()
+                if not np.array_equal(stats, data['stats']):
+                    # mtime 变化(例如重新 checkout)时再比较内容哈希
+                    if not np.array_equal(stats[:, 0], data['stats'][:, 0]):
+                        return False
+                    hashes = [str(h) for h in data['hashes']]
+                    if hashes != [file_sha1(p) for p in self.ref_paths]:
+                        return False
+                    rewrite = True
+                else:
+                    rewrite = False
+                shapes = data['shapes']
+            # np.asarray 去掉 memmap 子类，模板仍是只读映射上的视图
+            pixels = np.asarray(np.load(pixels_path(self.cache_path), mmap_mode='r'))
+            if pixels.dtype != np.uint8 or pixels.size != int(np.sum(np.prod(shapes, axis=1))):
+                return False
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return False
+
+        offset = 0
+        self.templates = []
+        for h, w in shapes:
+            self.templates.append(pixels[offset:offset + h * w].reshape(h, w))
+            offset += h * w
+        self.stats = stats
+        if rewrite:
+            self._save()
+        return True
+
+    def _load_pack(self):
+        from figure_pack import get_figure_pack
+        self.pack = get_figure_pack(self.ref_dir)
+        if self.pack.templates is not None:
+            self.templates = self.pack.templates
+        else:
+            self.templates = [preprocess_image(piece) for piece in self.pack.pieces]
+        self.stats = self._source_stats()
+
+    def _build(self):
+        self.templates = []
+        for ref_path in self.ref_paths:
+            ref_img = cv2.imread(ref_path)
+            if ref_img is None:
+                raise ValueError(f"无法加载参考碎片: {os.path.basename(ref_path)}")
+            self.templates.append(preprocess_image(ref_img))
+        self.stats = self._source_stats()
+        self._save()
+
+    def _save(self):
+        if not self.templates:
+            return
+        # 批量处理的多个子进程可能同时重建缓存，临时文件按进程区分，避免互相覆盖
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            # 先写像素再写索引，索引中的形状与像素数不一致时视为缓存失效
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.concatenate([t.ravel() for t in self.templates]))
+            os.replace(tmp_path, pixels_path(self.cache_path))
+            with open(tmp_path, 'wb') as f:
+                np.savez(f,
+                         version=np.array(BANK_VERSION),
+                         names=np.array([os.path.basename(p) for p in self.ref_paths]),
+                         stats=self.stats,
+                         hashes=np.array([file_sha1(p) for p in self.ref_paths]),
+                         shapes=np.array([t.shape for t in self.templates], dtype=np.int32))
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            # 缓存目录不可写时只在内存中使用
+            print(f"模板缓存写入失败: {e}")
+
+    def resized(self, size):
+        # size 为 (宽, 高)，与 cv2.resize 的参数一致
+        size = (int(size[0]), int(size[1]))
+        with self._lock:
+            if size in self._resized:
+                self._resized.move_to_end(size)
+                return self._resized[size]
+        resized = [cv2.resize(t, size) for t in self.templates]
+        with self._lock:
+            self._resized[size] = resized
+            if len(self._resized) > self.lru_size:
+                self._resized.popitem(last=False)
+        return resized
+
+    def is_stale(self):
+        if reference_sources(self.ref_dir) != self.ref_paths:
+            return True
+        try:
+            return not np.array_equal(self._source_stats(), self.stats)
+        except OSError:
+            return True
+
+
+def get_template_bank(ref_dir):
+    # 进程内复用已加载的模板库，参考碎片有变动时重新加载
+    key = os.path.abspath(ref_dir)
+    bank = _banks.get(key)
+    if bank is None or bank.is_stale():
+        bank = TemplateBank(ref_dir)
+        _banks[key] = bank
+    return bank
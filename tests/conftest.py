@@ -0,0 +1,9 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import sys
+
+# 各模块都放在仓库根目录下，测试从根目录导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
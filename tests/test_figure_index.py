@@ -0,0 +1,29 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import discover_fixtures
+from figure_index import identify_figure
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REF_ROOT = os.path.join(ROOT, 'reference_patches')
+FIXTURES = discover_fixtures(os.path.join(ROOT, 'screenshot'))
+
+
+@pytest.mark.parametrize('figure_label, screenshot_path', FIXTURES,
+                         ids=[os.path.relpath(path, ROOT) for _, path in FIXTURES])
+def test_identify_uncropped_screenshot(figure_label, screenshot_path):
+    # 截图贴在两倍大小的深色画布上模拟未裁剪的整屏截图，自动裁剪时应识别为同一幅图
+    screenshot_area = cv2.imread(screenshot_path)
+    h, w = screenshot_area.shape[:2]
+    canvas = np.full((h * 2, w * 2, 3), 20, dtype=np.uint8)
+    canvas[h // 2:h // 2 + h, w // 3:w // 3 + w] = screenshot_area
+
+    assert identify_figure(screenshot_area, REF_ROOT)[0] == figure_label
+    best, scores = identify_figure(canvas, REF_ROOT, auto_crop=True)
+    assert best == figure_label
+    assert scores[best] > max(score for label, score in scores.items() if label != best) + 0.1
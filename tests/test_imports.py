@@ -0,0 +1,54 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 各入口模块导入时不应加载的库：只做交换步骤的核心不需要 OpenCV/numpy，命令行和服务不需要 PyQt5，
+# 界面在处理截图前不需要 OpenCV
+IMPORT_CHECKS = {
+    'puzzle_core': ('cv2', 'numpy', 'PyQt5'),
+    'image_core': ('PyQt5',),
+    'swap_sort': ('PyQt5',),
+    'annotate_server': ('PyQt5',),
+    'watch_screenshots': ('PyQt5',),
+    'annotate_figure': ('cv2', 'numpy'),
+}
+# 导入耗时上限(ms)，只用来发现导入时多做了重活(例如加载了模型或读了参考碎片)，不是精确的性能指标
+MAX_IMPORT_MS = 2000
+IMPORT_PROBE = '''import sys, json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'ms': (time.perf_counter() - start) * 1000,
+                  'loaded': [name for name in {forbidden!r} if name in sys.modules]}}))
+'''
+
+
+def probe_import(module, forbidden):
+    # 在新的解释器中导入，sys.modules 不受测试进程中已导入模块的影响
+    proc = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module, forbidden=forbidden)],
+                          capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        missing = [line for line in proc.stderr.splitlines() if 'ModuleNotFoundError' in line]
+        if missing:
+            # 缺少可选依赖(例如没有安装 PyQt5)时跳过该模块
+            pytest.skip(missing[-1])
+        pytest.fail(proc.stderr)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize('module, forbidden', IMPORT_CHECKS.items(), ids=list(IMPORT_CHECKS))
+def test_import_does_not_load_heavy_modules(module, forbidden):
+    assert probe_import(module, forbidden)['loaded'] == []
+
+
+@pytest.mark.parametrize('module', list(IMPORT_CHECKS))
+def test_import_time(module):
+    # 第一次导入可能要编译字节码，取三次的中位数
+    samples = [probe_import(module, ())['ms'] for _ in range(3)]
+    assert statistics.median(samples) < MAX_IMPORT_MS
@@ -0,0 +1,123 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import heapq
+import random
+import time
+
+import pytest
+
+from puzzle_core import plan_swaps, plan_cycles, target_positions, swap_cost_fn
+
+
+def apply_swaps(arr, swaps):
+    arr = list(arr)
+    for i, j in swaps:
+        arr[i], arr[j] = arr[j], arr[i]
+    return arr
+
+
+def plan_cost(swaps, cost_fn):
+    return sum(cost_fn(i, j) for i, j in swaps)
+
+
+def brute_force_cost(targets, cost_fn, locked=()):
+    # 在所有交换序列上做 Dijkstra，得到总代价的下界(碎片很少时才能算完)
+    n = len(targets)
+    goal = tuple(range(n))
+    pairs = [(i, j) for i in range(n) for j in range(i + 1, n) if i not in locked and j not in locked]
+    best = {tuple(targets): 0}
+    heap = [(0, tuple(targets))]
+    while heap:
+        g, state = heapq.heappop(heap)
+        if state == goal:
+            return g
+        if g > best[state]:
+            continue
+        for i, j in pairs:
+            new_state = list(state)
+            new_state[i], new_state[j] = new_state[j], new_state[i]
+            new_state = tuple(new_state)
+            new_g = g + cost_fn(i, j)
+            if new_g < best.get(new_state, float('inf')):
+                best[new_state] = new_g
+                heapq.heappush(heap, (new_g, new_state))
+    return None
+
+
+def random_boards(count, n, seed=0):
+    rng = random.Random(seed)
+    return [rng.sample(range(1, n + 1), n) for _ in range(count)]
+
+
+@pytest.mark.parametrize('planner, cost', [('cycles', 'count'), ('astar', 'count'), ('astar', 'distance')])
+def test_locked_positions_never_swapped(planner, cost):
+    rng = random.Random(1)
+    for arr in random_boards(100, 12):
+        locked = rng.sample(range(12), rng.randint(1, 3))
+        swaps = plan_swaps(arr, planner, cols=4, cost=cost, locked=locked)
+        assert not [swap for swap in swaps if set(swap) & set(locked)]
+        # 其余碎片都移到了 target_positions 给出的位置(锁定位置占着的碎片归不了位，由空出的位置接收)
+        result = apply_swaps(arr, swaps)
+        targets = target_positions(arr, locked)
+        assert all(result[targets[i]] == arr[i] for i in range(12))
+
+
+def test_locked_example_from_review():
+    arr = [10, 2, 8, 12, 5, 4, 1, 9, 6, 3, 11, 7]
+    for cost in ('count', 'distance'):
+        swaps = plan_swaps(arr, 'astar', cols=4, cost=cost, locked=[1, 5])
+        assert not [swap for swap in swaps if {1, 5} & set(swap)]
+
+
+def test_locked_out_of_range():
+    with pytest.raises(ValueError):
+        plan_swaps(list(range(1, 13)), locked=[12])
+
+
+def test_astar_count_cost_matches_cycles():
+    # 每次交换代价相同时按环分解已经是最少交换次数，A* 不应更差
+    for arr in random_boards(60, 12, seed=2):
+        swaps = plan_swaps(arr, 'astar', cols=4, cost='count')
+        assert len(swaps) == len(plan_swaps(arr, 'cycles'))
+        assert apply_swaps(arr, swaps) == sorted(arr)
+
+
+@pytest.mark.parametrize('rows, cols, count', [(2, 3, 120), (2, 4, 20)])
+def test_astar_distance_cost_is_optimal(rows, cols, count):
+    cost_fn = swap_cost_fn('distance', cols)
+    for arr in random_boards(count, rows * cols, seed=3):
+        swaps = plan_swaps(arr, 'astar', cols=cols, cost='distance', budget_ms=10000)
+        assert apply_swaps(arr, swaps) == sorted(arr)
+        assert plan_cost(swaps, cost_fn) == brute_force_cost(target_positions(arr), cost_fn)
+
+
+@pytest.mark.parametrize('arr, expected', [([3, 4, 2, 5, 6, 1], 5), ([5, 4, 1, 6, 3, 2], 6),
+                                           ([3, 4, 2, 6, 5, 1], 5), ([2, 4, 6, 5, 3, 1], 5)])
+def test_astar_review_counterexamples(arr, expected):
+    assert plan_cost(plan_swaps(arr, 'astar', cols=3, cost='distance'), swap_cost_fn('distance', 3)) == expected
+
+
+def test_astar_twelve_pieces_within_budget():
+    cost_fn = swap_cost_fn('distance', 4)
+    elapsed = []
+    for arr in random_boards(60, 12, seed=4):
+        start = time.perf_counter()
+        swaps = plan_swaps(arr, 'astar', cols=4, cost='distance', budget_ms=200)
+        elapsed.append(time.perf_counter() - start)
+        assert apply_swaps(arr, swaps) == sorted(arr)
+        assert plan_cost(swaps, cost_fn) <= plan_cost(plan_cycles(target_positions(arr)), cost_fn)
+    elapsed.sort()
+    # 12 张碎片一般几毫秒就能搜索完
+    assert elapsed[len(elapsed) // 2] < 0.05
+    assert elapsed[-1] < 0.4
+
+
+def test_astar_large_board_respects_budget():
+    # 碎片很多时超时后贪心补全，总代价不超过按环分解
+    cost_fn = swap_cost_fn('distance', 10)
+    arr = random_boards(1, 100, seed=5)[0]
+    start = time.perf_counter()
+    swaps = plan_swaps(arr, 'astar', cols=10, cost='distance', budget_ms=50)
+    assert time.perf_counter() - start < 1.0
+    assert apply_swaps(arr, swaps) == sorted(arr)
+    assert plan_cost(swaps, cost_fn) <= plan_cost(plan_cycles(target_positions(arr)), cost_fn)
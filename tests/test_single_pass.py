@@ -0,0 +1,70 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import discover_fixtures
+from image_core import match_screenshot, preprocess_image, load_reference_pieces
+from puzzle_core import get_piece_order, figure_path
+from template_bank import get_template_bank
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = discover_fixtures(os.path.join(ROOT, 'screenshot'))
+
+
+def threshold_sweep_reference(screenshot_area, ref_pieces, rows, cols):
+    # 原来的做法：每个阈值都把所有碎片重新预处理、缩放并用 cv2.matchTemplate 匹配一遍，保留找到碎片最多的一组
+    best_matches = {}
+    for threshold in np.arange(0.4, 0.8, 0.05):
+        matches = {}
+        screenshot_gray = preprocess_image(screenshot_area)
+        h, w = screenshot_gray.shape[:2]
+        for ref_idx, ref_piece in enumerate(ref_pieces):
+            ref_resized = cv2.resize(preprocess_image(ref_piece), (w // cols, h // rows))
+            best_match_val = 0
+            best_match_loc = None
+            for method in (cv2.TM_CCOEFF_NORMED, cv2.TM_CCORR_NORMED):
+                _, max_val, _, max_loc = cv2.minMaxLoc(cv2.matchTemplate(screenshot_gray, ref_resized, method))
+                if max_val > best_match_val:
+                    best_match_val = max_val
+                    best_match_loc = max_loc
+            if best_match_val >= threshold:
+                matches[(best_match_loc[0] + ref_resized.shape[1] // 2,
+                         best_match_loc[1] + ref_resized.shape[0] // 2)] = ref_idx + 1
+        if len(matches) > len(best_matches):
+            best_matches = matches
+    return best_matches
+
+
+@pytest.mark.parametrize('figure_label, screenshot_path', FIXTURES,
+                         ids=[os.path.relpath(path, ROOT) for _, path in FIXTURES])
+def test_single_pass_matches_threshold_sweep(figure_label, screenshot_path):
+    # 匹配度只算一次(模板库 + 共用 DFT 的匹配核)再扫描阈值，结果应与逐阈值重新匹配完全一致
+    ref_dir = figure_path(os.path.join(ROOT, 'reference_patches'), figure_label)
+    bank = get_template_bank(ref_dir)
+    screenshot_area = cv2.imread(screenshot_path)
+    assert screenshot_area is not None
+
+    single, _, _ = match_screenshot(screenshot_area, bank=bank, single_pass=True, matcher='template',
+                                    rows=bank.rows, cols=bank.cols)
+    sweep = threshold_sweep_reference(screenshot_area, load_reference_pieces(ref_dir), bank.rows, bank.cols)
+    assert single and single == sweep
+    assert (get_piece_order(screenshot_area, single, bank.rows, bank.cols) ==
+            get_piece_order(screenshot_area, sweep, bank.rows, bank.cols))
+
+
+@pytest.mark.parametrize('pyramid_levels', [1, 2, 3, 4, 'auto'])
+def test_pyramid_levels_keep_piece_order(pyramid_levels):
+    # 界面可选的每个金字塔层数都应得到与不用金字塔相同的碎片顺序
+    for figure_label, screenshot_path in FIXTURES:
+        bank = get_template_bank(figure_path(os.path.join(ROOT, 'reference_patches'), figure_label))
+        screenshot_area = cv2.imread(screenshot_path)
+        orders = []
+        for levels in (0, pyramid_levels):
+            matches, _, _ = match_screenshot(screenshot_area, bank=bank, matcher='template', pyramid_levels=levels,
+                                             rows=bank.rows, cols=bank.cols)
+            orders.append(get_piece_order(screenshot_area, matches, bank.rows, bank.cols))
+        assert orders[0] == orders[1], screenshot_path
@@ -0,0 +1,160 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import sys
+import json
+import argparse
+
+import cv2
+import numpy as np
+
+import profiler
+from swap_sort import write_annotated_image, MATCHERS, DEFAULT_MATCHER, pyramid_levels_arg
+from solve_session import SolveSession
+from puzzle_core import figure_path
+from template_bank import get_template_bank
+from output_writer import get_output_writer, flush_output
+
+SIGNATURE_SIZE = (64, 36)  # 帧差分用的缩略图 (宽, 高)
+CHANGE_THRESHOLD = 4.0  # 与上次求解的帧相比，缩略图平均灰度差超过该值才认为拼图有变化
+STABLE_THRESHOLD = 1.5  # 与前一帧的平均灰度差低于该值时认为画面已经静止(交换动画结束)
+
+
+def read_frames(video_path, stride=1):
+    # 逐帧读取录屏，返回 (帧号, 时间(毫秒), 图像)；stride > 1 时跳过的帧只 grab 不解码
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"无法打开视频: {video_path}")
+    try:
+        frame_idx = 0
+        while True:
+            with profiler.span('decode_frame'):
+                ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame_idx, capture.get(cv2.CAP_PROP_POS_MSEC), frame
+            frame_idx += 1
+            for _ in range(stride - 1):
+                if not capture.grab():
+                    return
+                frame_idx += 1
+    finally:
+        capture.release()
+
+
+def frame_signature(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def changed_frames(frames, change_threshold=CHANGE_THRESHOLD, stable_threshold=STABLE_THRESHOLD):
+    # 只放行拼图有变化且画面已经静止的帧：与上次放行的帧差别足够大，并且与前一帧几乎相同
+    # 交换动画进行中的帧和重复的静止帧都被跳过，第一帧总是放行
+    solved_signature = None
+    previous_signature = None
+    for frame_idx, time_ms, frame in frames:
+        signature = frame_signature(frame)
+        if solved_signature is None:
+            changed = True
+        else:
+            stable = previous_signature is not None and \
+                float(np.mean(np.abs(signature - previous_signature))) < stable_threshold
+            changed = stable and float(np.mean(np.abs(signature - solved_signature))) > change_threshold
+        previous_signature = signature
+        if changed:
+            solved_signature = signature
+            yield frame_idx, time_ms, frame
+
+
+def solve_video(video_path, ref_dir=None, ref_root='reference_patches', matcher=DEFAULT_MATCHER, pyramid_levels=0,
+                auto_crop=False, stride=1, frame_dir=None):
+    # 依次返回碎片顺序有变化的帧的结果；ref_dir 为 None 时用第一帧自动识别是第几幅图
+    # 模板只加载一次，录屏中拼图区域的位置不变，自动裁剪时只在第一次求解时定位
+    # 之后每次只重新识别与上次求解相比有变化的格子，交换步骤沿用上次剩下的
+    bank = get_template_bank(ref_dir) if ref_dir else None
+    session = None
+    board_box = None
+    last_order = None
+    for frame_idx, time_ms, frame in changed_frames(read_frames(video_path, stride)):
+        with profiler.span('solve_frame', frame=frame_idx) as span_args:
+            if bank is None:
+                from figure_index import get_figure_index
+                figure_label, _ = get_figure_index(ref_root).identify(frame, auto_crop)
+                if figure_label is None:
+                    raise ValueError(f"没有可用的参考碎片: {ref_root}")
+                print(f"自动识别为第 {figure_label} 幅图")
+                bank = get_template_bank(figure_path(ref_root, figure_label))
+            if session is None:
+                session = SolveSession(bank, matcher, pyramid_levels)
+            if board_box is None:
+                board_box = (0, 0, frame.shape[1], frame.shape[0])
+                if auto_crop:
+                    from board_locator import crop_board
+                    _, board_box = crop_board(frame, bank)
+            x, y, w, h = board_box
+            screenshot_area = frame[y:y + h, x:x + w]
+            result = session.solve(screenshot_area)
+            piece_order = result['order']
+            span_args.update(order=piece_order, changed=len(result['changed']))
+        if piece_order == last_order:
+            continue
+        last_order = piece_order
+        record = {
+            'frame': frame_idx,
+            'time_ms': round(time_ms, 1),
+            'figure': os.path.basename(bank.ref_dir),
+            'order': piece_order,
+            'swaps': [list(swap) for swap in result['swaps']],
+            'margins': result['margins'],
+            'changed_cells': result['changed'],
+            'board_box': [int(v) for v in board_box],
+        }
+        if frame_dir:
+            os.makedirs(frame_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(video_path))[0]
+            record['output'] = os.path.join(frame_dir, f"{name}_{frame_idx:06d}_annotated.jpg")
+            # 标注帧由后台线程编码保存，同时继续解码和比较后面的帧
+            get_output_writer().submit(write_annotated_image, frame, result['matches'], board_box, record['output'])
+        yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='从录屏中识别拼图，画面变化时输出新的碎片顺序和交换步骤')
+    parser.add_argument('video', help='录屏文件')
+    parser.add_argument('figure_label', nargs='?', default='auto', help='图编号，例如 01；默认自动识别')
+    parser.add_argument('--ref-root', default='reference_patches')
+    parser.add_argument('--output', '-o', default=None, help='碎片顺序随时间的变化(JSONL)，默认 output/<视频名>_orders.jsonl')
+    parser.add_argument('--save-frames', action='store_true', help='同时保存每次顺序变化时的标注帧')
+    parser.add_argument('--stride', type=int, default=1, help='每隔多少帧检查一次画面')
+    parser.add_argument('--matcher', choices=MATCHERS, default=DEFAULT_MATCHER, help='匹配方式')
+    parser.add_argument('--pyramid-levels', type=pyramid_levels_arg, default=0, help='金字塔层数，auto 表示自动选择')
+    parser.add_argument('--auto-crop', action='store_true', help='录屏未裁剪时自动定位并裁剪拼图区域')
+    parser.add_argument('--profile', default=None, help='记录各阶段耗时并写入该文件(.json 为 Chrome trace，.csv 为表格)')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiler.enable(args.profile)
+
+    name = os.path.splitext(os.path.basename(args.video))[0]
+    output_path = args.output or os.path.join('output', f'{name}_orders.jsonl')
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    ref_dir = None
+    if args.figure_label != 'auto':
+        ref_dir = figure_path(args.ref_root, args.figure_label.zfill(2))
+    frame_dir = os.path.join('output', 'frames') if args.save_frames else None
+
+    count = 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for record in solve_video(args.video, ref_dir, args.ref_root, args.matcher, args.pyramid_levels,
+                                  args.auto_crop, args.stride, frame_dir):
+            count += 1
+            print(f"{record['time_ms'] / 1000:.2f}s (第 {record['frame']} 帧): 碎片顺序 {record['order']}，"
+                  f"还需交换 {len(record['swaps'])} 次")
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+    flush_output()
+    print(f"处理完成！碎片顺序共变化 {count} 次，结果保存至: {output_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
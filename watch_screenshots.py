@@ -0,0 +1,173 @@
+# coding=utf-8
+# @Author    : ssss要加油哦
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import profiler
+from swap_sort import (discover_screenshots, annotate_batch_task, set_saved_queue, collect_saved, MATCHERS,
+                       DEFAULT_MATCHER, pyramid_levels_arg)
+from memory_budget import set_memory_budget, jobs_for_budget
+from output_writer import add_output_arguments, output_options_from_args
+from template_bank import get_template_bank, file_sha1
+
+
+def load_ledger(ledger_path):
+    # 已处理截图的记录，按内容哈希索引；处理失败的截图不记为已完成，重启后会重试
+    done = {}
+    if not os.path.exists(ledger_path):
+        return done
+    with open(ledger_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次退出时可能只写了半行
+                continue
+            if 'error' not in record:
+                done[record['sha1']] = record
+    return done
+
+
+def preload_worker(ref_root, auto_figure, profile=False, budget_mb=None, saved_queue=None):
+    # 子进程启动时预先加载所有图的模板，之后每张截图都直接使用内存中的模板
+    # Ctrl+C 只由主进程处理，子进程把手上的截图处理完再退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if profile:
+        profiler.enable()
+    set_memory_budget(budget_mb)
+    set_saved_queue(saved_queue)
+    from figure_index import discover_figures, get_figure_index
+    for ref_dir in discover_figures(ref_root).values():
+        get_template_bank(ref_dir)
+    if auto_figure:
+        get_figure_index(ref_root)
+
+
+def watch(screenshot_root='screenshot', jobs=None, ref_root='reference_patches', output_root='output',
+          ledger_path=None, matcher=DEFAULT_MATCHER, pyramid_levels=0, auto_figure=False, auto_crop=False,
+          interval=1.0, once=False, use_cache=True, budget_mb=None, output_options=None):
+    if ledger_path is None:
+        ledger_path = os.path.join(output_root, 'ledger.jsonl')
+    os.makedirs(os.path.dirname(ledger_path) or '.', exist_ok=True)
+    done = load_ledger(ledger_path)
+    print(f"开始监视 {screenshot_root}，已处理过 {len(done)} 张截图，按 Ctrl+C 停止")
+
+    # path -> (大小, 修改时间)：两次轮询之间没有变化才认为文件已经写完
+    pending_stats = {}
+    handled_stats = {}
+    in_flight = {}  # future -> (路径, 内容哈希)
+    queued_hashes = set()
+    # 令牌 -> 记录：匹配完但标注图还没保存完，收到保存完成的通知后再写入处理记录
+    # 中途停止时没写入的截图下次启动会重新处理
+    waiting = {}
+    saved_queue = multiprocessing.Queue()
+    processed = 0
+    failed = 0
+    if budget_mb is not None:
+        jobs = jobs_for_budget(budget_mb, jobs)
+        print(f"内存预算: 每个进程 {budget_mb} MB，进程数: {jobs}")
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=preload_worker,
+                                   initargs=(ref_root, auto_figure, profiler.is_enabled(), budget_mb, saved_queue))
+    try:
+        with open(ledger_path, 'a', encoding='utf-8') as ledger:
+            while True:
+                for figure_label, path in discover_screenshots(screenshot_root, auto_figure):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    stat = (st.st_size, st.st_mtime_ns)
+                    if handled_stats.get(path) == stat:
+                        continue
+                    # --once 时不等待文件稳定，直接处理已有的截图
+                    if not once and pending_stats.get(path) != stat:
+                        pending_stats[path] = stat
+                        continue
+                    pending_stats.pop(path, None)
+                    handled_stats[path] = stat
+
+                    sha1 = file_sha1(path)
+                    if sha1 in done or sha1 in queued_hashes:
+                        continue
+                    queued_hashes.add(sha1)
+                    task = (figure_label, path, ref_root, output_root, matcher, pyramid_levels, auto_crop,
+                            use_cache, output_options)
+                    in_flight[executor.submit(annotate_batch_task, task)] = (path, sha1)
+
+                finished = []
+                for future in [f for f in in_flight if f.done()]:
+                    path, sha1 = in_flight.pop(future)
+                    record = future.result()
+                    profiler.add_events(record.pop('trace', []))
+                    record.update({'sha1': sha1, 'time': time.strftime('%Y-%m-%d %H:%M:%S')})
+                    if budget_mb is not None and record.get('peak_rss_mb', 0) > budget_mb:
+                        print(f"超出内存预算: {path} 峰值 {record['peak_rss_mb']:.1f} MB")
+                    token = record.pop('pending_output', None)
+                    if token is None:
+                        finished.append(record)
+                    else:
+                        waiting[token] = record
+                finished.extend(collect_saved(saved_queue, waiting))
+
+                for record in finished:
+                    path, sha1 = record['screenshot'], record['sha1']
+                    queued_hashes.discard(sha1)
+                    if 'error' in record:
+                        failed += 1
+                        print(f"处理失败: {path}: {record['error']}")
+                    else:
+                        processed += 1
+                        done[sha1] = record
+                        print(f"已处理: {path} -> {record['output']}，碎片顺序: {record['order']}")
+                    ledger.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    ledger.flush()
+
+                if once and not in_flight and not waiting:
+                    break
+                time.sleep(0.05 if once else interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    print(f"监视结束，本次处理 {processed} 张截图，失败 {failed} 张，处理记录: {ledger_path}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='监视截图目录，新截图出现时自动标注')
+    parser.add_argument('screenshot_root', nargs='?', default='screenshot')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='进程数，默认为 CPU 核数')
+    parser.add_argument('--ref-root', default='reference_patches')
+    parser.add_argument('--output-root', default='output')
+    parser.add_argument('--ledger', default=None, help='已处理截图的记录(JSONL)，默认 output/ledger.jsonl')
+    parser.add_argument('--matcher', choices=MATCHERS, default=DEFAULT_MATCHER, help='匹配方式')
+    parser.add_argument('--pyramid-levels', type=pyramid_levels_arg, default=0, help='金字塔层数，auto 表示自动选择')
+    parser.add_argument('--auto-figure', action='store_true', help='同时处理直接放在截图目录下的截图，自动识别是第几幅图')
+    parser.add_argument('--auto-crop', action='store_true', help='截图未裁剪时自动定位并裁剪拼图区域')
+    parser.add_argument('--interval', type=float, default=1.0, help='轮询间隔(秒)')
+    parser.add_argument('--once', action='store_true', help='处理完目录中现有的截图后退出')
+    parser.add_argument('--no-cache', action='store_true', help='不读写结果缓存，总是重新匹配')
+    add_output_arguments(parser)
+    parser.add_argument('--memory-budget-mb', type=float, default=None,
+                        help='每个进程的内存预算：截图缩小解码、少缓存模板频谱，并按可用内存限制进程数')
+    parser.add_argument('--profile', default=None, help='记录各阶段耗时并写入该文件(.json 为 Chrome trace，.csv 为表格)')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiler.enable(args.profile)
+    failed = watch(args.screenshot_root, args.jobs, args.ref_root, args.output_root, args.ledger, args.matcher,
+                   args.pyramid_levels, args.auto_figure, args.auto_crop, args.interval, args.once,
+                   not args.no_cache, args.memory_budget_mb, output_options_from_args(args))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())